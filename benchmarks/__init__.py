@@ -0,0 +1,4 @@
+"""
+Benchmarks of the integration API, run through management commands against
+a disposable database.
+"""
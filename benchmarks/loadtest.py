@@ -0,0 +1,491 @@
+"""
+End-to-end load test of the integration API.
+
+`LoadTest` seeds tenants, integrations, and clients enrolled with an email
+device, then has concurrent workers drive the flows of an integration:
+deciding on a client's authentication, challenging it and completing the
+challenge with the token mailed to it, and enrolling a new client. Mail is
+delivered to a local SMTP sink, challenges are dispatched in-process, and
+the latency and throughput of every endpoint are reported.
+
+Seeded entities are named after the run and left in place; run against a
+disposable database.
+"""
+from __future__ import unicode_literals
+
+import base64
+import json
+import logging
+import math
+import platform
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import django
+from django.core.servers.basehttp import WSGIServer, WSGIRequestHandler, \
+    get_internal_wsgi_application
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from six.moves import http_client, socketserver
+from six.moves.urllib.parse import urlparse
+
+from challenge.models import Challenge, ChallengeDispatch
+from contrib.models import Module
+from devices.models import Device, DeviceKind
+from enrollment.models import Enrollment
+from tenants.models import Tenant, Integration, Client
+from .smtp import SMTPSink, SinkMailer
+
+logger = logging.getLogger(__name__)
+
+DEVICE_KIND_NAME = 'Email (benchmark)'
+MESSAGE = 'Your token is {token}'
+TOKEN_PATTERN = re.compile(r'token is (\d+)')
+
+PERCENTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of sorted `values`.
+    """
+    if not values:
+        return None
+
+    return values[max(int(math.ceil(fraction * len(values))) - 1, 0)]
+
+
+def summarize(samples, duration):
+    """
+    Returns the request count, error count, throughput and latency
+    percentiles of every endpoint, from `(endpoint, seconds, ok)` samples
+    taken over `duration` seconds.
+    """
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    for endpoint, seconds, ok in samples:
+        latencies[endpoint].append(seconds)
+        if not ok:
+            errors[endpoint] += 1
+
+    res = OrderedDict()
+    for endpoint in sorted(latencies):
+        values = sorted(latencies[endpoint])
+
+        summary = OrderedDict([
+            ('requests', len(values)),
+            ('errors', errors[endpoint]),
+            ('throughput', len(values) / duration if duration else None),
+            ('mean', sum(values) / len(values)),
+        ])
+        for name, fraction in PERCENTILES:
+            summary[name] = percentile(values, fraction)
+        summary['max'] = values[-1]
+
+        res[endpoint] = summary
+
+    return res
+
+
+class ThreadedWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class LocalServer(object):
+    """
+    Serves the API from a thread of this process. Numbers are only
+    comparable between runs made the same way; point the load test at a
+    gunicorn server for numbers closer to production.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.httpd = ThreadedWSGIServer((host, port), QuietWSGIRequestHandler)
+        self.httpd.set_app(get_internal_wsgi_application())
+
+        # requests are made to `localhost`, which ALLOWED_HOSTS accepts
+        self.url = 'http://localhost:{0}'.format(self.httpd.server_address[1])
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, name='loadtest-server')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+
+class APIClient(object):
+    def __init__(self, url, access_key, secret_key, timeout=30):
+        parsed = urlparse(url)
+
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+        self.authorization = 'Basic {0}'.format(
+            base64.b64encode('{0}:{1}'.format(access_key, secret_key).encode(
+                'utf-8')).decode('ascii'))
+
+    def request(self, method, path, data=None):
+        conn = http_client.HTTPConnection(
+            self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request(method, path,
+                         json.dumps(data) if data is not None else None, {
+                             'Authorization': self.authorization,
+                             'Content-Type': 'application/json',
+                             'Accept': 'application/json',
+                         })
+            res = conn.getresponse()
+            content = res.read()
+        finally:
+            conn.close()
+
+        try:
+            return res.status, json.loads(content) if content else None
+        except ValueError:
+            return res.status, None
+
+
+class FlowError(Exception):
+    pass
+
+
+class LoadTest(object):
+    def __init__(self,
+                 tenants=1,
+                 integrations=1,
+                 clients=10,
+                 concurrency=4,
+                 iterations=10,
+                 url=None,
+                 smtp_host='127.0.0.1',
+                 smtp_port=0,
+                 dispatchers=2,
+                 mail_timeout=10):
+        if clients * integrations * tenants < concurrency:
+            raise ValueError(
+                'at least one seeded client is required per worker')
+
+        self.tenants = tenants
+        self.integrations = integrations
+        self.clients = clients
+        self.concurrency = concurrency
+        self.iterations = iterations
+        self.url = url
+        self.smtp_host = smtp_host
+        self.smtp_port = smtp_port
+        self.dispatchers = dispatchers
+        self.mail_timeout = mail_timeout
+
+        self.run_id = uuid.uuid4().hex[:8]
+        self.sink = None
+
+        self._samples = []
+        self._samples_lock = threading.Lock()
+
+    def get_configuration(self):
+        return OrderedDict([
+            ('tenants', self.tenants),
+            ('integrations', self.integrations),
+            ('clients', self.clients),
+            ('concurrency', self.concurrency),
+            ('iterations', self.iterations),
+            ('dispatchers', self.dispatchers),
+            ('url', self.url),
+        ])
+
+    def get_address(self, username):
+        return '{0}@example.com'.format(username)
+
+    def seed_device_kind(self):
+        # the sink listens on a new port every run
+        Module.objects.update_or_create(
+            name='{0}.{1}'.format(SinkMailer.__module__,
+                                  SinkMailer.__name__),
+            defaults={
+                'configuration': {
+                    'host': self.sink.host,
+                    'port': self.sink.port,
+                    'use_tls': False,
+                    'pool_size': self.concurrency,
+                }
+            })
+
+        kind, _ = DeviceKind.objects.update_or_create(
+            name=DEVICE_KIND_NAME,
+            defaults={
+                'module': 'devices.modules.email.EmailDeviceKindModule',
+                'description': 'Email devices delivering to the benchmark '
+                'SMTP sink',
+                'configuration': {
+                    'from_email': 'benchmark@example.com',
+                    'subject': 'Your token',
+                    'message': MESSAGE,
+                    'communication_module': '{0}.{1}'.format(
+                        SinkMailer.__module__, SinkMailer.__name__),
+                    'communication_module_settings': {},
+                }
+            })
+
+        return kind
+
+    def seed(self, kind):
+        """
+        Returns `(integration, clients)` for every seeded integration, where
+        `clients` are `(username, device pk)` pairs.
+        """
+        res = []
+
+        for i in range(self.tenants):
+            tenant = Tenant.create(
+                name='benchmark-{0}-{1}'.format(self.run_id, i),
+                email='benchmark-{0}-{1}@example.com'.format(self.run_id, i),
+                password=get_random_string(32))
+
+            for j in range(self.integrations):
+                integration = Integration.create(
+                    tenant=tenant,
+                    name='benchmark-{0}-{1}-{2}'.format(self.run_id, i, j),
+                    notes='Load test integration')
+
+                usernames = [
+                    'benchmark-{0}-{1}-{2}-{3}'.format(self.run_id, i, j, k)
+                    for k in range(self.clients)
+                ]
+
+                clients = Client.objects.bulk_create([
+                    Client(
+                        name=x,
+                        integration=integration,
+                        username=x,
+                        email=self.get_address(x)) for x in usernames
+                ])
+
+                enrollments = Enrollment.objects.bulk_create([
+                    Enrollment(
+                        integration=integration,
+                        policy=integration.policy,
+                        client=x,
+                        username=x.username,
+                        status=Enrollment.STATUS_COMPLETE,
+                        expires_at=timezone.now() + timedelta(minutes=5))
+                    for x in clients
+                ])
+
+                devices = Device.objects.bulk_create([
+                    Device(
+                        name='Email [@example.com]',
+                        kind=kind,
+                        client=x,
+                        enrollment=y,
+                        details={'address': self.get_address(x.username)})
+                    for x, y in zip(clients, enrollments)
+                ])
+
+                res.append((integration, [(x.username, y.pk)
+                                          for x, y in zip(clients, devices)]))
+
+        return res
+
+    def record(self, endpoint, seconds, ok):
+        with self._samples_lock:
+            self._samples.append((endpoint, seconds, ok))
+
+    def call(self, api, endpoint, path, data, expected_status, method='POST'):
+        started_at = time.time()
+        try:
+            status, res = api.request(method, path, data)
+        except (http_client.HTTPException, IOError) as e:
+            self.record(endpoint, time.time() - started_at, False)
+            raise FlowError('{0} failed: {1}'.format(endpoint, e))
+
+        ok = status == expected_status
+        self.record(endpoint, time.time() - started_at, ok)
+
+        if not ok:
+            raise FlowError('{0} returned `{1}`: {2}'.format(
+                endpoint, status, res))
+
+        return res
+
+    def wait_for_token(self, endpoint, username):
+        started_at = time.time()
+        body = self.sink.wait_for(
+            self.get_address(username), self.mail_timeout)
+        match = TOKEN_PATTERN.search(body or '')
+
+        self.record(endpoint, time.time() - started_at, bool(match))
+        if not match:
+            raise FlowError('no token was mailed to `{0}`'.format(username))
+
+        return match.group(1)
+
+    def challenge_flow(self, api, username, device_pk):
+        self.call(api, 'client-auth',
+                  reverse('client-auth'), {'username': username}, 200)
+
+        challenge = self.call(api, 'challenge-list',
+                              reverse('challenge-list'), {
+                                  'username': username,
+                                  'device_pk': device_pk
+                              }, 201)
+
+        token = self.wait_for_token('challenge-delivery', username)
+
+        # the token is mailed before the dispatch commits, so it may arrive
+        # while the challenge is still new
+        deadline = time.time() + self.mail_timeout
+        while self.call(
+                api,
+                'challenge-detail',
+                reverse('challenge-detail', kwargs={'pk': challenge['pk']}),
+                None,
+                200,
+                method='GET')['status'] == Challenge.STATUS_NEW:
+            if time.time() > deadline:
+                raise FlowError('challenge `{0}` was never dispatched'.format(
+                    challenge['pk']))
+            time.sleep(0.01)
+
+        self.call(api, 'challenge-complete',
+                  reverse(
+                      'challenge-complete', kwargs={'pk': challenge['pk']}),
+                  {'token': token}, 200)
+
+    def enrollment_flow(self, api, username, kind):
+        enrollment = self.call(api, 'enrollment-list',
+                               reverse('enrollment-list'),
+                               {'username': username}, 201)
+
+        self.call(api, 'enrollment-detail-prepare-device',
+                  reverse(
+                      'enrollment-detail-prepare-device',
+                      kwargs={'pk': enrollment['pk']}), {
+                          'kind': kind.pk,
+                          'options': {
+                              'address': self.get_address(username)
+                          }
+                      }, 200)
+
+        token = self.wait_for_token('enrollment-delivery', username)
+
+        self.call(api, 'enrollment-complete',
+                  reverse(
+                      'enrollment-complete', kwargs={'pk': enrollment['pk']}),
+                  {'token': token}, 201)
+
+    def work(self, worker, clients, kind, url):
+        completed = failed = 0
+
+        for i in range(self.iterations):
+            # every client belongs to a single worker, so that the mail
+            # sent to it is never picked up by another
+            integration, username, device_pk = clients[i % len(clients)]
+            api = APIClient(url, integration.access_key,
+                            integration.secret_key)
+
+            for flow, args in (
+                (self.challenge_flow, (username, device_pk)),
+                (self.enrollment_flow,
+                 ('benchmark-{0}-enroll-{1}-{2}'.format(
+                     self.run_id, worker, i), kind)), ):
+                try:
+                    flow(api, *args)
+                    completed += 1
+                except FlowError as e:
+                    logger.warning('load test flow failed: {0}'.format(e))
+                    failed += 1
+
+        return completed, failed
+
+    def dispatch(self, stop):
+        try:
+            while not stop.is_set():
+                if not ChallengeDispatch.drain():
+                    stop.wait(0.05)
+        finally:
+            connection.close()
+
+    def run(self):
+        started_at = timezone.now()
+
+        self.sink = SMTPSink(self.smtp_host, self.smtp_port)
+        self.sink.start()
+
+        server = None
+        url = self.url
+        if not url:
+            server = LocalServer()
+            server.start()
+            url = server.url
+
+        stop = threading.Event()
+        dispatchers = [
+            threading.Thread(target=self.dispatch, args=(stop, ))
+            for _ in range(self.dispatchers)
+        ]
+
+        try:
+            kind = self.seed_device_kind()
+
+            clients = [(integration, username, device_pk)
+                       for integration, entries in self.seed(kind)
+                       for username, device_pk in entries]
+
+            for thread in dispatchers:
+                thread.start()
+
+            run_started_at = time.time()
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                results = list(
+                    executor.map(lambda x: self.work(
+                        x, clients[x::self.concurrency], kind, url),
+                                 range(self.concurrency)))
+            duration = time.time() - run_started_at
+        finally:
+            stop.set()
+            for thread in dispatchers:
+                if thread.is_alive():
+                    thread.join()
+
+            if server is not None:
+                server.stop()
+            self.sink.stop()
+
+        completed = sum(x[0] for x in results)
+
+        return OrderedDict([
+            ('run_id', self.run_id),
+            ('started_at', started_at.isoformat()),
+            ('duration_seconds', duration),
+            ('configuration', self.get_configuration()),
+            ('environment', OrderedDict([
+                ('python', platform.python_version()),
+                ('django', django.get_version()),
+                ('database', connection.vendor),
+                ('local_server', server is not None),
+            ])),
+            ('flows', OrderedDict([
+                ('completed', completed),
+                ('failed', sum(x[1] for x in results)),
+                ('throughput', completed / duration if duration else None),
+            ])),
+            ('endpoints', summarize(self._samples, duration)),
+        ])
@@ -0,0 +1,271 @@
+"""
+Micro-benchmarks of the device module paths that are most often changed.
+
+Benchmarks only exercise pure CPU paths: devices, challenges and device kinds
+are left unsaved, and policies are given their configuration rather than
+loading it, so that the database plays no part in the timings; nor does the
+terminal, as info logs are disabled. Every benchmark is timed over rounds of
+as many calls as fit a minimum duration, keeping the per-call time of each
+round.
+
+Runs are appended to a JSON history, along with the revision they were run
+against, and the median of every benchmark is compared to the median of its
+recent runs.
+"""
+from __future__ import unicode_literals
+
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import timeit
+from collections import OrderedDict
+
+from django.utils import timezone
+
+from challenge.models import Challenge
+from devices.models import Device, DeviceKind
+from devices.modules.base import DeviceKindModule
+from devices.modules.email import EmailDeviceKindModule
+from devices.modules.otp import OTPConfiguration, OTPDeviceDetails, \
+    OTPDeviceKindModule
+from policy.models import Configuration, PolicySnapshot
+
+DEFAULT_ROUNDS = 10
+DEFAULT_MIN_TIME = 0.1
+DEFAULT_WINDOW = 5
+
+OTP_SECRET = 'JBSWY3DPEHPK3PXPJBSWY3DPEHPK3PXP'
+OTP_PROVISIONING_URI = 'otpauth://totp/oss2fa:john.doe%40email.com' \
+    '?secret={0}&issuer=oss2fa'.format(OTP_SECRET)
+
+OTP_CONFIGURATION = {
+    'issuer_name': OTPConfiguration.DEFAULT_ISSUER,
+    'digits': OTPConfiguration.DEFAULT_DIGITS,
+    'interval': OTPConfiguration.DEFAULT_INTERVAL,
+    'algorithm': OTPConfiguration.ALGORITHM_SHA1,
+    'secret_length': OTPConfiguration.DEFAULT_SECRET_LENGTH,
+    'valid_window': OTPConfiguration.DEFAULT_VALID_WINDOW,
+}
+
+OTP_DEVICE_DETAILS = {
+    'issuer_name': OTPConfiguration.DEFAULT_ISSUER,
+    'digits': OTPConfiguration.DEFAULT_DIGITS,
+    'interval': OTPConfiguration.DEFAULT_INTERVAL,
+    'algorithm': OTPConfiguration.ALGORITHM_SHA1,
+    'secret': OTP_SECRET,
+    'valid_window': OTPConfiguration.DEFAULT_VALID_WINDOW,
+}
+
+EMAIL_CONFIGURATION = {
+    'from_email': 'oss2fa@email.com',
+    'subject': 'Your token',
+    'message': 'Your token is {token}',
+    'html_message': '<p>Your token is <strong>{token}</strong></p>',
+    'communication_module': 'contrib.communications.DjangoSMTPMailer',
+    'communication_module_settings': {},
+}
+
+# benchmark name -> function returning the callable to time
+_benchmarks = OrderedDict()
+
+
+def benchmark(name):
+    def decorator(setup):
+        _benchmarks[name] = setup
+        return setup
+
+    return decorator
+
+
+def get_benchmark_names():
+    return list(_benchmarks)
+
+
+class StaticPolicy(object):
+    """
+    A policy with the given configurations, rather than those of a policy
+    loaded from the database.
+    """
+
+    def __init__(self, configurations):
+        self._snapshot = PolicySnapshot(
+            rules=[], configurations=configurations)
+
+    def get_configuration(self, kind):
+        return self._snapshot.get_configuration(kind)
+
+
+@benchmark('build_model_instance')
+def build_model_instance():
+    return lambda: DeviceKindModule.build_model_instance(
+        OTPDeviceDetails, OTP_DEVICE_DETAILS)
+
+
+@benchmark('otp_challenge_complete')
+def otp_challenge_complete():
+    kind = DeviceKind(
+        module='devices.modules.otp.OTPDeviceKindModule',
+        configuration=OTP_CONFIGURATION)
+    device = Device(
+        pk=1,
+        kind=kind,
+        details=OTP_DEVICE_DETAILS,
+        last_updated_at=timezone.now())
+    challenge = Challenge(
+        pk=1, device=device, status=Challenge.STATUS_IN_PROGRESS)
+
+    module = kind.get_module()
+
+    # a token that never matches computes every candidate, as a valid one
+    # does, without being claimed from the replay guard's cache
+    data = {'token': 'invalid'}
+
+    return lambda: module.challenge_complete(challenge, data)
+
+
+@benchmark('otp_generate_qr_code')
+def otp_generate_qr_code():
+    return lambda: OTPDeviceKindModule.generate_qr_code(OTP_PROVISIONING_URI)
+
+
+@benchmark('generate_secure_token')
+def generate_secure_token():
+    policy = StaticPolicy([(Configuration.KIND_TOKEN_LENGTH, 6)])
+    return lambda: DeviceKindModule.generate_secure_token(policy)
+
+
+@benchmark('email_format_message')
+def email_format_message():
+    return lambda: EmailDeviceKindModule.format_message(
+        'john.doe@email.com', '123456', EMAIL_CONFIGURATION)
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def summarize(timings, iterations):
+    mean = sum(timings) / len(timings)
+
+    return OrderedDict([
+        ('min', min(timings)),
+        ('max', max(timings)),
+        ('mean', mean),
+        ('median', median(timings)),
+        ('stddev', math.sqrt(
+            sum((x - mean)**2 for x in timings) / len(timings))),
+        ('rounds', len(timings)),
+        ('iterations', iterations),
+    ])
+
+
+def measure(func, rounds=DEFAULT_ROUNDS, min_time=DEFAULT_MIN_TIME):
+    """
+    Returns statistics of the seconds taken per call to `func`, over
+    `rounds` rounds of as many calls as take at least `min_time` seconds.
+    """
+    timer = timeit.Timer(func)
+
+    # calibrate the calls per round, which also warms up caches
+    iterations = 1
+    while True:
+        elapsed = timer.timeit(iterations)
+        if elapsed >= min_time:
+            break
+
+        iterations = iterations * 10 if elapsed < min_time / 10 else \
+            int(math.ceil(iterations * min_time / elapsed))
+
+    return summarize([x / iterations
+                      for x in timer.repeat(rounds, iterations)], iterations)
+
+
+def run(names=None, rounds=DEFAULT_ROUNDS, min_time=DEFAULT_MIN_TIME):
+    results = OrderedDict()
+
+    logging.disable(logging.INFO)
+    try:
+        for name in names or get_benchmark_names():
+            results[name] = measure(_benchmarks[name](), rounds, min_time)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    return results
+
+
+def get_revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=devnull).strip().decode('ascii')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_history(path, history):
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=2)
+
+
+def record(history, results):
+    history.append({
+        'timestamp': timezone.now().isoformat(),
+        'revision': get_revision(),
+        'python': platform.python_version(),
+        'results': results,
+    })
+
+    return history
+
+
+def get_baseline(history, name, window=DEFAULT_WINDOW):
+    """
+    Returns the median of the medians of the last `window` runs of the
+    benchmark `name`, or None if it was never run.
+    """
+    medians = [x['results'][name]['median']
+               for x in history if name in x['results']][-window:]
+
+    return median(medians) if medians else None
+
+
+def compare(results, history, threshold, window=DEFAULT_WINDOW):
+    """
+    Compares `results` to the runs in `history`, returning the baseline
+    and relative change of every benchmark, and whether it regressed by
+    more than `threshold`.
+    """
+    comparison = OrderedDict()
+    for name, stats in results.items():
+        baseline = get_baseline(history, name, window)
+        change = stats['median'] / baseline - 1 if baseline else None
+
+        comparison[name] = {
+            'baseline': baseline,
+            'change': change,
+            'regression': change is not None and change > threshold,
+        }
+
+    return comparison
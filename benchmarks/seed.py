@@ -0,0 +1,386 @@
+"""
+Synthetic data for capacity testing.
+
+`Seeder` generates clients, along with their enrollments, devices and
+challenges, spread over a window of days with roughly the status and age
+mix of a production deployment. Chunks of clients are generated by a pool
+of worker processes. Rows whose ids are needed are inserted with
+`bulk_create`; challenges, which are the bulk of the rows, are streamed
+with COPY.
+
+Seeded entities are named after the run and left in place; seed a
+disposable database.
+"""
+from __future__ import unicode_literals
+
+import base64
+import io
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from multiprocessing import Pool
+
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from challenge import partitions
+from challenge.models import Challenge
+from devices.models import Device, DeviceKind
+from devices.modules.otp import OTPConfiguration
+from enrollment.models import Enrollment
+from tenants.models import Tenant, Integration, Client
+
+CLIENT_STATUS_WEIGHTS = ((Client.STATUS_ACTIVE, 95),
+                         (Client.STATUS_BYPASS, 3),
+                         (Client.STATUS_INACTIVE, 2), )
+
+CHALLENGE_STATUS_WEIGHTS = ((Challenge.STATUS_COMPLETE, 85),
+                            (Challenge.STATUS_FAILED, 10),
+                            (Challenge.STATUS_EXPIRED, 5), )
+
+ABANDONED_ENROLLMENT_STATUS_WEIGHTS = ((Enrollment.STATUS_EXPIRED, 70),
+                                       (Enrollment.STATUS_FAILED, 30), )
+
+# share of clients using an OTP rather than an email device
+OTP_DEVICE_RATIO = 0.7
+
+SEEDED_MODELS = (Client, Enrollment, Device, Challenge)
+
+# models inserted through the ORM, rather than copied
+BULK_CREATED_MODELS = (Client, Enrollment, Device)
+
+
+def choose(rng, weights):
+    value = rng.uniform(0, sum(x[1] for x in weights))
+    for choice, weight in weights:
+        value -= weight
+        if value <= 0:
+            return choice
+
+    return weights[-1][0]
+
+
+def scale(delta, factor):
+    return timedelta(seconds=delta.total_seconds() * factor)
+
+
+def get_recent(rng, since, now):
+    # activity is skewed towards the recent end of the window
+    return since + scale(now - since, 1 - rng.random()**2)
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Lets `created_at` and `last_updated_at` be set on new rows, rather than
+    set to the current time.
+    """
+    fields = [
+        (f, f.auto_now, f.auto_now_add) for model in models
+        for f in model._meta.concrete_fields
+        if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)
+    ]
+
+    for f, _, _ in fields:
+        f.auto_now = f.auto_now_add = False
+
+    try:
+        yield
+    finally:
+        for f, auto_now, auto_now_add in fields:
+            f.auto_now = auto_now
+            f.auto_now_add = auto_now_add
+
+
+def _format_copy_value(value):
+    if value is None:
+        return '\\N'
+
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+
+    value = value.isoformat() if hasattr(value, 'isoformat') else \
+        '{0}'.format(value)
+
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace(
+        '\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(cursor, model, fields, rows, batch_size):
+    """
+    Streams `rows`, tuples of values for `fields`, into the table of
+    `model` with COPY, `batch_size` rows at a time.
+    """
+    sql = 'COPY {0} ({1}) FROM STDIN'.format(
+        model._meta.db_table,
+        ', '.join(model._meta.get_field(x).column for x in fields))
+
+    for start in range(0, len(rows), batch_size):
+        data = io.BytesIO('\n'.join(
+            '\t'.join(_format_copy_value(x) for x in row)
+            for row in rows[start:start + batch_size]).encode('utf-8') + b'\n')
+        cursor.copy_expert(sql, data)
+
+
+def seed_chunk(task):
+    """
+    Seeds a chunk of clients of an integration, returning the number of rows
+    created per model.
+    """
+    rng = random.Random(task['seed'])
+    now = timezone.now()
+    window = timedelta(days=task['days'])
+    expiration = timedelta(minutes=Challenge.DEFAULT_EXPIRATION_IN_MINUTES)
+
+    clients = []
+    for i in range(task['first'], task['first'] + task['count']):
+        username = '{0}-{1}'.format(task['prefix'], i)
+        created_at = now - scale(window, rng.random())
+
+        clients.append(
+            Client(
+                name=username,
+                integration_id=task['integration_pk'],
+                username=username,
+                email='{0}@example.com'.format(username),
+                status=choose(rng, CLIENT_STATUS_WEIGHTS),
+                created_at=created_at,
+                last_updated_at=created_at))
+
+    with explicit_timestamps(*BULK_CREATED_MODELS), transaction.atomic():
+        Client.objects.bulk_create(clients, batch_size=task['batch_size'])
+
+        enrollments = []
+        for client in clients:
+            started_at = client.created_at - timedelta(
+                seconds=rng.uniform(10, 300))
+
+            enrollments.append(
+                Enrollment(
+                    integration_id=task['integration_pk'],
+                    policy_id=task['policy_pk'],
+                    client=client,
+                    username=client.username,
+                    status=Enrollment.STATUS_COMPLETE,
+                    expires_at=started_at + expiration,
+                    created_at=started_at,
+                    last_updated_at=client.created_at))
+
+        # some enrollments are never completed, and leave no client behind
+        abandoned = []
+        for client in clients:
+            if rng.random() >= task['abandoned_ratio']:
+                continue
+
+            started_at = get_recent(rng, now - window, now)
+            abandoned.append(
+                Enrollment(
+                    integration_id=task['integration_pk'],
+                    policy_id=task['policy_pk'],
+                    username='{0}-abandoned'.format(client.username),
+                    status=choose(rng, ABANDONED_ENROLLMENT_STATUS_WEIGHTS),
+                    expires_at=started_at + expiration,
+                    created_at=started_at,
+                    last_updated_at=started_at + expiration))
+
+        Enrollment.objects.bulk_create(
+            enrollments + abandoned, batch_size=task['batch_size'])
+
+        devices = []
+        for client, enrollment in zip(clients, enrollments):
+            if rng.random() < OTP_DEVICE_RATIO:
+                kind_pk = task['otp_kind_pk']
+                details = {
+                    'issuer_name': OTPConfiguration.DEFAULT_ISSUER,
+                    'digits': OTPConfiguration.DEFAULT_DIGITS,
+                    'interval': OTPConfiguration.DEFAULT_INTERVAL,
+                    'algorithm': OTPConfiguration.ALGORITHM_SHA1,
+                    'secret': base64.b32encode(os.urandom(20)).decode(
+                        'ascii'),
+                    'valid_window': OTPConfiguration.DEFAULT_VALID_WINDOW,
+                }
+            else:
+                kind_pk = task['email_kind_pk']
+                details = {'address': client.email}
+
+            devices.append(
+                Device(
+                    name='Device [{0}]'.format(client.username),
+                    kind_id=kind_pk,
+                    client=client,
+                    enrollment=enrollment,
+                    details=details,
+                    created_at=client.created_at,
+                    last_updated_at=client.created_at))
+
+        Device.objects.bulk_create(devices, batch_size=task['batch_size'])
+
+        challenges = []
+        for client, device in zip(clients, devices):
+            count = int(rng.expovariate(1.0 / task['challenges_per_client'])
+                        ) if task['challenges_per_client'] else 0
+
+            for _ in range(count):
+                created_at = get_recent(rng, client.created_at, now)
+                expires_at = created_at + expiration
+
+                challenges.append(
+                    ('', True, client.pk, device.pk, task['policy_pk'],
+                     Challenge.STATUS_IN_PROGRESS if expires_at > now else
+                     choose(rng, CHALLENGE_STATUS_WEIGHTS), expires_at,
+                     created_at, min(expires_at, now)))
+
+        with connection.cursor() as cursor:
+            copy_rows(cursor, Challenge,
+                      ('name', 'active', 'client', 'device', 'policy',
+                       'status', 'expires_at', 'created_at',
+                       'last_updated_at'), challenges, task['batch_size'])
+
+    return {
+        Client: len(clients),
+        Enrollment: len(enrollments) + len(abandoned),
+        Device: len(devices),
+        Challenge: len(challenges),
+    }
+
+
+class Seeder(object):
+    DEFAULT_CHUNK_SIZE = 1000
+    DEFAULT_BATCH_SIZE = 1000
+
+    def __init__(self,
+                 clients,
+                 tenants=1,
+                 integrations=1,
+                 challenges_per_client=20,
+                 abandoned_ratio=0.1,
+                 days=365,
+                 chunk_size=DEFAULT_CHUNK_SIZE,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 workers=4,
+                 seed=None):
+        self.clients = clients
+        self.tenants = tenants
+        self.integrations = integrations
+        self.challenges_per_client = challenges_per_client
+        self.abandoned_ratio = abandoned_ratio
+        self.days = days
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.workers = workers
+        self.seed = seed
+
+        self.run_id = uuid.uuid4().hex[:8]
+
+    def get_device_kinds(self):
+        otp_kind, _ = DeviceKind.objects.get_or_create(
+            name='OTP (seed)',
+            defaults={
+                'module': 'devices.modules.otp.OTPDeviceKindModule',
+                'description': 'OTP devices of seeded clients',
+                'configuration': {
+                    'issuer_name': OTPConfiguration.DEFAULT_ISSUER,
+                    'digits': OTPConfiguration.DEFAULT_DIGITS,
+                    'algorithm': OTPConfiguration.ALGORITHM_SHA1,
+                    'secret_length': OTPConfiguration.DEFAULT_SECRET_LENGTH,
+                    'valid_window': OTPConfiguration.DEFAULT_VALID_WINDOW,
+                    'interval': OTPConfiguration.DEFAULT_INTERVAL,
+                }
+            })
+
+        email_kind, _ = DeviceKind.objects.get_or_create(
+            name='Email (seed)',
+            defaults={
+                'module': 'devices.modules.email.EmailDeviceKindModule',
+                'description': 'Email devices of seeded clients',
+                'configuration': {
+                    'from_email': 'seed@example.com',
+                    'subject': 'Your token',
+                    'message': 'Your token is {token}',
+                    'communication_module':
+                    'contrib.communications.DjangoSMTPMailer',
+                    'communication_module_settings': {},
+                }
+            })
+
+        return otp_kind, email_kind
+
+    def get_tasks(self):
+        """
+        Creates the tenants and integrations clients are seeded for, and
+        returns the chunks to seed.
+        """
+        otp_kind, email_kind = self.get_device_kinds()
+        rng = random.Random(self.seed)
+
+        integrations = []
+        for i in range(self.tenants):
+            tenant = Tenant.create(
+                name='seed-{0}-{1}'.format(self.run_id, i),
+                email='seed-{0}-{1}@example.com'.format(self.run_id, i),
+                password=get_random_string(32))
+
+            for j in range(self.integrations):
+                integrations.append(
+                    Integration.create(
+                        tenant=tenant,
+                        name='seed-{0}-{1}-{2}'.format(self.run_id, i, j),
+                        notes='Seeded integration'))
+
+        tasks = []
+        for i, integration in enumerate(integrations):
+            # spread the remainder over the first integrations
+            count = self.clients // len(integrations) + (
+                1 if i < self.clients % len(integrations) else 0)
+
+            for first in range(0, count, self.chunk_size):
+                tasks.append({
+                    'integration_pk': integration.pk,
+                    'policy_pk': integration.policy_id,
+                    'otp_kind_pk': otp_kind.pk,
+                    'email_kind_pk': email_kind.pk,
+                    'prefix': integration.name,
+                    'first': first,
+                    'count': min(self.chunk_size, count - first),
+                    'days': self.days,
+                    'challenges_per_client': self.challenges_per_client,
+                    'abandoned_ratio': self.abandoned_ratio,
+                    'batch_size': self.batch_size,
+                    'seed': rng.random(),
+                })
+
+        return tasks
+
+    def run(self, progress=None):
+        """
+        Seeds every chunk, calling `progress` with the running row counts
+        and elapsed seconds as chunks complete, and returns the same.
+        """
+        # seeded challenges must not pile up in the default partition
+        partitions.ensure_partitions(
+            since=timezone.now() - timedelta(days=self.days))
+
+        tasks = self.get_tasks()
+        totals = dict((model, 0) for model in SEEDED_MODELS)
+        started_at = time.time()
+
+        # workers must not share the connections of this process
+        connections.close_all()
+
+        pool = Pool(self.workers)
+        try:
+            for counts in pool.imap_unordered(seed_chunk, tasks):
+                for model, count in counts.items():
+                    totals[model] += count
+
+                if progress:
+                    progress(totals, time.time() - started_at)
+        finally:
+            pool.close()
+            pool.join()
+
+        return totals, time.time() - started_at
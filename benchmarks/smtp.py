@@ -0,0 +1,78 @@
+from __future__ import unicode_literals
+
+import asyncore
+import email
+import smtpd
+import threading
+import time
+from collections import defaultdict
+
+from contrib.communications import DjangoSMTPMailer
+
+
+class SinkMailer(DjangoSMTPMailer):
+    """
+    The mailer of benchmark device kinds, registered as a communication
+    module of its own so that the real mailer's configuration is untouched.
+    """
+
+
+class SMTPSink(smtpd.SMTPServer):
+    """
+    A local SMTP server that keeps the messages it receives, by recipient,
+    until they are waited for.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        smtpd.SMTPServer.__init__(self, (host, port), None)
+        self.host, self.port = self.socket.getsockname()[:2]
+
+        self._messages = defaultdict(list)
+        self._condition = threading.Condition()
+        self._thread = None
+        self.received = 0
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        message = email.message_from_string(data)
+        if message.is_multipart():
+            message = message.get_payload(0)
+
+        body = message.get_payload(decode=True).decode('utf-8')
+
+        with self._condition:
+            for recipient in rcpttos:
+                self._messages[recipient.lower()].append(body)
+            self.received += 1
+            self._condition.notify_all()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=asyncore.loop,
+            kwargs={'timeout': 0.1,
+                    'use_poll': True},
+            name='smtp-sink')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        # closing every channel ends the loop
+        asyncore.close_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def wait_for(self, recipient, timeout):
+        """
+        Returns the body of the oldest message not yet waited for that was
+        sent to `recipient`, or None once `timeout` passes.
+        """
+        deadline = time.time() + timeout
+
+        with self._condition:
+            messages = self._messages[recipient.lower()]
+            while not messages:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+            return messages.pop(0)
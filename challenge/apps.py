@@ -7,4 +7,4 @@ class ChallengeConfig(AppConfig):
     name = 'challenge'
 
     def ready(self):
-        pass
+        from . import signals  # noqa
@@ -0,0 +1,86 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from challenge.models import ChallengeDispatch
+from devices.registry import module_registry
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Drain the challenge outbox, performing queued challenges'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='number of concurrent workers draining the outbox')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=ChallengeDispatch.DEFAULT_BATCH_SIZE,
+            help='number of outbox entries claimed by a worker at a time')
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='seconds to wait before polling an empty outbox again')
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='exit once the outbox is empty')
+
+    def _work(self, stop, options):
+        processed = 0
+
+        try:
+            while not stop.is_set():
+                count = ChallengeDispatch.drain(options['batch_size'])
+                processed += count
+
+                if count:
+                    continue
+
+                if options['once']:
+                    break
+
+                stop.wait(options['poll_interval'])
+        finally:
+            # each worker thread owns its database connection
+            connection.close()
+
+        return processed
+
+    def handle(self, *args, **options):
+        module_registry.warm()
+
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=options['workers'])
+
+        logger.info('draining challenge outbox with `{0}` workers'.format(
+            options['workers']))
+
+        futures = [
+            executor.submit(self._work, stop, options)
+            for _ in range(options['workers'])
+        ]
+
+        try:
+            # wait with a timeout, so that the main thread stays responsive
+            # to keyboard interrupts
+            while not all(f.done() for f in futures):
+                stop.wait(1)
+        except KeyboardInterrupt:
+            stop.set()
+        finally:
+            executor.shutdown(wait=True)
+
+        processed = sum(f.result() for f in futures if not f.exception())
+        self.stdout.write(
+            self.style.SUCCESS(
+                'dispatched `{0}` challenges'.format(processed)))
@@ -0,0 +1,60 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from challenge import partitions
+
+
+class Command(BaseCommand):
+    help = ('Create the monthly challenge partitions ahead of time, and detach '
+            'or drop old ones')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=settings.MFA_CHALLENGE_PARTITIONS_AHEAD,
+            help='number of months to create partitions ahead for')
+        parser.add_argument(
+            '--detach-older-than',
+            type=int,
+            default=None,
+            help='detach partitions holding only challenges older than this '
+            'many days')
+        parser.add_argument(
+            '--drop',
+            action='store_true',
+            help='drop detached partitions, rather than keeping them as '
+            'standalone tables')
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=None,
+            help='keep maintaining partitions, every this many seconds')
+
+    def maintain(self, options):
+        for name in partitions.ensure_partitions(options['months_ahead']):
+            self.stdout.write('created partition `{0}`'.format(name))
+
+        if options['detach_older_than'] is None:
+            return
+
+        for name in partitions.detach_partitions(
+                timezone.now() - timedelta(days=options['detach_older_than']),
+                drop=options['drop']):
+            self.stdout.write('{0} partition `{1}`'.format(
+                'dropped' if options['drop'] else 'detached', name))
+
+    def handle(self, *args, **options):
+        if not partitions.is_supported():
+            self.stderr.write('challenge partitioning requires postgres 11')
+            return
+
+        self.maintain(options)
+
+        while options['interval'] is not None:
+            time.sleep(options['interval'])
+            self.maintain(options)
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 00:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('challenge', '0002_auto_20170826_2332'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChallengeDispatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('challenge', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dispatch_entry', to='challenge.Challenge')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='challengedispatch',
+            index=models.Index(fields=['available_at'], name='challenge_c_availab_4ba0f8_idx'),
+        ),
+    ]
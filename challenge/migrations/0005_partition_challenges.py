@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+from challenge import partitions
+
+logger = logging.getLogger(__name__)
+
+TABLE = partitions.TABLE
+REBUILT_TABLE = TABLE + '_rebuilt'
+
+
+def get_definitions(cursor):
+    """
+    Returns the secondary index and foreign key definitions of the challenge
+    table, along with the name of its `binding_context` uniqueness
+    constraint (or index, once partitioned).
+    """
+    cursor.execute(
+        'SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND '
+        'indexname NOT IN (SELECT conname FROM pg_constraint '
+        'WHERE conrelid = %s::regclass)', [TABLE, TABLE])
+    indexes = cursor.fetchall()
+
+    cursor.execute(
+        'SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint '
+        'WHERE conrelid = %s::regclass AND contype = %s', [TABLE, 'f'])
+    foreign_keys = cursor.fetchall()
+
+    cursor.execute(
+        'SELECT conname FROM pg_constraint '
+        'WHERE conrelid = %s::regclass AND contype = %s', [TABLE, 'u'])
+    row = cursor.fetchone()
+
+    if row is not None:
+        binding_context = row[0]
+    else:
+        binding_context, = [
+            name for name, definition in indexes
+            if '(binding_context_id)' in definition
+        ]
+        indexes = [x for x in indexes if x[0] != binding_context]
+
+    return indexes, foreign_keys, binding_context
+
+
+def rebuild(cursor, partition_by, primary_key, create_partitions):
+    indexes, foreign_keys, binding_context = get_definitions(cursor)
+
+    cursor.execute('ALTER TABLE {0} RENAME TO {1}'.format(TABLE, REBUILT_TABLE))
+    cursor.execute('CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS) {2}'.format(
+        TABLE, REBUILT_TABLE, partition_by))
+
+    create_partitions(cursor)
+
+    cursor.execute('INSERT INTO {0} SELECT * FROM {1}'.format(
+        TABLE, REBUILT_TABLE))
+    cursor.execute('ALTER SEQUENCE {0}_id_seq OWNED BY {0}.id'.format(TABLE))
+    cursor.execute('DROP TABLE {0}'.format(REBUILT_TABLE))
+
+    cursor.execute('ALTER TABLE {0} ADD CONSTRAINT {0}_pkey PRIMARY KEY ({1})'.
+                   format(TABLE, primary_key))
+
+    for name, definition in indexes:
+        # indexes of a partitioned table are defined on it `ONLY`
+        cursor.execute(definition.replace(' ON ONLY ', ' ON '))
+
+    for name, definition in foreign_keys:
+        cursor.execute('ALTER TABLE {0} ADD CONSTRAINT {1} {2}'.format(
+            TABLE, name, definition))
+
+    return binding_context
+
+
+def partition_challenges(apps, schema_editor):
+    if not partitions.is_supported(schema_editor.connection):
+        logger.warning('not partitioning challenges, as postgres 11 or newer '
+                       'is required')
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT min(created_at) FROM {0}'.format(TABLE))
+        first = partitions.get_month_start(cursor.fetchone()[0] or
+                                           timezone.now())
+        last = partitions.add_months(
+            partitions.get_month_start(timezone.now()),
+            settings.MFA_CHALLENGE_PARTITIONS_AHEAD)
+
+        def create_partitions(cursor):
+            cursor.execute('CREATE TABLE {0} PARTITION OF {1} DEFAULT'.format(
+                partitions.DEFAULT_PARTITION, TABLE))
+
+            start = first
+            while start <= last:
+                partitions.create_partition(cursor, start)
+                start = partitions.add_months(start, 1)
+
+        # unique constraints must include the partition key, so the one on
+        # `binding_context` is demoted to a plain index
+        binding_context = rebuild(cursor, 'PARTITION BY RANGE (created_at)',
+                                  'id, created_at', create_partitions)
+        cursor.execute('CREATE INDEX {0} ON {1} (binding_context_id)'.format(
+            binding_context, TABLE))
+
+
+def unpartition_challenges(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if not partitions.is_partitioned(cursor):
+            return
+
+        binding_context = rebuild(cursor, '', 'id', lambda cursor: None)
+        cursor.execute('ALTER TABLE {0} ADD CONSTRAINT {1} UNIQUE '
+                       '(binding_context_id)'.format(TABLE, binding_context))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('challenge', '0004_auto_20261018_0103'),
+    ]
+
+    operations = [
+        # the primary key of a partitioned table includes its partition key,
+        # so challenges can no longer be referenced by id alone
+        migrations.AlterField(
+            model_name='challengedispatch',
+            name='challenge',
+            field=models.OneToOneField(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name='dispatch_entry',
+                to='challenge.Challenge'),
+        ),
+        migrations.RunPython(partition_challenges, unpartition_challenges),
+    ]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from challenge import partitions
+
+TABLE = partitions.TABLE
+
+
+def get_unique_constraint(cursor):
+    cursor.execute(
+        'SELECT conname FROM pg_constraint '
+        'WHERE conrelid = %s::regclass AND contype = %s', [TABLE, 'u'])
+    row = cursor.fetchone()
+    return row[0] if row is not None else None
+
+
+def demote_unique_constraint(apps, schema_editor):
+    # partitioning already demoted the constraint to a plain index; it is
+    # only left on tables that could not be partitioned
+    with schema_editor.connection.cursor() as cursor:
+        name = get_unique_constraint(cursor)
+        if name is None:
+            return
+
+        cursor.execute('ALTER TABLE {0} DROP CONSTRAINT {1}'.format(
+            TABLE, name))
+        cursor.execute('CREATE INDEX {0} ON {1} (binding_context_id)'.format(
+            name, TABLE))
+
+
+def restore_unique_constraint(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        if partitions.is_partitioned(cursor):
+            return
+
+        cursor.execute(
+            'SELECT indexname FROM pg_indexes WHERE tablename = %s AND '
+            'indexdef LIKE %s', [TABLE, '%(binding_context_id)'])
+        name, = cursor.fetchone()
+
+        cursor.execute('DROP INDEX {0}'.format(name))
+        cursor.execute('ALTER TABLE {0} ADD CONSTRAINT {1} UNIQUE '
+                       '(binding_context_id)'.format(TABLE, name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('challenge', '0005_partition_challenges'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(demote_unique_constraint,
+                                     restore_unique_constraint),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='challenge',
+                    name='binding_context',
+                    field=models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='challenges',
+                        to='tenants.BindingContext'),
+                ),
+            ]),
+    ]
@@ -1,16 +1,20 @@
 from __future__ import unicode_literals
 
 import logging
+from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.postgres.fields import JSONField
 from django.db import models, transaction
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
-from core import errors
-from core.models import Entity
-from policy.models import Policy
+from core import errors, metrics
+from core.http import make_etag
+from core.models import Entity, update_chunk
+from policy.models import Policy, Configuration
 from tenants.models import Client, BindingContext
+from tenants.tokens import TrustedDeviceToken
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +26,8 @@ class Challenge(Entity):
     STATUS_FAILED = 4
     STATUS_EXPIRED = 5
 
+    PENDING_STATUSES = (STATUS_NEW, STATUS_IN_PROGRESS)
+
     DEFAULT_TOKEN_LENGTH = 5
     DEFAULT_EXPIRATION_IN_MINUTES = 5
 
@@ -37,26 +43,109 @@ class Challenge(Entity):
     policy = models.ForeignKey(Policy, related_name='challenges')
     status = models.PositiveSmallIntegerField(
         choices=STATUS_CHOICES, default=STATUS_NEW)
-    binding_context = models.OneToOneField(
-        BindingContext, related_name='challenge', blank=True, null=True)
+    # a binding context belongs to a single challenge, but uniqueness can't
+    # be enforced across the partitions of the challenge table
+    binding_context = models.ForeignKey(
+        BindingContext, related_name='challenges', blank=True, null=True)
     private_details = JSONField(blank=True, null=True)
     public_details = JSONField(blank=True, null=True)
     reference = models.CharField(max_length=128, blank=True, null=True)
     expires_at = models.DateTimeField()
     portal_url = models.URLField(blank=True, null=True)
 
+    # never stored; only set on the instance whose completion issued it
+    trusted_device_token = None
+
     class Meta:
         indexes = [
             models.Index(fields=['client']),
+            models.Index(fields=['status', 'expires_at']),
         ]
 
     def is_expired(self):
         return self.expires_at < timezone.now()
 
     @staticmethod
-    def get_by_integration_and_pk(pk, integration, **kwargs):
+    def compute_effective_status(status, expires_at):
+        # pending entities past their expiration are reported as expired,
+        # even before the sweeper gets to them
+        if status in Challenge.PENDING_STATUSES and expires_at < timezone.now():
+            return Challenge.STATUS_EXPIRED
+        return status
+
+    def get_effective_status(self):
+        return Challenge.compute_effective_status(self.status, self.expires_at)
+
+    def get_etag(self):
+        return make_etag(self.pk, self.last_updated_at,
+                         self.get_effective_status())
+
+    @staticmethod
+    def get_etag_by_integration_and_pk(pk, integration):
+        """
+        Returns the etag of an entity, without loading its details.
+        """
+        row = Challenge.filter_by_integration_and_pk(pk, integration).values_list(
+            'pk', 'last_updated_at', 'status', 'expires_at').first()
+        if row is None:
+            return None
+
+        pk, last_updated_at, status, expires_at = row
+        return make_etag(pk, last_updated_at,
+                         Challenge.compute_effective_status(status, expires_at))
+
+    @staticmethod
+    def expire_stale(chunk_size, now=None):
+        return update_chunk(
+            Challenge.objects.filter(
+                status__in=Challenge.PENDING_STATUSES,
+                expires_at__lt=now or timezone.now()),
+            chunk_size,
+            status=Challenge.STATUS_EXPIRED,
+            last_updated_at=timezone.now())
+
+    @staticmethod
+    def filter_by_integration_and_pk(pk, integration, **kwargs):
+        # bounding the creation time lets postgres skip the partitions a
+        # recent challenge cannot be in
         return Challenge.objects.filter(
-            pk=pk, client__integration=integration, **kwargs).first()
+            pk=pk,
+            client__integration=integration,
+            created_at__gte=timezone.now() - timedelta(
+                days=settings.MFA_CHALLENGE_LOOKUP_WINDOW_DAYS),
+            **kwargs)
+
+    @staticmethod
+    def get_by_integration_and_pk(pk, integration, **kwargs):
+        return Challenge.filter_by_integration_and_pk(pk, integration,
+                                                      **kwargs).first()
+
+    def dispatch(self):
+        assert self.status == Challenge.STATUS_NEW
+
+        logger.info(
+            u'processing challenge creation for `{0}` with device kind `{1}`'.
+            format(self.pk, self.device.kind))
+
+        # obtain the device handler module
+        module = self.device.kind.get_module()
+
+        # create the challenge
+        with metrics.time_module_hook(module, 'challenge_create'):
+            _, err = module.challenge_create(self)
+        if err:
+            self.status = Challenge.STATUS_FAILED
+            self.save()
+
+            logger.error(u'failed to process challenge `{0}` due to: {1}'.
+                         format(self.pk, err))
+            return err
+
+        # mark the challenge as in-progress
+        self.status = Challenge.STATUS_IN_PROGRESS
+        self.save()
+
+        return None
 
     def complete(self, payload):
         if self.status != Challenge.STATUS_IN_PROGRESS:
@@ -65,6 +154,9 @@ class Challenge(Entity):
                 self.pk, self.get_status_display())
 
         if self.is_expired():
+            self.status = Challenge.STATUS_EXPIRED
+            self.save()
+
             return False, errors.MFAInconsistentStateError(
                 'challenge `{0}` expired at `{1}`', self.pk, self.expires_at)
 
@@ -89,7 +181,8 @@ class Challenge(Entity):
                 return False, err
 
             # complete the challenge
-            success, err = module.challenge_complete(self, model)
+            with metrics.time_module_hook(module, 'challenge_complete'):
+                success, err = module.challenge_complete(self, model)
             if err:
                 logger.error('failed to complete challenge `{0}`: {1}'.format(
                     self.pk, err))
@@ -103,4 +196,129 @@ class Challenge(Entity):
             self.status = Challenge.STATUS_COMPLETE if success else Challenge.STATUS_FAILED
             self.save()
 
+            if success:
+                self.trusted_device_token = self.issue_trusted_device_token()
+
             return success, None
+
+    def issue_trusted_device_token(self):
+        """
+        Returns a token sparing the client further challenges from the
+        browser this challenge was bound to, if the policy allows it.
+        """
+        lifetime_days = self.policy.get_configuration(
+            Configuration.KIND_TRUSTED_DEVICE_LIFETIME_IN_DAYS)
+        if not lifetime_days or not self.binding_context_id:
+            return None
+
+        fingerprint = self.binding_context.client_browser_fingerprint
+        if not fingerprint:
+            return None
+
+        return TrustedDeviceToken.issue(
+            self.client.integration, self.client_id, fingerprint,
+            timezone.now() + timedelta(days=lifetime_days))
+
+
+class ChallengeDispatch(models.Model):
+    """
+    Outbox entry for a challenge that has yet to be handed to its device
+    module. Entries are written in the same transaction as their challenge,
+    and drained in batches by the `dispatch_challenges` command, each entry
+    of a batch processed in a transaction of its own.
+    """
+    DEFAULT_BATCH_SIZE = 50
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY_IN_SECONDS = 30
+    LEASE_IN_SECONDS = 300
+
+    challenge = models.OneToOneField(
+        Challenge,
+        related_name='dispatch_entry',
+        on_delete=models.CASCADE,
+        db_constraint=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['available_at']),
+        ]
+
+    @staticmethod
+    def claim(batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Leases up to `batch_size` available entries to this worker, returning
+        their pks. Entries whose worker dies before processing them become
+        available again once their lease runs out.
+        """
+        now = timezone.now()
+
+        with transaction.atomic():
+            # only lock the outbox rows; concurrent workers skip each other's
+            # entries rather than waiting on them.
+            pks = list(
+                ChallengeDispatch.objects.select_for_update(skip_locked=True)
+                .filter(available_at__lte=now)
+                .order_by('available_at')
+                .values_list('pk', flat=True)[:batch_size])
+
+            ChallengeDispatch.objects.filter(pk__in=pks).update(
+                available_at=now + timedelta(
+                    seconds=ChallengeDispatch.LEASE_IN_SECONDS))
+
+        return pks
+
+    @staticmethod
+    def drain(batch_size=DEFAULT_BATCH_SIZE):
+        pks = ChallengeDispatch.claim(batch_size)
+
+        entries = ChallengeDispatch.objects.filter(pk__in=pks).select_related(
+            'challenge__device__kind', 'challenge__policy').order_by('pk')
+
+        # every entry is committed as soon as it is processed, so that its
+        # challenge is visible right away, and is not dispatched again should
+        # a later entry fail
+        for entry in entries:
+            with transaction.atomic():
+                entry.process()
+
+        return len(pks)
+
+    def process(self):
+        challenge = self.challenge
+
+        if challenge.status != Challenge.STATUS_NEW:
+            logger.info('skipping dispatch of challenge `{0}` in state `{1}`'.
+                        format(challenge.pk, challenge.get_status_display()))
+            self.delete()
+            return
+
+        try:
+            with transaction.atomic():
+                challenge.dispatch()
+                self.delete()
+        except Exception as e:
+            logger.exception('failed to dispatch challenge `{0}`'.format(
+                challenge.pk))
+            self._retry_or_fail(challenge, e)
+
+    def _retry_or_fail(self, challenge, err):
+        self.attempts += 1
+        self.last_error = '{0}'.format(err)
+
+        if self.attempts >= ChallengeDispatch.MAX_ATTEMPTS:
+            logger.error('giving up on challenge `{0}` after `{1}` attempts'.
+                         format(challenge.pk, self.attempts))
+
+            challenge.status = Challenge.STATUS_FAILED
+            challenge.save()
+
+            self.delete()
+            return
+
+        self.available_at = timezone.now() + timedelta(
+            seconds=ChallengeDispatch.RETRY_DELAY_IN_SECONDS * self.attempts)
+        self.save()
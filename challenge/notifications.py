@@ -0,0 +1,158 @@
+from __future__ import unicode_literals
+
+import logging
+import os
+import select
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from django.db import connections, DEFAULT_DB_ALIAS
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'challenge_status'
+
+
+def notify(pk, using=DEFAULT_DB_ALIAS):
+    """
+    Notifies the listeners of every node that challenge `pk` changed, once
+    the current transaction commits.
+    """
+    conn = connections[using]
+    if conn.vendor != 'postgresql':
+        return
+
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, '{0}'.format(pk)])
+
+
+class ChallengeStatusListener(object):
+    """
+    Listens for challenge notifications on a dedicated connection, from a
+    background thread, and wakes up the threads waiting on those
+    challenges.
+    """
+    RECONNECT_DELAY_IN_SECONDS = 5
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self._using = using
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._waiters = {}
+        self._thread = None
+        self._conn = None
+        self._connected = threading.Event()
+        self._stop = threading.Event()
+
+    @property
+    def connected(self):
+        return self._connected.is_set()
+
+    def _connect(self):
+        conn = psycopg2.connect(
+            **connections[self._using].get_connection_params())
+        conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+        with conn.cursor() as cursor:
+            cursor.execute('LISTEN {0}'.format(CHANNEL))
+
+        return conn
+
+    def _wake(self, pks=None):
+        with self._lock:
+            waiters = [
+                event for pk, events in self._waiters.items()
+                if pks is None or pk in pks for event in events
+            ]
+
+        for event in waiters:
+            event.set()
+
+    def _listen(self, conn):
+        while not self._stop.is_set():
+            if select.select([conn], [], [], 1.0) == ([], [], []):
+                continue
+
+            conn.poll()
+
+            pks = set()
+            while conn.notifies:
+                try:
+                    pks.add(int(conn.notifies.pop(0).payload))
+                except ValueError:
+                    pass
+
+            self._wake(pks)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._conn = self._connect()
+                self._connected.set()
+
+                # changes may have been missed while disconnected
+                self._wake()
+                self._listen(self._conn)
+            except (psycopg2.Error, select.error) as e:
+                logger.warning(
+                    'challenge status listener disconnected: {0}'.format(e))
+                self._stop.wait(self.RECONNECT_DELAY_IN_SECONDS)
+            finally:
+                self._connected.clear()
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+
+    def start(self, timeout=1.0):
+        with self._lock:
+            # listener threads do not survive forks
+            if self._pid != os.getpid():
+                self._reset()
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='challenge-status-listener')
+                self._thread.daemon = True
+                self._thread.start()
+
+        self._connected.wait(timeout)
+
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            self._stop.set()
+
+        if thread is not None:
+            thread.join()
+
+        with self._lock:
+            self._reset()
+
+    @contextmanager
+    def subscribe(self, pk):
+        """
+        Yields an event set whenever challenge `pk` may have changed. Check
+        the challenge only after subscribing, so that no change is missed.
+        """
+        self.start()
+
+        event = threading.Event()
+        with self._lock:
+            self._waiters.setdefault(pk, set()).add(event)
+
+        try:
+            yield event
+        finally:
+            with self._lock:
+                events = self._waiters.get(pk)
+                events.discard(event)
+                if not events:
+                    del self._waiters[pk]
+
+
+listener = ChallengeStatusListener()
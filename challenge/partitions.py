@@ -0,0 +1,172 @@
+from __future__ import unicode_literals
+
+import logging
+from datetime import datetime
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# challenges are range partitioned by month of creation; rows outside of
+# every monthly partition land in the default one.
+TABLE = 'challenge_challenge'
+DEFAULT_PARTITION = TABLE + '_default'
+PARTITION_NAME_FORMAT = TABLE + '_p%Y%m'
+
+# declarative partitioning, with primary keys, foreign keys and a default
+# partition, needs postgres 11.
+MIN_SERVER_VERSION = 110000
+
+
+def get_month_start(dt):
+    return dt.astimezone(timezone.utc).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(dt, months):
+    month = dt.month - 1 + months
+    return dt.replace(year=dt.year + month // 12, month=month % 12 + 1)
+
+
+def is_supported(conn=connection):
+    return conn.vendor == 'postgresql' and conn.pg_version >= MIN_SERVER_VERSION
+
+
+def is_partitioned(cursor):
+    cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)',
+                   [TABLE])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def get_partitions(cursor):
+    """
+    Returns the monthly partitions attached to the challenge table, as
+    `(month start, name)` tuples ordered by month.
+    """
+    cursor.execute(
+        'SELECT c.relname FROM pg_inherits i '
+        'JOIN pg_class c ON c.oid = i.inhrelid '
+        'WHERE i.inhparent = to_regclass(%s)', [TABLE])
+
+    partitions = []
+    for name, in cursor.fetchall():
+        try:
+            start = datetime.strptime(name, PARTITION_NAME_FORMAT)
+        except ValueError:
+            continue
+
+        partitions.append((start.replace(tzinfo=timezone.utc), name))
+
+    return sorted(partitions)
+
+
+def create_partition(cursor, start):
+    end = add_months(start, 1)
+    name = start.strftime(PARTITION_NAME_FORMAT)
+
+    cursor.execute('CREATE TABLE {0} (LIKE {1})'.format(name, TABLE))
+
+    # challenges created before the partition existed went to the default
+    # one, and must be moved before it can be attached.
+    cursor.execute(
+        'WITH moved AS (DELETE FROM {0} WHERE created_at >= %s AND '
+        'created_at < %s RETURNING *) INSERT INTO {1} SELECT * FROM moved'.
+        format(DEFAULT_PARTITION, name), [start, end])
+
+    cursor.execute(
+        "ALTER TABLE {0} ATTACH PARTITION {1} FOR VALUES FROM ('{2}') TO "
+        "('{3}')".format(TABLE, name, start.isoformat(), end.isoformat()))
+
+    logger.info('created challenge partition `{0}` for `{1}` to `{2}`'.format(
+        name, start, end))
+
+    return name
+
+
+def ensure_partitions(months_ahead=None, now=None, since=None):
+    """
+    Creates the partitions for the current month and `months_ahead` months
+    after it, or from the month of `since` on, returning the names of those
+    that did not exist yet.
+    """
+    if months_ahead is None:
+        months_ahead = settings.MFA_CHALLENGE_PARTITIONS_AHEAD
+
+    if not is_supported():
+        return []
+
+    created = []
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return []
+
+        existing = set(start for start, _ in get_partitions(cursor))
+        now = now or timezone.now()
+
+        start = get_month_start(since or now)
+        last = add_months(get_month_start(now), months_ahead)
+        while start <= last:
+            if start not in existing:
+                created.append(create_partition(cursor, start))
+            start = add_months(start, 1)
+
+    return created
+
+
+def detach_partitions(before, drop=False):
+    """
+    Detaches the partitions holding only challenges created before `before`,
+    dropping them along with their dispatch entries and binding contexts
+    when `drop` is set. Returns the names of the affected partitions.
+    """
+    if not is_supported():
+        return []
+
+    BindingContext = apps.get_model('tenants', 'BindingContext')
+    ChallengeDispatch = apps.get_model('challenge', 'ChallengeDispatch')
+
+    detached = []
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return []
+
+        for start, name in get_partitions(cursor):
+            if add_months(start, 1) > before:
+                continue
+
+            cursor.execute('ALTER TABLE {0} DETACH PARTITION {1}'.format(
+                TABLE, name))
+            detached.append(name)
+
+            if not drop:
+                logger.info('detached challenge partition `{0}`'.format(name))
+                continue
+
+            cursor.execute(
+                'DELETE FROM {0} WHERE challenge_id IN (SELECT id FROM {1})'.
+                format(ChallengeDispatch._meta.db_table, name))
+
+            cursor.execute(
+                'SELECT binding_context_id FROM {0} '
+                'WHERE binding_context_id IS NOT NULL'.format(name))
+            binding_contexts = [x for x, in cursor.fetchall()]
+
+            # deferred foreign key checks queued earlier in the transaction
+            # would otherwise prevent the table from being dropped
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute('DROP TABLE {0}'.format(name))
+
+            BindingContext.objects.filter(
+                pk__in=binding_contexts,
+                challenges__isnull=True,
+                enrollments__isnull=True).delete()
+
+            logger.info('dropped challenge partition `{0}`'.format(name))
+
+    return detached
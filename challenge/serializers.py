@@ -2,6 +2,7 @@ from __future__ import unicode_literals
 
 from rest_framework import serializers
 
+from tenants.serializers import BindingContextSerializer
 from .models import Challenge
 
 
@@ -9,9 +10,17 @@ class CreateChallengeSerializer(serializers.Serializer):
     username = serializers.CharField()
     reference = serializers.CharField(required=False)
     device_pk = serializers.IntegerField(required=False)
+    binding_context = BindingContextSerializer(required=False)
+
+
+class ChallengeWaitSerializer(serializers.Serializer):
+    timeout = serializers.FloatField(min_value=0, required=False)
 
 
 class ChallengeSerializer(serializers.ModelSerializer):
+    status = serializers.SerializerMethodField()
+    trusted_device_token = serializers.CharField(read_only=True)
+
     class Meta:
         model = Challenge
         fields = (
@@ -20,4 +29,8 @@ class ChallengeSerializer(serializers.ModelSerializer):
             'public_details',
             'reference',
             'created_at',
-            'expires_at', )
+            'expires_at',
+            'trusted_device_token', )
+
+    def get_status(self, obj):
+        return obj.get_effective_status()
@@ -1,34 +1,20 @@
-import logging
+from __future__ import unicode_literals
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_migrate, post_save
 from django.dispatch import receiver
 
 from .models import Challenge
+from .notifications import notify
+from .partitions import ensure_partitions
 
-logger = logging.getLogger(__name__)
 
+@receiver(post_migrate)
+def on_migrated_ensure_partitions(sender, app_config, **kwargs):
+    if app_config.name == 'challenge':
+        ensure_partitions()
 
-@receiver(post_save, sender=Challenge)
-def on_challenge_created_perform_challenge(sender, instance, created,
-                                           **kwargs):
-    if created:
-        logger.info(
-            u'processing challenge creation for `{0}` with device kind `{1}`'.
-            format(instance.pk, instance.device.kind))
-
-        # obtain the device handler module
-        module = instance.device.kind.get_module()
-
-        # create the challenge
-        _, err = module.challenge_create(instance)
-        if err:
-            instance.status = Challenge.STATUS_FAILED
-            instance.save()
 
-            logger.error(u'failed to process challenge `{0}` due to: {1}'.
-                         format(instance.pk, err))
-            return
-
-        # mark the challenge as in-progress
-        instance.status = Challenge.STATUS_IN_PROGRESS
-        instance.save()
+@receiver(post_save, sender=Challenge)
+def on_challenge_saved_notify(sender, instance, created, using, **kwargs):
+    if not created:
+        notify(instance.pk, using)
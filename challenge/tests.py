@@ -1 +1,511 @@
-# Create your tests here.
+import datetime
+import time
+
+import pyotp
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from core import models as core_models
+from devices.models import Device, DeviceKind
+from devices.modules.otp import OTPConfiguration, OTPDeviceKindModule
+from enrollment.models import Enrollment
+from policy.models import Configuration
+from tenants.models import Tenant, Integration, Client, BindingContext
+from tenants.serializers import IntegrationClientAuthDecisionResponseSerializer
+from tenants.tokens import signing_key_cache
+from . import partitions
+from .models import Challenge, ChallengeDispatch
+from .notifications import listener, notify
+from .serializers import ChallengeSerializer
+
+BASE_TEST_USERNAME = 'test'
+
+
+class BaseChallengeTestCase(TestCase):
+    def setUp(self):
+        self.integration = Integration.create(
+            tenant=Tenant.create(
+                name='Test Tenant',
+                email='john.doe@email.com',
+                password='john.doe'),
+            name='Test Integration',
+            notes='Test Notes')
+
+        kind = DeviceKind.objects.create(
+            name='OTP',
+            module='devices.modules.otp.OTPDeviceKindModule',
+            description='OTP Devices',
+            configuration={
+                'issuer_name': 'pymfa',
+                'digits': 6,
+                'algorithm': OTPConfiguration.ALGORITHM_SHA1,
+                'secret_length': 32,
+                'valid_window': 1,
+                'interval': 30,
+            })
+
+        self.client_entity = Client.objects.create(
+            name=BASE_TEST_USERNAME,
+            integration=self.integration,
+            username=BASE_TEST_USERNAME)
+
+        self.device = Device.objects.create(
+            name='OTP [{0}]'.format(BASE_TEST_USERNAME),
+            kind=kind,
+            client=self.client_entity,
+            enrollment=Enrollment.objects.create(
+                integration=self.integration,
+                policy=self.integration.policy,
+                username=BASE_TEST_USERNAME,
+                status=Enrollment.STATUS_COMPLETE,
+                expires_at=timezone.now() + datetime.timedelta(minutes=5)),
+            details={
+                'issuer_name': 'pymfa',
+                'digits': 6,
+                'interval': 30,
+                'algorithm': OTPConfiguration.ALGORITHM_SHA1,
+                'secret': pyotp.random_base32(),
+                'valid_window': 1,
+            })
+
+    def create_challenge(self):
+        challenge, err = self.integration.challenge(self.client_entity, {
+            'device_pk': self.device.pk,
+        })
+
+        self.assertIsNone(err)
+        return challenge
+
+
+class ChallengeDispatchTestCase(BaseChallengeTestCase):
+    def setUp(self):
+        super(ChallengeDispatchTestCase, self).setUp()
+
+        # OTP challenges deliver nothing; have them go through the outbox
+        OTPDeviceKindModule.delivers_challenges = True
+        self.addCleanup(setattr, OTPDeviceKindModule, 'delivers_challenges',
+                        False)
+
+    def test_challenge_is_queued_on_creation(self):
+        challenge = self.create_challenge()
+
+        self.assertEqual(challenge.status, Challenge.STATUS_NEW)
+        self.assertTrue(
+            ChallengeDispatch.objects.filter(challenge=challenge).exists())
+
+    def test_drain_performs_queued_challenges(self):
+        challenge = self.create_challenge()
+
+        self.assertEqual(ChallengeDispatch.drain(), 1)
+        self.assertEqual(ChallengeDispatch.drain(), 0)
+
+        challenge.refresh_from_db()
+        self.assertEqual(challenge.status, Challenge.STATUS_IN_PROGRESS)
+        self.assertFalse(ChallengeDispatch.objects.exists())
+
+    def test_drain_retries_failed_dispatches(self):
+        challenge = self.create_challenge()
+
+        self.device.kind.module = 'devices.modules.otp.Missing'
+        self.device.kind.save()
+
+        self.assertEqual(ChallengeDispatch.drain(), 1)
+
+        entry = ChallengeDispatch.objects.get(challenge=challenge)
+        self.assertEqual(entry.attempts, 1)
+        self.assertGreater(entry.available_at, timezone.now())
+
+        challenge.refresh_from_db()
+        self.assertEqual(challenge.status, Challenge.STATUS_NEW)
+
+    def test_drain_commits_every_entry(self):
+        first, second = self.create_challenge(), self.create_challenge()
+
+        process = ChallengeDispatch.process
+
+        def fail_second(entry):
+            if entry.challenge_id == second.pk:
+                raise RuntimeError('worker died')
+            process(entry)
+
+        ChallengeDispatch.process = fail_second
+        self.addCleanup(setattr, ChallengeDispatch, 'process', process)
+
+        with self.assertRaises(RuntimeError):
+            ChallengeDispatch.drain()
+
+        first.refresh_from_db()
+        self.assertEqual(first.status, Challenge.STATUS_IN_PROGRESS)
+        self.assertFalse(
+            ChallengeDispatch.objects.filter(challenge=first).exists())
+
+        # the entry left behind is leased until its worker is presumed dead
+        entry = ChallengeDispatch.objects.get(challenge=second)
+        self.assertGreater(entry.available_at, timezone.now())
+        self.assertEqual(ChallengeDispatch.drain(), 0)
+
+
+class ChallengeCompletionTestCase(BaseChallengeTestCase):
+    def setUp(self):
+        super(ChallengeCompletionTestCase, self).setUp()
+        self.totp = pyotp.TOTP(self.device.details['secret'])
+
+    def test_otp_challenge_can_be_completed_right_after_creation(self):
+        challenge = self.create_challenge()
+
+        self.assertEqual(challenge.status, Challenge.STATUS_IN_PROGRESS)
+        self.assertFalse(ChallengeDispatch.objects.exists())
+
+        challenge = Challenge.objects.get(pk=challenge.pk)
+        success, err = challenge.complete({'token': self.totp.now()})
+
+        self.assertTrue(success)
+        self.assertIsNone(err)
+
+    def test_can_complete_otp_challenge(self):
+        challenge = self.create_challenge()
+
+        success, err = challenge.complete({'token': self.totp.now()})
+
+        self.assertTrue(success)
+        self.assertIsNone(err)
+        self.assertEqual(challenge.status, Challenge.STATUS_COMPLETE)
+
+    def test_otp_token_cannot_be_replayed(self):
+        token = self.totp.now()
+
+        success, _ = self.create_challenge().complete({'token': token})
+        self.assertTrue(success)
+
+        challenge = self.create_challenge()
+        success, _ = challenge.complete({'token': token})
+
+        self.assertFalse(success)
+        self.assertEqual(challenge.status, Challenge.STATUS_FAILED)
+
+
+class ChallengeExpirationTestCase(BaseChallengeTestCase):
+    def expire(self, challenge):
+        Challenge.objects.filter(pk=challenge.pk).update(
+            expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        challenge.refresh_from_db()
+        return challenge
+
+    def test_expired_challenge_is_reported_as_expired(self):
+        challenge = self.expire(self.create_challenge())
+
+        self.assertEqual(challenge.status, Challenge.STATUS_IN_PROGRESS)
+        self.assertEqual(
+            ChallengeSerializer(challenge).data['status'],
+            Challenge.STATUS_EXPIRED)
+
+    def test_expire_stale_sweeps_in_chunks(self):
+        stale = [self.expire(self.create_challenge()) for _ in range(3)]
+        fresh = self.create_challenge()
+
+        self.assertEqual(Challenge.expire_stale(2), 2)
+        self.assertEqual(Challenge.expire_stale(2), 1)
+        self.assertEqual(Challenge.expire_stale(2), 0)
+
+        self.assertEqual(
+            Challenge.objects.filter(
+                pk__in=[c.pk for c in stale],
+                status=Challenge.STATUS_EXPIRED).count(), 3)
+
+        fresh.refresh_from_db()
+        self.assertEqual(fresh.status, Challenge.STATUS_IN_PROGRESS)
+
+    def test_expire_stale_skips_challenges_completed_meanwhile(self):
+        completed, stale = [
+            self.expire(self.create_challenge()) for _ in range(2)
+        ]
+
+        get_chunk_pks = core_models.get_chunk_pks
+
+        def complete_after_select(queryset, chunk_size):
+            pks = get_chunk_pks(queryset, chunk_size)
+            Challenge.objects.filter(pk=completed.pk).update(
+                status=Challenge.STATUS_COMPLETE)
+            return pks
+
+        core_models.get_chunk_pks = complete_after_select
+        self.addCleanup(setattr, core_models, 'get_chunk_pks', get_chunk_pks)
+
+        self.assertEqual(Challenge.expire_stale(10), 1)
+
+        completed.refresh_from_db()
+        stale.refresh_from_db()
+        self.assertEqual(completed.status, Challenge.STATUS_COMPLETE)
+        self.assertEqual(stale.status, Challenge.STATUS_EXPIRED)
+
+
+class ChallengePartitionTestCase(BaseChallengeTestCase):
+    def get_partition_names(self):
+        with connection.cursor() as cursor:
+            return [name for _, name in partitions.get_partitions(cursor)]
+
+    def count_rows(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM {0}'.format(table))
+            return cursor.fetchone()[0]
+
+    def age(self, challenge, created_at):
+        Challenge.objects.filter(pk=challenge.pk).update(created_at=created_at)
+
+    def test_challenges_are_partitioned(self):
+        self.assertTrue(partitions.is_supported())
+
+        with connection.cursor() as cursor:
+            self.assertTrue(partitions.is_partitioned(cursor))
+
+        self.assertIn(
+            partitions.get_month_start(timezone.now()).strftime(
+                partitions.PARTITION_NAME_FORMAT),
+            self.get_partition_names())
+
+    def test_ensure_partitions_moves_rows_out_of_default(self):
+        future = partitions.add_months(
+            partitions.get_month_start(timezone.now()), 12)
+
+        challenge = self.create_challenge()
+        self.age(challenge, future)
+        self.assertEqual(self.count_rows(partitions.DEFAULT_PARTITION), 1)
+
+        created = partitions.ensure_partitions(months_ahead=0, now=future)
+
+        self.assertEqual(created,
+                         [future.strftime(partitions.PARTITION_NAME_FORMAT)])
+        self.assertEqual(self.count_rows(partitions.DEFAULT_PARTITION), 0)
+        self.assertEqual(self.count_rows(created[0]), 1)
+        self.assertEqual(partitions.ensure_partitions(0, now=future), [])
+
+    def test_drop_partitions(self):
+        past = partitions.add_months(
+            partitions.get_month_start(timezone.now()), -12)
+        partitions.ensure_partitions(months_ahead=0, now=past)
+
+        old = self.create_challenge()
+        old.binding_context = BindingContext.objects.create()
+        old.save()
+        self.age(old, past)
+        recent = self.create_challenge()
+
+        dropped = partitions.detach_partitions(
+            partitions.add_months(past, 1), drop=True)
+
+        self.assertEqual(dropped,
+                         [past.strftime(partitions.PARTITION_NAME_FORMAT)])
+        self.assertEqual(list(Challenge.objects.all()), [recent])
+        self.assertFalse(
+            ChallengeDispatch.objects.filter(challenge_id=old.pk).exists())
+        self.assertFalse(BindingContext.objects.exists())
+
+    def test_lookup_is_limited_to_recent_challenges(self):
+        challenge = self.create_challenge()
+        self.assertEqual(
+            Challenge.get_by_integration_and_pk(challenge.pk,
+                                                self.integration), challenge)
+
+        self.age(challenge, timezone.now() - datetime.timedelta(days=365))
+        self.assertIsNone(
+            Challenge.get_by_integration_and_pk(challenge.pk,
+                                                self.integration))
+
+
+class ChallengeWaitTestCase(BaseChallengeTestCase, APITestCase):
+    def setUp(self):
+        super(ChallengeWaitTestCase, self).setUp()
+        self.addCleanup(listener.stop)
+
+        self.client.force_authenticate(
+            user=self.integration, token=self.integration)
+
+    def wait(self, challenge, timeout):
+        return self.client.get(
+            reverse('challenge-wait', kwargs={'pk': challenge.pk}),
+            {'timeout': timeout})
+
+    def test_wait_returns_pending_challenge_on_timeout(self):
+        challenge = self.create_challenge()
+
+        started_at = time.time()
+        res = self.wait(challenge, 0.2)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['status'], Challenge.STATUS_IN_PROGRESS)
+        self.assertGreaterEqual(time.time() - started_at, 0.2)
+
+    def test_wait_returns_finished_challenge_immediately(self):
+        challenge = self.create_challenge()
+        challenge.status = Challenge.STATUS_FAILED
+        challenge.save()
+
+        res = self.wait(challenge, 10)
+
+        self.assertEqual(res.data['status'], Challenge.STATUS_FAILED)
+
+
+class ChallengeNotificationTestCase(TransactionTestCase):
+    # notifications are only delivered on commit
+
+    def setUp(self):
+        self.addCleanup(listener.stop)
+
+    def test_listener_is_woken_by_notifications(self):
+        listener.start(timeout=5)
+        self.assertTrue(listener.connected)
+
+        with listener.subscribe(42) as changed:
+            notify(41)
+            self.assertFalse(changed.wait(0.5))
+
+            notify(42)
+            self.assertTrue(changed.wait(5))
+
+
+class ChallengeDetailTestCase(BaseChallengeTestCase, APITestCase):
+    def setUp(self):
+        super(ChallengeDetailTestCase, self).setUp()
+        self.client.force_authenticate(
+            user=self.integration, token=self.integration)
+
+    def get(self, challenge, **headers):
+        return self.client.get(
+            reverse('challenge-detail', kwargs={'pk': challenge.pk}),
+            **headers)
+
+    def test_unchanged_challenge_is_not_modified(self):
+        challenge = self.create_challenge()
+        etag = self.get(challenge)['ETag']
+
+        with self.assertNumQueries(1):
+            res = self.get(challenge, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res['ETag'], etag)
+
+    def test_etag_is_not_loaded_without_if_none_match(self):
+        challenge = self.create_challenge()
+
+        with self.assertNumQueries(1):
+            res = self.get(challenge)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_changed_challenge_is_returned(self):
+        challenge = self.create_challenge()
+        etag = self.get(challenge)['ETag']
+
+        challenge.status = Challenge.STATUS_FAILED
+        challenge.save()
+
+        res = self.get(challenge, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+        self.assertEqual(res['ETag'], challenge.get_etag())
+
+    def test_expiration_changes_etag(self):
+        challenge = self.create_challenge()
+        etag = self.get(challenge)['ETag']
+
+        # still pending in the database, but served as expired
+        Challenge.objects.filter(pk=challenge.pk).update(
+            expires_at=timezone.now() - datetime.timedelta(minutes=1))
+
+        res = self.get(challenge, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['status'], Challenge.STATUS_EXPIRED)
+
+
+    def test_challenges_past_the_lookup_window_are_not_found(self):
+        challenge = self.create_challenge()
+        Challenge.objects.filter(pk=challenge.pk).update(
+            created_at=timezone.now() - datetime.timedelta(
+                days=settings.MFA_CHALLENGE_LOOKUP_WINDOW_DAYS, minutes=1))
+
+        self.assertEqual(self.get(challenge).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+        res = self.client.post(
+            reverse('challenge-complete', kwargs={'pk': challenge.pk}), {
+                'token': pyotp.TOTP(self.device.details['secret']).now()
+            },
+            format='json')
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+class TrustedDeviceTestCase(BaseChallengeTestCase, APITestCase):
+    FINGERPRINT = 'fingerprint'
+
+    def setUp(self):
+        super(TrustedDeviceTestCase, self).setUp()
+        self.client.force_authenticate(
+            user=self.integration, token=self.integration)
+        self.addCleanup(signing_key_cache.clear)
+
+        Configuration.objects.create(
+            policy=self.integration.policy,
+            kind=Configuration.KIND_TRUSTED_DEVICE_LIFETIME_IN_DAYS,
+            value='30')
+
+    def complete_challenge(self, fingerprint=FINGERPRINT):
+        res = self.client.post(
+            reverse('challenge-list'), {
+                'username': BASE_TEST_USERNAME,
+                'device_pk': self.device.pk,
+                'binding_context': {
+                    'client_browser_fingerprint': fingerprint
+                }
+            },
+            format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        return self.client.post(
+            reverse('challenge-complete', kwargs={'pk': res.data['pk']}), {
+                'token': pyotp.TOTP(self.device.details['secret']).now()
+            },
+            format='json')
+
+    def decide(self, token, fingerprint=FINGERPRINT):
+        return self.client.post(
+            reverse('client-auth'), {
+                'username': BASE_TEST_USERNAME,
+                'binding_context': {
+                    'client_browser_fingerprint': fingerprint,
+                    'trusted_device_token': token
+                }
+            },
+            format='json').data['result']
+
+    def test_trusted_device_is_allowed(self):
+        res = self.complete_challenge()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        token = res.data['trusted_device_token']
+        self.assertIsNotNone(token)
+
+        challenges = Challenge.objects.count()
+        self.assertEqual(
+            self.decide(token),
+            IntegrationClientAuthDecisionResponseSerializer.RESULT_ALLOW)
+        self.assertEqual(Challenge.objects.count(), challenges)
+
+        # the token is only good for the browser it was issued to
+        self.assertEqual(
+            self.decide(token, fingerprint='other'),
+            IntegrationClientAuthDecisionResponseSerializer.RESULT_CHALLENGE)
+        self.assertEqual(
+            self.decide(token[:-1]),
+            IntegrationClientAuthDecisionResponseSerializer.RESULT_CHALLENGE)
+
+    def test_no_token_without_lifetime(self):
+        Configuration.objects.filter(
+            policy=self.integration.policy,
+            kind=Configuration.KIND_TRUSTED_DEVICE_LIFETIME_IN_DAYS).delete()
+
+        self.assertIsNone(self.complete_challenge().data[
+            'trusted_device_token'])
@@ -1,18 +1,28 @@
 from __future__ import unicode_literals
 
 import logging
+import time
 
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from core.http import etag_matches, not_modified, with_etag
+from mfa.routers import ReplicaReadMixin
+from tenants.idempotency import idempotent
+
 from .models import Challenge
-from .serializers import CreateChallengeSerializer, ChallengeSerializer
+from .notifications import listener
+from .serializers import CreateChallengeSerializer, ChallengeSerializer, ChallengeWaitSerializer
 
 logger = logging.getLogger(__name__)
 
 
 class ChallengeList(APIView):
+    @idempotent
     def post(self, request, format=None):
         serializer = CreateChallengeSerializer(data=request.data)
         if not serializer.is_valid():
@@ -42,13 +52,66 @@ class ChallengeList(APIView):
             status=status.HTTP_201_CREATED)
 
 
-class ChallengeDetailView(APIView):
+class ChallengeDetailView(ReplicaReadMixin, APIView):
     def get(self, request, pk, format=None):
+        # the etag alone is only worth loading when the client has one
+        if request.META.get('HTTP_IF_NONE_MATCH'):
+            etag = Challenge.get_etag_by_integration_and_pk(pk, request.auth)
+            if etag and etag_matches(request, etag):
+                return not_modified(etag)
+
         challenge = Challenge.get_by_integration_and_pk(pk, request.auth)
 
         if not challenge:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
+        return with_etag(
+            Response(
+                ChallengeSerializer(challenge).data,
+                status=status.HTTP_200_OK), challenge.get_etag())
+
+
+class ChallengeWaitView(APIView):
+    """
+    Holds the request until the challenge is no longer pending, or until the
+    requested timeout passes, and returns it.
+    """
+
+    def get(self, request, pk, format=None):
+        serializer = ChallengeWaitSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        deadline = time.time() + min(
+            serializer.validated_data.get(
+                'timeout', settings.MFA_CHALLENGE_WAIT_TIMEOUT),
+            settings.MFA_CHALLENGE_WAIT_TIMEOUT)
+
+        with listener.subscribe(int(pk)) as changed:
+            challenge = Challenge.get_by_integration_and_pk(pk, request.auth)
+            if not challenge:
+                return Response(status=status.HTTP_404_NOT_FOUND)
+
+            while challenge.get_effective_status(
+            ) in Challenge.PENDING_STATUSES:
+                # expiration ends the wait as well
+                remaining = min(
+                    deadline - time.time(),
+                    (challenge.expires_at - timezone.now()).total_seconds())
+                if remaining <= 0:
+                    break
+
+                # don't hold on to a database connection while waiting
+                if not connection.in_atomic_block:
+                    connection.close()
+
+                changed.wait(
+                    min(remaining, settings.MFA_CHALLENGE_WAIT_POLL_INTERVAL))
+                changed.clear()
+
+                challenge.refresh_from_db()
+
         return Response(
             ChallengeSerializer(challenge).data, status=status.HTTP_200_OK)
 
@@ -1,15 +1,97 @@
 from __future__ import unicode_literals
 
-from django.core.mail import send_mail
+import atexit
+import hashlib
+import json
+import logging
+import smtplib
+import socket
+import threading
+from contextlib import contextmanager
+
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 
+from core.pool import ConnectionPool
 from core.errors import MFAError
 
+logger = logging.getLogger(__name__)
+
+
+class SMTPConnectionPool(ConnectionPool):
+    """
+    A bounded pool of open mail backend connections, health checked with a
+    NOOP.
+    """
+
+    def __init__(self, size, idle_timeout, health_check, checkout_timeout,
+                 connection_options):
+        super(SMTPConnectionPool, self).__init__(
+            connect=lambda: SMTPConnectionPool.open(connection_options),
+            size=size,
+            idle_timeout=idle_timeout,
+            health_check=health_check,
+            checkout_timeout=checkout_timeout)
+
+    @staticmethod
+    def open(connection_options):
+        conn = get_connection(fail_silently=False, **connection_options)
+        conn.open()
+        return conn
+
+    def _is_healthy(self, conn):
+        # only the smtp backend keeps a transport around to check
+        smtp = getattr(conn, 'connection', None)
+        if smtp is None:
+            return not hasattr(conn, 'connection')
+
+        try:
+            return smtp.noop()[0] == 250
+        except (smtplib.SMTPException, socket.error):
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except (smtplib.SMTPException, socket.error):
+            pass
+
+    def _timeout_error(self):
+        return smtplib.SMTPException(
+            'timed out waiting for a pooled smtp connection')
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except (smtplib.SMTPException, socket.error):
+            self.release(conn, broken=True)
+            raise
+        except Exception:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
 
 class DjangoSMTPMailer(object):
     class Configuration(serializers.Serializer):
-        pass
+        pool_size = serializers.IntegerField(default=4, min_value=1)
+        idle_timeout = serializers.FloatField(default=60, min_value=0)
+        health_check = serializers.BooleanField(default=True)
+        checkout_timeout = serializers.FloatField(default=10, min_value=0)
+        max_retries = serializers.IntegerField(default=2, min_value=0)
+        host = serializers.CharField(required=False)
+        port = serializers.IntegerField(required=False)
+        username = serializers.CharField(required=False)
+        password = serializers.CharField(required=False)
+        use_tls = serializers.BooleanField(required=False)
+        timeout = serializers.FloatField(required=False)
+
+    CONNECTION_OPTIONS = ('host', 'port', 'username', 'password', 'use_tls',
+                          'timeout')
 
     class Request(serializers.Serializer):
         from_email = serializers.EmailField()
@@ -18,24 +100,109 @@ class DjangoSMTPMailer(object):
         message = serializers.CharField()
         html_message = serializers.CharField(required=False)
 
+    # pools are shared by every mailer instance with the same configuration
+    _pools = {}
+    _pools_lock = threading.Lock()
+
     def __init__(self, options):
         self._options = options
 
+        configuration = self.get_configuration_model(options or {})
+        if not configuration.is_valid():
+            raise Exception('could not instantiate configuration: {0}'.format(
+                configuration.errors))
+
+        self._configuration = configuration.validated_data
+        self._pool = DjangoSMTPMailer.get_pool(self._configuration)
+
+    @staticmethod
+    def get_pool(configuration):
+        key = hashlib.sha1(json.dumps(configuration,
+                                      sort_keys=True)).hexdigest()
+
+        with DjangoSMTPMailer._pools_lock:
+            pool = DjangoSMTPMailer._pools.get(key)
+            if pool is None:
+                pool = DjangoSMTPMailer._pools[key] = SMTPConnectionPool(
+                    size=configuration['pool_size'],
+                    idle_timeout=configuration['idle_timeout'],
+                    health_check=configuration['health_check'],
+                    checkout_timeout=configuration['checkout_timeout'],
+                    connection_options=dict(
+                        (k, configuration[k])
+                        for k in DjangoSMTPMailer.CONNECTION_OPTIONS
+                        if k in configuration))
+
+        return pool
+
+    @staticmethod
+    def close_pools():
+        with DjangoSMTPMailer._pools_lock:
+            pools, DjangoSMTPMailer._pools = DjangoSMTPMailer._pools, {}
+
+        for pool in pools.values():
+            pool.close()
+
     def get_configuration_model(self, data):
         return DjangoSMTPMailer.Configuration(data=data)
 
     def get_request_model(self, data):
         return DjangoSMTPMailer.Request(data=data)
 
+    @staticmethod
+    def build_message(data):
+        message = EmailMultiAlternatives(data['subject'], data['message'],
+                                         data['from_email'],
+                                         [data['recipient']])
+
+        if data.get('html_message'):
+            message.attach_alternative(data['html_message'], 'text/html')
+
+        return message
+
+    def _send(self, messages):
+        attempts = self._configuration['max_retries'] + 1
+
+        for attempt in range(attempts):
+            try:
+                with self._pool.connection() as conn:
+                    return conn.send_messages(messages), None
+            except (smtplib.SMTPException, socket.error) as e:
+                logger.warning(
+                    'failed to send mail on attempt `{0}` of `{1}`: {2}'.
+                    format(attempt + 1, attempts, e))
+                err = e
+
+        return 0, MFAError(_('Could not send mail: {0}'), err)
+
     def execute(self, request):
         assert request.is_valid()
 
-        data = request.validated_data
-
-        res = send_mail(data['subject'], data['message'], data['from_email'],
-                        [data['recipient']])
+        res, err = self._send(
+            [DjangoSMTPMailer.build_message(request.validated_data)])
+        if err:
+            return False, err
 
         if res == 0:
             return False, MFAError(_('Could not send mail'))
 
         return True, None
+
+    def execute_many(self, requests):
+        """
+        Send every request over a single pooled connection, returning the
+        number of messages sent.
+        """
+        messages = []
+        for request in requests:
+            assert request.is_valid()
+            messages.append(
+                DjangoSMTPMailer.build_message(request.validated_data))
+
+        if not messages:
+            return 0, None
+
+        return self._send(messages)
+
+
+atexit.register(DjangoSMTPMailer.close_pools)
@@ -1,4 +1,99 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-# Create your tests here.
+import smtplib
+
+from django.core import mail
+from django.test import SimpleTestCase
+
+from .communications import DjangoSMTPMailer, SMTPConnectionPool
+
+
+class DjangoSMTPMailerTestCase(SimpleTestCase):
+    def setUp(self):
+        DjangoSMTPMailer.close_pools()
+
+    def _request(self, mailer, recipient):
+        return mailer.get_request_model(data={
+            'from_email': 'oss2fa@email.com',
+            'recipient': recipient,
+            'subject': 'Your 2fa access token',
+            'message': 'Your 2fa access token is `12345`',
+        })
+
+    def test_mailers_share_a_pool(self):
+        self.assertIs(
+            DjangoSMTPMailer({})._pool, DjangoSMTPMailer({})._pool)
+        self.assertIsNot(
+            DjangoSMTPMailer({})._pool,
+            DjangoSMTPMailer({'pool_size': 1})._pool)
+
+    def test_can_send_mail(self):
+        mailer = DjangoSMTPMailer({})
+
+        success, err = mailer.execute(
+            self._request(mailer, 'john.doe@email.com'))
+
+        self.assertTrue(success)
+        self.assertIsNone(err)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_can_send_many_mails(self):
+        mailer = DjangoSMTPMailer({})
+
+        sent, err = mailer.execute_many([
+            self._request(mailer, 'john.doe@email.com'),
+            self._request(mailer, 'jane.doe@email.com'),
+        ])
+
+        self.assertEqual(sent, 2)
+        self.assertIsNone(err)
+        self.assertEqual(len(mail.outbox), 2)
+
+
+class SMTPConnectionPoolTestCase(SimpleTestCase):
+    def _pool(self, **kwargs):
+        options = {
+            'size': 1,
+            'idle_timeout': 60,
+            'health_check': True,
+            'checkout_timeout': 0,
+            'connection_options': {},
+        }
+        options.update(kwargs)
+        return SMTPConnectionPool(**options)
+
+    def test_connections_are_reused(self):
+        pool = self._pool()
+
+        with pool.connection() as conn:
+            pass
+
+        with pool.connection() as other:
+            self.assertIs(other, conn)
+
+    def test_idle_connections_expire(self):
+        pool = self._pool(idle_timeout=0)
+
+        with pool.connection() as conn:
+            pass
+
+        with pool.connection() as other:
+            self.assertIsNot(other, conn)
+
+    def test_broken_connections_are_replaced(self):
+        pool = self._pool()
+
+        with self.assertRaises(smtplib.SMTPException):
+            with pool.connection() as conn:
+                raise smtplib.SMTPServerDisconnected()
+
+        with pool.connection() as other:
+            self.assertIsNot(other, conn)
+
+    def test_checkout_is_bounded(self):
+        pool = self._pool()
+
+        with pool.connection():
+            with self.assertRaises(smtplib.SMTPException):
+                pool.acquire()
@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CoreConfig(AppConfig):
@@ -10,3 +11,7 @@ class CoreConfig(AppConfig):
     def ready(self):
         if not self.did_load:
             self.did_load = True
+
+            if settings.MFA_METRICS_ENABLED:
+                from .metrics import instrument
+                instrument()
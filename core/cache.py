@@ -0,0 +1,100 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# backends whose entries are not seen by other processes
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+class BoundedTTLCache(object):
+    """
+    A thread-safe, in-process LRU cache whose entries expire after `ttl`
+    seconds. Once `max_size` entries are stored, the least recently used
+    entry is evicted.
+    """
+
+    def __init__(self, max_size, ttl=None):
+        assert max_size > 0
+
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                return default
+
+            # re-insert the entry so it becomes the most recently used
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self._ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires_at)
+
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self._lock:
+            keys = [
+                k for k, (v, _) in self._entries.items() if predicate(k, v)
+            ]
+            for key in keys:
+                del self._entries[key]
+
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _new_version():
+    # versions start from the clock, so that a version key evicted from the
+    # cache can never bring back what was cached under an old one
+    return int(time.time() * 1000)
+
+
+def get_version(key):
+    """
+    Returns the version stored under `key` in the default cache, which every
+    process sees once the cache backend is shared, starting it if need be.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), None)
+        version = cache.get(key)
+
+    return version
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), None)
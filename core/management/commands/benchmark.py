@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks import micro
+
+
+class Command(BaseCommand):
+    help = 'Run the device module micro-benchmarks, recording them and flagging regressions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names',
+            nargs='*',
+            help='benchmarks to run, out of: {0}'.format(', '.join(
+                micro.get_benchmark_names())))
+        parser.add_argument(
+            '--rounds',
+            type=int,
+            default=micro.DEFAULT_ROUNDS,
+            help='number of timed rounds per benchmark')
+        parser.add_argument(
+            '--min-time',
+            type=float,
+            default=micro.DEFAULT_MIN_TIME,
+            help='minimum seconds per round')
+        parser.add_argument(
+            '--history',
+            default=settings.MFA_BENCHMARK_HISTORY_FILE,
+            help='file runs are recorded in')
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=settings.MFA_BENCHMARK_REGRESSION_THRESHOLD,
+            help='slowdown, as a fraction of the baseline, flagged as a regression')
+        parser.add_argument(
+            '--window',
+            type=int,
+            default=micro.DEFAULT_WINDOW,
+            help='number of recent runs the baseline is taken from')
+        parser.add_argument(
+            '--no-save',
+            action='store_true',
+            help='do not record this run')
+        parser.add_argument(
+            '--fail-on-regression',
+            action='store_true',
+            help='exit with an error when a benchmark regressed')
+
+    def handle(self, *args, **options):
+        unknown = set(options['names']) - set(micro.get_benchmark_names())
+        if unknown:
+            raise CommandError('unknown benchmarks: {0}'.format(', '.join(
+                sorted(unknown))))
+
+        history = micro.load_history(options['history'])
+
+        results = micro.run(options['names'], options['rounds'],
+                            options['min_time'])
+        comparison = micro.compare(results, history, options['threshold'],
+                                   options['window'])
+
+        regressions = []
+        for name, stats in results.items():
+            change = comparison[name]['change']
+
+            line = '{0:<24} {1:>10.2f}us +/- {2:.2f}us ({3} x {4})'.format(
+                name, stats['median'] * 1e6, stats['stddev'] * 1e6,
+                stats['rounds'], stats['iterations'])
+            if change is not None:
+                line += ' {0:+.1%} vs {1:.2f}us'.format(
+                    change, comparison[name]['baseline'] * 1e6)
+
+            if comparison[name]['regression']:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line + ' REGRESSION'))
+            else:
+                self.stdout.write(line)
+
+        if not options['no_save']:
+            micro.save_history(options['history'],
+                               micro.record(history, results))
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError('regressed: {0}'.format(', '.join(regressions)))
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from challenge.models import Challenge
+from enrollment.models import Enrollment
+from tenants.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Mark pending challenges and enrollments past their expiration as expired, ' \
+           'and delete expired idempotency keys'
+
+    EXPIRABLE_MODELS = (Challenge, Enrollment, IdempotencyKey)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='number of rows expired per update')
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0.0,
+            help='seconds to pause between chunks')
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=None,
+            help='keep sweeping, every this many seconds')
+
+    def sweep(self, options):
+        for model in self.EXPIRABLE_MODELS:
+            total = 0
+
+            while True:
+                count = model.expire_stale(options['chunk_size'])
+                total += count
+
+                if count < options['chunk_size']:
+                    break
+
+                time.sleep(options['pause'])
+
+            self.stdout.write('expired `{0}` {1} entities'.format(
+                total, model._meta.verbose_name))
+
+    def handle(self, *args, **options):
+        self.sweep(options)
+
+        while options['interval'] is not None:
+            time.sleep(options['interval'])
+            self.sweep(options)
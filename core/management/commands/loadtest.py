@@ -0,0 +1,78 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from benchmarks.loadtest import LoadTest
+
+
+class Command(BaseCommand):
+    help = 'Load test the integration API end to end, reporting latency and throughput per endpoint as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tenants', type=int, default=1, help='number of tenants seeded')
+        parser.add_argument(
+            '--integrations',
+            type=int,
+            default=1,
+            help='number of integrations seeded per tenant')
+        parser.add_argument(
+            '--clients',
+            type=int,
+            default=10,
+            help='number of clients seeded per integration')
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='number of concurrent workers')
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=10,
+            help='number of challenge and enrollment flows run per worker')
+        parser.add_argument(
+            '--url',
+            default=None,
+            help='API to load, instead of one served from this process')
+        parser.add_argument(
+            '--smtp-host',
+            default='127.0.0.1',
+            help='address the SMTP sink listens on, reachable by the API')
+        parser.add_argument(
+            '--smtp-port',
+            type=int,
+            default=0,
+            help='port the SMTP sink listens on')
+        parser.add_argument(
+            '--dispatchers',
+            type=int,
+            default=2,
+            help='number of threads draining the challenge outbox')
+        parser.add_argument(
+            '--mail-timeout',
+            type=float,
+            default=10,
+            help='seconds to wait for a token to be mailed')
+        parser.add_argument(
+            '--output', default=None, help='file to write the results to')
+
+    def handle(self, *args, **options):
+        results = LoadTest(
+            tenants=options['tenants'],
+            integrations=options['integrations'],
+            clients=options['clients'],
+            concurrency=options['concurrency'],
+            iterations=options['iterations'],
+            url=options['url'],
+            smtp_host=options['smtp_host'],
+            smtp_port=options['smtp_port'],
+            dispatchers=options['dispatchers'],
+            mail_timeout=options['mail_timeout']).run()
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
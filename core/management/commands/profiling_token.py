@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.profiling import issue_token
+
+
+class Command(BaseCommand):
+    help = 'Issue a token profiling a single integration request, sent in its X-MFA-Profile header'
+
+    def handle(self, *args, **options):
+        self.stdout.write(issue_token())
+        self.stderr.write('valid for {0} seconds'.format(
+            settings.MFA_PROFILING_TOKEN_MAX_AGE))
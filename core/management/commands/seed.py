@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand
+
+from benchmarks.seed import Seeder, SEEDED_MODELS
+
+
+class Command(BaseCommand):
+    help = 'Seed clients, devices, enrollments and challenges for capacity testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clients',
+            type=int,
+            default=100000,
+            help='number of clients seeded, over every integration')
+        parser.add_argument(
+            '--tenants', type=int, default=1, help='number of tenants seeded')
+        parser.add_argument(
+            '--integrations',
+            type=int,
+            default=1,
+            help='number of integrations seeded per tenant')
+        parser.add_argument(
+            '--challenges-per-client',
+            type=float,
+            default=20,
+            help='mean number of challenges seeded per client')
+        parser.add_argument(
+            '--abandoned-ratio',
+            type=float,
+            default=0.1,
+            help='share of clients that also abandoned an enrollment')
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help='days of history the seeded rows are spread over')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=Seeder.DEFAULT_CHUNK_SIZE,
+            help='number of clients seeded per transaction')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=Seeder.DEFAULT_BATCH_SIZE,
+            help='number of rows inserted per statement or COPY')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='number of worker processes seeding chunks')
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='seed of the random distributions, for repeatable runs')
+
+    def report(self, totals, elapsed):
+        rows = sum(totals.values())
+
+        self.stdout.write('seeded {0} in {1:.1f}s, {2:.0f} rows/s'.format(
+            ', '.join('`{0}` {1}'.format(totals[model], model._meta.
+                                         verbose_name_plural)
+                      for model in SEEDED_MODELS), elapsed, rows / elapsed
+            if elapsed else 0))
+
+    def handle(self, *args, **options):
+        seeder = Seeder(
+            clients=options['clients'],
+            tenants=options['tenants'],
+            integrations=options['integrations'],
+            challenges_per_client=options['challenges_per_client'],
+            abandoned_ratio=options['abandoned_ratio'],
+            days=options['days'],
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            seed=options['seed'])
+
+        totals, elapsed = seeder.run(progress=self.report)
+
+        self.stdout.write(
+            self.style.SUCCESS('seeded run `{0}`'.format(seeder.run_id)))
+        self.report(totals, elapsed)
@@ -0,0 +1,472 @@
+"""
+Latency histograms for requests and device module hooks, along with the
+statistics of database connection pools, rendered in the Prometheus text
+format.
+
+Every process observes into a registry of its own. When `MFA_METRICS_DIR` is
+set, processes periodically write their registry to a file of their own in
+that directory, and the metrics endpoint of any of them sums every file, so
+that all gunicorn workers are scraped at once. The files of earlier runs
+would be summed in as well, so the directory is cleared by `clear`, which
+the gunicorn master calls before forking its workers (see
+`mfa.gunicorn_conf`).
+"""
+from __future__ import unicode_literals
+
+import atexit
+import errno
+import glob
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.utils import CursorWrapper
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+FILE_NAME_FORMAT = 'metrics_{0}.json'
+FILE_NAME_PATTERN = re.compile(r'metrics_(\d+)\.json$')
+
+# pool statistics are written along with the histograms, under this key
+POOLS_KEY = 'pools'
+
+# `ConnectionPool.stats` key -> name, type and documentation of its metric;
+# gauges are only summed over live processes, and maximums are not summed
+POOL_METRICS = OrderedDict([
+    ('connections', ('mfa_db_pool_connections', 'gauge',
+                     'Open pooled database connections.')),
+    ('in_use', ('mfa_db_pool_connections_in_use', 'gauge',
+                'Pooled database connections checked out.')),
+    ('idle', ('mfa_db_pool_connections_idle', 'gauge',
+              'Pooled database connections waiting to be checked out.')),
+    ('checkouts', ('mfa_db_pool_checkouts_total', 'counter',
+                   'Checkouts of pooled database connections.')),
+    ('timeouts', ('mfa_db_pool_checkout_timeouts_total', 'counter',
+                  'Checkouts that timed out waiting for a connection.')),
+    ('discarded', ('mfa_db_pool_discarded_total', 'counter',
+                   'Pooled database connections closed as stale or broken.')),
+    ('wait_seconds_total', ('mfa_db_pool_checkout_wait_seconds_total',
+                            'counter',
+                            'Time spent waiting to check out connections.')),
+    ('wait_seconds_max', ('mfa_db_pool_checkout_wait_seconds_max', 'gauge',
+                          'Longest wait to check out a connection.')),
+])
+
+_lock = threading.Lock()
+_registry = OrderedDict()
+
+# observations made before a fork belong to the parent only
+_pid = os.getpid()
+_last_flush_at = time.time()
+
+_state = threading.local()
+
+
+class Histogram(object):
+    def __init__(self, name, documentation, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple('{0}'.format(labels[x]) for x in self.labels)
+
+        with _lock:
+            _check_pid()
+
+            # bucket counts are cumulative, followed by the sum and count
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+
+            values[-2] += value
+            values[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - started_at, **labels)
+
+    def collect(self):
+        with _lock:
+            _check_pid()
+            return dict((k, list(v)) for k, v in self._values.items())
+
+
+def _check_pid():
+    global _pid
+
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        for histogram in _registry.values():
+            histogram._values = {}
+
+
+def histogram(name, documentation, labels, buckets=DEFAULT_BUCKETS):
+    if name not in _registry:
+        _registry[name] = Histogram(name, documentation, labels, buckets)
+
+    return _registry[name]
+
+
+REQUEST_DURATION = histogram('mfa_request_duration_seconds',
+                             'Wall time spent handling requests.',
+                             ('view', 'method', 'status'))
+REQUEST_QUERIES = histogram('mfa_request_db_queries',
+                            'Database queries made per request.',
+                            ('view', 'method'), QUERY_COUNT_BUCKETS)
+REQUEST_QUERY_DURATION = histogram(
+    'mfa_request_db_duration_seconds',
+    'Time spent in database queries per request.', ('view', 'method'))
+REQUEST_SERIALIZER_DURATION = histogram(
+    'mfa_request_serializer_duration_seconds',
+    'Time spent validating and representing serializers per request.',
+    ('view', 'method'))
+MODULE_HOOK_DURATION = histogram('mfa_device_module_hook_duration_seconds',
+                                 'Time spent in device module hooks.',
+                                 ('module', 'hook'))
+
+
+def time_module_hook(module, hook):
+    return MODULE_HOOK_DURATION.time(
+        module=module.__class__.__name__, hook=hook)
+
+
+def get_file_path(pid=None):
+    return os.path.join(settings.MFA_METRICS_DIR,
+                        FILE_NAME_FORMAT.format(pid or os.getpid()))
+
+
+def flush():
+    """
+    Writes the registry of this process to its file, replacing it at once so
+    that readers never see a partial file.
+    """
+    global _last_flush_at
+
+    if not settings.MFA_METRICS_DIR:
+        return
+
+    data = dict((name, [[list(k), v] for k, v in x.collect().items()])
+                for name, x in _registry.items())
+    data[POOLS_KEY] = get_pool_stats()
+
+    if not os.path.isdir(settings.MFA_METRICS_DIR):
+        os.makedirs(settings.MFA_METRICS_DIR)
+
+    fd, path = tempfile.mkstemp(dir=settings.MFA_METRICS_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.rename(path, get_file_path())
+
+    _last_flush_at = time.time()
+
+
+def clear():
+    """
+    Removes the files of every process from `MFA_METRICS_DIR`.
+    """
+    if not settings.MFA_METRICS_DIR:
+        return
+
+    for path in glob.glob(get_file_path('*')):
+        try:
+            os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    logger.info('cleared metrics of earlier runs from `{0}`'.format(
+        settings.MFA_METRICS_DIR))
+
+
+def maybe_flush():
+    if time.time() - _last_flush_at >= settings.MFA_METRICS_FLUSH_INTERVAL:
+        try:
+            flush()
+        except (IOError, OSError) as e:
+            logger.warning('failed to flush metrics: {0}'.format(e))
+
+
+def get_pool_stats():
+    """
+    Returns the statistics of the database connection pools of this
+    process, by database alias.
+    """
+    from mfa.db.pooled.base import get_pool_stats
+
+    return dict(get_pool_stats())
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+
+    return True
+
+
+def _read_files():
+    """
+    Yields the pid and data of every file in `MFA_METRICS_DIR`.
+    """
+    for path in glob.glob(get_file_path('*')):
+        match = FILE_NAME_PATTERN.search(path)
+        if match is None:
+            continue
+
+        try:
+            with open(path) as f:
+                yield int(match.group(1)), json.load(f)
+        except (IOError, ValueError):
+            continue
+
+
+def _merge(samples, name, key, values):
+    current = samples[name].get(key)
+    if current is None:
+        samples[name][key] = list(values)
+    elif len(current) == len(values):
+        samples[name][key] = [x + y for x, y in zip(current, values)]
+
+
+def collect():
+    """
+    Returns the values of every histogram, by name and labels, summed over
+    every process writing to `MFA_METRICS_DIR`, or of this process alone.
+    """
+    if not settings.MFA_METRICS_DIR:
+        return dict((name, x.collect()) for name, x in _registry.items())
+
+    flush()
+
+    samples = dict((name, {}) for name in _registry)
+    for _, data in _read_files():
+        for name, entries in data.items():
+            # skip histograms since removed, or since rebucketed
+            if name not in _registry:
+                continue
+
+            size = len(_registry[name].buckets) + 2
+            for key, values in entries:
+                if len(values) == size:
+                    _merge(samples, name, tuple(key), values)
+
+    return samples
+
+
+def collect_pools():
+    """
+    Returns the statistics of the database connection pools, by alias,
+    summed over every process writing to `MFA_METRICS_DIR`, or of this
+    process alone.
+    """
+    if not settings.MFA_METRICS_DIR:
+        return get_pool_stats()
+
+    flush()
+
+    pools = {}
+    for pid, data in _read_files():
+        alive = _is_alive(pid)
+
+        for alias, stats in data.get(POOLS_KEY, {}).items():
+            merged = pools.setdefault(alias, dict.fromkeys(POOL_METRICS, 0))
+
+            for key, (_, kind, _) in POOL_METRICS.items():
+                value = stats.get(key, 0)
+                if key.endswith('_max'):
+                    merged[key] = max(merged[key], value)
+                elif kind == 'counter' or alive:
+                    merged[key] += value
+
+    return pools
+
+
+def _format_labels(names, values):
+    return ','.join('{0}="{1}"'.format(
+        name,
+        value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+                    for name, value in zip(names, values))
+
+
+def _format_bound(bound):
+    return '{0}'.format(float(bound))
+
+
+def render(samples=None, pools=None):
+    samples = collect() if samples is None else samples
+    pools = collect_pools() if pools is None else pools
+
+    lines = []
+    for name, x in _registry.items():
+        lines.append('# HELP {0} {1}'.format(name, x.documentation))
+        lines.append('# TYPE {0} histogram'.format(name))
+
+        for key, values in sorted(samples.get(name, {}).items()):
+            labels = _format_labels(x.labels, key)
+            prefix = labels + ',' if labels else ''
+
+            for bound, count in zip(x.buckets, values):
+                lines.append('{0}_bucket{{{1}le="{2}"}} {3}'.format(
+                    name, prefix, _format_bound(bound), count))
+            lines.append('{0}_bucket{{{1}le="+Inf"}} {2}'.format(
+                name, prefix, values[-1]))
+            lines.append('{0}_sum{{{1}}} {2}'.format(name, labels, values[-2]))
+            lines.append('{0}_count{{{1}}} {2}'.format(name, labels,
+                                                       values[-1]))
+
+    for key, (name, kind, documentation) in POOL_METRICS.items():
+        lines.append('# HELP {0} {1}'.format(name, documentation))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+
+        for alias, stats in sorted(pools.items()):
+            lines.append('{0}{{{1}}} {2}'.format(
+                name, _format_labels(('database', ), (alias, )),
+                stats.get(key, 0)))
+
+    return '\n'.join(lines) + '\n'
+
+
+def _counted_query(method):
+    def wrapper(*args, **kwargs):
+        queries = getattr(_state, 'queries', None)
+        if queries is None:
+            return method(*args, **kwargs)
+
+        started_at = time.time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            queries[0] += 1
+            queries[1] += time.time() - started_at
+
+    return wrapper
+
+
+def _timed_serializer(method):
+    def wrapper(*args, **kwargs):
+        # nested serializers are accounted for by the outermost one
+        depth = getattr(_state, 'serializer_depth', 0)
+        if getattr(_state, 'serializer_seconds', None) is None or depth:
+            return method(*args, **kwargs)
+
+        started_at = time.time()
+        _state.serializer_depth = depth + 1
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _state.serializer_depth = depth
+            _state.serializer_seconds += time.time() - started_at
+
+    return wrapper
+
+
+def instrument_serializers():
+    """
+    Accounts for the time serializers spend validating and representing
+    data, during requests handled by `MetricsMiddleware`.
+    """
+    from rest_framework.serializers import BaseSerializer
+
+    if getattr(BaseSerializer, '_mfa_instrumented', False):
+        return
+
+    BaseSerializer.is_valid = _timed_serializer(BaseSerializer.is_valid)
+    BaseSerializer.data = property(_timed_serializer(BaseSerializer.data.fget))
+    BaseSerializer._mfa_instrumented = True
+
+
+def instrument_queries():
+    """
+    Counts and times the queries made during requests handled by
+    `MetricsMiddleware`, without the query log of debug cursors.
+    """
+    if getattr(CursorWrapper, '_mfa_instrumented', False):
+        return
+
+    CursorWrapper.execute = _counted_query(CursorWrapper.execute)
+    CursorWrapper.executemany = _counted_query(CursorWrapper.executemany)
+    CursorWrapper._mfa_instrumented = True
+
+
+def instrument():
+    instrument_serializers()
+    instrument_queries()
+
+
+class MetricsMiddleware(object):
+    """
+    Observes the wall time, database queries and serializer time of every
+    request, by view.
+    """
+
+    def __init__(self, get_response):
+        if not settings.MFA_METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+
+        instrument()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # the query count and seconds of this request
+        queries = _state.queries = [0, 0.0]
+        _state.serializer_seconds = 0.0
+
+        started_at = time.time()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = time.time() - started_at
+            serializer_seconds = _state.serializer_seconds
+            _state.serializer_seconds = _state.queries = None
+
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unresolved'
+
+        REQUEST_DURATION.observe(
+            duration,
+            view=view,
+            method=request.method,
+            status=response.status_code)
+        REQUEST_QUERIES.observe(queries[0], view=view, method=request.method)
+        REQUEST_QUERY_DURATION.observe(
+            queries[1], view=view, method=request.method)
+        REQUEST_SERIALIZER_DURATION.observe(
+            serializer_seconds, view=view, method=request.method)
+
+        maybe_flush()
+
+        return response
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except (IOError, OSError):
+        pass
+
+
+atexit.register(_flush_at_exit)
@@ -1,6 +1,6 @@
 from __future__ import unicode_literals
 
-from django.db import models
+from django.db import connections, models, router
 
 
 class Entity(models.Model):
@@ -14,3 +14,47 @@ class Entity(models.Model):
 
     class Meta:
         abstract = True
+
+
+def reserve_pk(model):
+    """
+    Draw the next primary key of `model` from its sequence, for rows that
+    must know their pk before they are inserted.
+    """
+    with connections[router.db_for_write(model)].cursor() as cursor:
+        cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s))',
+                       [model._meta.db_table, model._meta.pk.column])
+        return cursor.fetchone()[0]
+
+
+def get_chunk_pks(queryset, chunk_size):
+    return list(
+        queryset.order_by('pk').values_list('pk', flat=True)[:chunk_size])
+
+
+def update_chunk(queryset, chunk_size, **values):
+    """
+    Apply `values` to at most `chunk_size` rows of `queryset`, through a
+    single `UPDATE ... WHERE id IN (...)`, returning the number of rows
+    updated. The filters of `queryset` are applied again by the update, so
+    that rows which stopped matching them in between are left alone.
+    """
+    pks = get_chunk_pks(queryset, chunk_size)
+    if not pks:
+        return 0
+
+    return queryset.filter(pk__in=pks).update(**values)
+
+
+def delete_chunk(queryset, chunk_size):
+    """
+    Delete at most `chunk_size` rows of `queryset`, returning the number of
+    rows deleted. As with `update_chunk`, the filters of `queryset` are
+    applied again by the delete.
+    """
+    pks = get_chunk_pks(queryset, chunk_size)
+    if not pks:
+        return 0
+
+    count, _ = queryset.filter(pk__in=pks).delete()
+    return count
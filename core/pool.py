@@ -0,0 +1,135 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+
+
+class ConnectionPool(object):
+    """
+    A bounded pool of open connections, made by `connect`. Checkouts wait for
+    at most `checkout_timeout` seconds for a connection to be released. Idle
+    connections are closed on checkout once they exceed `idle_timeout`, or
+    when they fail the health check of the pool.
+
+    Subclasses define how their connections are checked, closed, and made
+    ready for reuse on release, and the error raised on checkout timeouts.
+    """
+
+    def __init__(self, connect, size, idle_timeout, health_check,
+                 checkout_timeout):
+        self._connect = connect
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._health_check = health_check
+        self._checkout_timeout = checkout_timeout
+
+        self._idle = []
+        self._created = 0
+        self._condition = threading.Condition()
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_seconds_total = 0.0
+        self._wait_seconds_max = 0.0
+
+    def _is_healthy(self, conn):
+        return True
+
+    def _close(self, conn):
+        conn.close()
+
+    def _reset(self, conn):
+        """
+        Returns whether `conn`, being released, can be handed out again.
+        """
+        return True
+
+    def _timeout_error(self):
+        return RuntimeError('timed out waiting for a pooled connection')
+
+    def _discard(self, conn):
+        self._close(conn)
+
+        with self._condition:
+            self._created -= 1
+            self._discarded += 1
+            self._condition.notify()
+
+    def _checked_out(self, started_at):
+        waited = time.time() - started_at
+
+        with self._condition:
+            self._checkouts += 1
+            self._wait_seconds_total += waited
+            self._wait_seconds_max = max(self._wait_seconds_max, waited)
+
+    def acquire(self):
+        started_at = time.time()
+        deadline = started_at + self._checkout_timeout
+
+        while True:
+            with self._condition:
+                while not self._idle and self._created >= self._size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise self._timeout_error()
+                    self._condition.wait(remaining)
+
+                if not self._idle:
+                    self._created += 1
+                    break
+
+                conn, last_used_at = self._idle.pop()
+
+            # check the connection outside of the lock, as it may block
+            if time.time() - last_used_at > self._idle_timeout or (
+                    self._health_check and not self._is_healthy(conn)):
+                self._discard(conn)
+                continue
+
+            self._checked_out(started_at)
+            return conn
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+
+        self._checked_out(started_at)
+        return conn
+
+    def release(self, conn, broken=False):
+        if broken or not self._reset(conn):
+            self._discard(conn)
+            return
+
+        with self._condition:
+            self._idle.append((conn, time.time()))
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'size': self._size,
+                'connections': self._created,
+                'in_use': self._created - len(self._idle),
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'wait_seconds_total': self._wait_seconds_total,
+                'wait_seconds_max': self._wait_seconds_max,
+            }
+
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+
+        for conn, last_used_at in idle:
+            self._close(conn)
@@ -0,0 +1,230 @@
+"""
+Opt-in profiling of integration requests.
+
+When enabled, a fraction of the requests to integration endpoints is
+profiled, as is any single request carrying a token issued by
+`manage.py profiling_token` in its `X-MFA-Profile` header. Used tokens are
+remembered in the `MFA_PROFILING_TOKEN_CACHE` cache; tokens are refused
+unless it is shared by every worker, as each could use them once otherwise.
+Profiles are written to `MFA_PROFILING_DIR`, named after the view and the
+integration that made the request.
+
+By default, the stack of the request's thread is sampled from another
+thread, and written as collapsed stacks for flame graphs. Samples are taken
+on the wall clock, so time spent waiting on the database or on a mailer is
+accounted for. In `cprofile` mode, every call is traced instead, and the
+profile written as a pstats file.
+
+The middleware is removed from the stack altogether while disabled.
+"""
+from __future__ import unicode_literals
+
+import cProfile
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from .cache import PROCESS_LOCAL_CACHES
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_MFA_PROFILE'
+INTEGRATION_PATH_PREFIX = '/integration/'
+
+TOKEN_SALT = 'core.profiling'
+TOKEN_CACHE_KEY = 'profiling.token.{0}'
+
+MODE_SAMPLE = 'sample'
+MODE_CPROFILE = 'cprofile'
+
+FILE_NAME_FORMAT = '{0}_{1}_{2}_{3}.{4}'
+
+
+def issue_token():
+    return signing.dumps(get_random_string(16), salt=TOKEN_SALT)
+
+
+def verify_token(token):
+    """
+    Returns whether `token` was issued by `issue_token`, has not expired,
+    and was not used before by any worker.
+    """
+    cache = caches[settings.MFA_PROFILING_TOKEN_CACHE]
+    if isinstance(cache, PROCESS_LOCAL_CACHES):
+        logger.warning(
+            'refusing profiling token: the `{0}` cache is not shared by every '
+            'worker'.format(settings.MFA_PROFILING_TOKEN_CACHE))
+        return False
+
+    try:
+        nonce = signing.loads(
+            token,
+            salt=TOKEN_SALT,
+            max_age=settings.MFA_PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+
+    # adding is atomic, so a token profiles a single request of any worker
+    return cache.add(
+        TOKEN_CACHE_KEY.format(nonce), True,
+        settings.MFA_PROFILING_TOKEN_MAX_AGE)
+
+
+class StackSampler(object):
+    """
+    Counts the stacks of the thread that started it, sampled every
+    `interval` seconds from a thread of its own.
+    """
+    extension = 'collapsed'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = defaultdict(int)
+
+        self._thread_id = None
+        self._thread = None
+        self._running = False
+
+    @staticmethod
+    def format_stack(frame):
+        stack = []
+        while frame is not None:
+            stack.append('{0}:{1}'.format(frame.f_code.co_filename,
+                                          frame.f_code.co_name))
+            frame = frame.f_back
+
+        return ';'.join(reversed(stack))
+
+    def _sample(self):
+        while self._running:
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.stacks[StackSampler.format_stack(frame)] += 1
+            del frame
+
+            time.sleep(self.interval)
+
+    def start(self):
+        self._thread_id = threading.current_thread().ident
+        self._running = True
+
+        self._thread = threading.Thread(
+            target=self._sample, name='profiling-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('{0} {1}\n'.format(stack, count).encode('utf-8'))
+
+
+class TracingProfiler(object):
+    """
+    Traces every call made by the thread that started it.
+    """
+    extension = 'prof'
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def dump(self, path):
+        self._profile.dump_stats(path)
+
+
+def create_profiler():
+    if settings.MFA_PROFILING_MODE == MODE_CPROFILE:
+        return TracingProfiler()
+
+    return StackSampler(settings.MFA_PROFILING_INTERVAL)
+
+
+def _clean(value):
+    return re.sub(r'[^\w.-]', '_', '{0}'.format(value))
+
+
+def get_file_path(view, uid, extension):
+    return os.path.join(settings.MFA_PROFILING_DIR,
+                        FILE_NAME_FORMAT.format(
+                            timezone.now().strftime('%Y%m%dT%H%M%S%f'),
+                            _clean(view), _clean(uid), os.getpid(),
+                            extension))
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles the views of sampled integration requests, and of those that
+    ask for it.
+    """
+
+    def __init__(self, get_response):
+        if not settings.MFA_PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+
+        self.get_response = get_response
+
+    @staticmethod
+    def should_profile(request):
+        if not request.path_info.startswith(INTEGRATION_PATH_PREFIX):
+            return False
+
+        token = request.META.get(PROFILE_HEADER)
+        if token and verify_token(token):
+            return True
+
+        return random.random() < settings.MFA_PROFILING_SAMPLE_RATE
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if ProfilingMiddleware.should_profile(request):
+            request.profiler = create_profiler()
+            request.profiler.start()
+
+        return None
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        profiler = getattr(request, 'profiler', None)
+        if profiler is None:
+            return response
+
+        profiler.stop()
+
+        match = request.resolver_match
+        path = get_file_path(
+            match.url_name or match.view_name,
+            getattr(request.user, 'uid', None) or 'anonymous',
+            profiler.extension)
+
+        try:
+            if not os.path.isdir(settings.MFA_PROFILING_DIR):
+                os.makedirs(settings.MFA_PROFILING_DIR)
+            profiler.dump(path)
+        except (IOError, OSError) as e:
+            logger.warning('failed to write profile: {0}'.format(e))
+        else:
+            logger.info('profiled `{0}` to `{1}`'.format(request.path, path))
+
+        return response
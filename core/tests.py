@@ -1 +1,348 @@
-# Create your tests here.
+import json
+import os
+import shutil
+import smtplib
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from benchmarks import micro
+from benchmarks.loadtest import summarize
+from benchmarks.seed import Seeder, seed_chunk
+from benchmarks.smtp import SMTPSink
+from challenge.models import Challenge
+from tenants.models import Tenant, Integration, Client
+from . import metrics, profiling
+from .cache import BoundedTTLCache
+
+
+class BoundedTTLCacheTestCase(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        cache = BoundedTTLCache(max_size=2)
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expires_entries(self):
+        cache = BoundedTTLCache(max_size=2, ttl=0.01)
+
+        cache.set('a', 1)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+@override_settings(MFA_METRICS_ENABLED=True)
+class MetricsTestCase(APITestCase):
+    def setUp(self):
+        self.integration = Integration.create(
+            tenant=Tenant.create(
+                name='Test Tenant',
+                email='john.doe@email.com',
+                password='john.doe'),
+            name='Test Integration',
+            notes='Test Notes')
+
+        self.client.force_authenticate(
+            user=self.integration, token=self.integration)
+
+    def get_count(self, histogram, *key):
+        values = histogram.collect().get(key)
+        return values[-1] if values else 0
+
+    def test_requests_are_observed(self):
+        key = ('device-kind-list', 'GET')
+        count = self.get_count(metrics.REQUEST_DURATION, *(key + ('200', )))
+        queries = metrics.REQUEST_QUERIES.collect().get(key, [0, 0])[-2]
+
+        self.client.get(reverse('device-kind-list'))
+
+        # the device kinds are listed in a single query
+        self.assertEqual(
+            metrics.REQUEST_QUERIES.collect()[key][-2], queries + 1)
+
+        self.assertEqual(
+            self.get_count(metrics.REQUEST_DURATION, *(key + ('200', ))),
+            count + 1)
+        for histogram in (metrics.REQUEST_QUERIES,
+                          metrics.REQUEST_QUERY_DURATION,
+                          metrics.REQUEST_SERIALIZER_DURATION):
+            self.assertGreater(self.get_count(histogram, *key), 0)
+
+        res = self.client.get(reverse('metrics'))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn(
+            'mfa_request_duration_seconds_count{view="device-kind-list",'
+            'method="GET",status="200"}', res.content.decode('utf-8'))
+
+    def test_metrics_are_only_served_to_scrapers(self):
+        url = reverse('metrics')
+
+        with override_settings(MFA_METRICS_TOKEN='secret'):
+            res = self.client.get(url, REMOTE_ADDR='10.0.0.1')
+            self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+            res = self.client.get(
+                url, REMOTE_ADDR='10.0.0.1', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        with override_settings(MFA_METRICS_ENABLED=False):
+            res = self.client.get(url)
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_workers_are_aggregated(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        with override_settings(MFA_METRICS_DIR=directory):
+            with open(metrics.get_file_path(1), 'w') as f:
+                json.dump({
+                    metrics.MODULE_HOOK_DURATION.name:
+                    [[['OTPDeviceKindModule', 'challenge_create'],
+                      [0] * 11 + [2.0, 1]]]
+                }, f)
+
+            metrics.MODULE_HOOK_DURATION.observe(
+                1.0, module='OTPDeviceKindModule', hook='challenge_create')
+            values = metrics.collect()[metrics.MODULE_HOOK_DURATION.name][(
+                'OTPDeviceKindModule', 'challenge_create')]
+
+            self.assertTrue(os.path.exists(metrics.get_file_path()))
+
+        self.assertGreaterEqual(values[-1], 2)
+        self.assertGreaterEqual(values[-2], 3.0)
+
+    def test_pool_gauges_of_dead_workers_are_dropped(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+
+        with override_settings(MFA_METRICS_DIR=directory):
+            for pid in (1, dead.pid):
+                with open(metrics.get_file_path(pid), 'w') as f:
+                    json.dump({
+                        metrics.POOLS_KEY: {
+                            'default': {
+                                'in_use': 2,
+                                'checkouts': 3,
+                                'wait_seconds_max': pid,
+                            }
+                        }
+                    }, f)
+
+            stats = metrics.collect_pools()['default']
+
+        self.assertEqual(stats['in_use'], 2)
+        self.assertEqual(stats['checkouts'], 6)
+        self.assertEqual(stats['wait_seconds_max'], max(1, dead.pid))
+
+    def test_files_of_earlier_runs_are_cleared(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        other = os.path.join(directory, 'other.json')
+        open(other, 'w').close()
+
+        with override_settings(MFA_METRICS_DIR=directory):
+            open(metrics.get_file_path(1), 'w').close()
+            metrics.clear()
+
+            self.assertFalse(os.path.exists(metrics.get_file_path(1)))
+        self.assertTrue(os.path.exists(other))
+
+
+class ProfilingTestCase(APITestCase):
+    def setUp(self):
+        self.integration = Integration.create(
+            tenant=Tenant.create(
+                name='Test Tenant',
+                email='john.doe@email.com',
+                password='john.doe'),
+            name='Test Integration',
+            notes='Test Notes')
+
+        self.client.force_authenticate(
+            user=self.integration, token=self.integration)
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def get_profiles(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_sampled_requests_are_profiled(self):
+        with override_settings(
+                MFA_PROFILING_ENABLED=True,
+                MFA_PROFILING_SAMPLE_RATE=1.0,
+                MFA_PROFILING_DIR=self.directory):
+            self.client.get(reverse('challenge-detail', args=[1]))
+            self.client.get(reverse('device-kind-list'))
+
+        profiles = self.get_profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].endswith('_challenge-detail_{0}_{1}.collapsed'.
+                                             format(self.integration.uid,
+                                                    os.getpid())))
+
+    def get_token_caches(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+
+        return dict(
+            settings.CACHES,
+            tokens={
+                'BACKEND':
+                'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            })
+
+    def test_requests_are_profiled_once_on_demand(self):
+        token = profiling.issue_token()
+
+        with override_settings(
+                MFA_PROFILING_ENABLED=True,
+                MFA_PROFILING_MODE=profiling.MODE_CPROFILE,
+                MFA_PROFILING_DIR=self.directory,
+                MFA_PROFILING_TOKEN_CACHE='tokens',
+                CACHES=self.get_token_caches()):
+            for _ in range(2):
+                self.client.get(
+                    reverse('challenge-detail', args=[1]),
+                    HTTP_X_MFA_PROFILE=token)
+            self.client.get(
+                reverse('challenge-detail', args=[1]),
+                HTTP_X_MFA_PROFILE=token + 'x')
+
+        profiles = self.get_profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].endswith('.prof'))
+
+    def test_tokens_need_a_shared_cache(self):
+        token = profiling.issue_token()
+
+        with override_settings(
+                MFA_PROFILING_TOKEN_CACHE='tokens',
+                CACHES=self.get_token_caches()):
+            self.assertTrue(profiling.verify_token(token))
+            self.assertFalse(profiling.verify_token(token))
+
+        # each worker would remember the token in a cache of its own
+        with override_settings(CACHES={
+                'default': {
+                    'BACKEND':
+                    'django.core.cache.backends.locmem.LocMemCache',
+                }
+        }):
+            self.assertFalse(profiling.verify_token(profiling.issue_token()))
+
+    def test_sampler_collapses_stacks(self):
+        sampler = profiling.StackSampler(0.001)
+
+        sampler.start()
+        deadline = time.time() + 0.05
+        while time.time() < deadline:
+            pass
+        sampler.stop()
+
+        # samples may also be taken while the sampler is being stopped
+        self.assertTrue(
+            any(x.endswith(':test_sampler_collapses_stacks')
+                for x in sampler.stacks))
+
+
+class LoadTestTestCase(SimpleTestCase):
+    def test_summarize_endpoints(self):
+        samples = [('challenge-list', x / 100.0, x != 100)
+                   for x in range(1, 101)]
+
+        summary = summarize(samples, 2.0)['challenge-list']
+
+        self.assertEqual(summary['requests'], 100)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['throughput'], 50.0)
+        self.assertEqual((summary['p50'], summary['p95'], summary['p99']),
+                         (0.5, 0.95, 0.99))
+
+    def test_sink_receives_mail(self):
+        sink = SMTPSink()
+        sink.start()
+        self.addCleanup(sink.stop)
+
+        smtp = smtplib.SMTP(sink.host, sink.port)
+        smtp.sendmail('oss2fa@email.com', ['John.Doe@email.com'],
+                      'Subject: token\n\nYour token is 12345')
+        smtp.quit()
+
+        self.assertEqual(
+            sink.wait_for('john.doe@email.com', 5), 'Your token is 12345')
+        self.assertIsNone(sink.wait_for('john.doe@email.com', 0))
+
+
+class MicroBenchmarkTestCase(SimpleTestCase):
+    def test_benchmarks_do_not_query_the_database(self):
+        results = micro.run(rounds=2, min_time=0.001)
+
+        self.assertEqual(list(results), micro.get_benchmark_names())
+        for stats in results.values():
+            self.assertEqual(stats['rounds'], 2)
+            self.assertLessEqual(stats['min'], stats['median'])
+
+    def test_regressions_are_flagged(self):
+        history = []
+        for median in (1.0, 1.1, 0.9, 5.0):
+            micro.record(history, {'otp_challenge_complete': {'median': median}})
+
+        self.assertEqual(
+            micro.get_baseline(history, 'otp_challenge_complete', window=3),
+            1.1)
+        self.assertIsNone(micro.get_baseline(history, 'email_format_message'))
+
+        comparison = micro.compare({
+            'otp_challenge_complete': {'median': 1.2},
+            'email_format_message': {'median': 1.0},
+        }, history[:3], threshold=0.1)
+
+        self.assertTrue(comparison['otp_challenge_complete']['regression'])
+        self.assertAlmostEqual(comparison['otp_challenge_complete']['change'],
+                               0.2)
+        self.assertFalse(comparison['email_format_message']['regression'])
+
+        comparison = micro.compare({
+            'otp_challenge_complete': {'median': 1.05}
+        }, history[:3], threshold=0.1)
+        self.assertFalse(comparison['otp_challenge_complete']['regression'])
+
+
+class SeedTestCase(TestCase):
+    def test_seed_chunk(self):
+        seeder = Seeder(20, chunk_size=10, challenges_per_client=5, seed=1)
+
+        tasks = seeder.get_tasks()
+        self.assertEqual([x['count'] for x in tasks], [10, 10])
+
+        counts = seed_chunk(tasks[0])
+        self.assertEqual(counts[Client], 10)
+
+        challenges = Challenge.objects.filter(
+            client__integration_id=tasks[0]['integration_pk'])
+        self.assertEqual(challenges.count(), counts[Challenge])
+        self.assertTrue(
+            all(x.created_at < x.expires_at for x in challenges))
+        self.assertTrue(
+            all(x.device.client_id == x.client_id for x in challenges))
@@ -1 +1,29 @@
-# Create your views here.
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from . import metrics as mfa_metrics
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def is_metrics_scraper(request):
+    if request.META.get('REMOTE_ADDR') in settings.MFA_METRICS_ALLOWED_IPS:
+        return True
+
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(settings.MFA_METRICS_TOKEN) and constant_time_compare(
+        authorization, 'Bearer {0}'.format(settings.MFA_METRICS_TOKEN))
+
+
+def metrics(request):
+    if not settings.MFA_METRICS_ENABLED:
+        raise Http404()
+
+    if not is_metrics_scraper(request):
+        return HttpResponseForbidden()
+
+    return HttpResponse(
+        mfa_metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
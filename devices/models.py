@@ -14,11 +14,15 @@ class DeviceKind(models.Model):
     configuration = JSONField(blank=True, null=True)
     description = models.TextField()
 
-    def get_module(self):
+    def load_module(self):
         parts = self.module.rsplit('.', 1)
         klass = getattr(importlib.import_module(parts[0]), parts[1])
         return klass(self.configuration)
 
+    def get_module(self):
+        from .registry import module_registry
+        return module_registry.get(self)
+
 
 class Device(Entity):
     kind = models.ForeignKey(DeviceKind, related_name='devices')
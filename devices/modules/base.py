@@ -12,6 +12,11 @@ from policy.models import Configuration
 class DeviceKindModule(object):
     __metaclass__ = ABCMeta
 
+    # whether `challenge_create` delivers something to the client, such as
+    # an email; if not, challenges are created without going through the
+    # dispatcher, and can be completed as soon as they are returned
+    delivers_challenges = True
+
     def __init__(self, configuration):
         self._configuration, err = self.get_configuration_model(configuration)
         if err:
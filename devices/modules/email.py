@@ -53,6 +53,24 @@ class EmailDeviceKindModule(DeviceKindModule):
     def mask_address(value):
         return value.split('@', 1)[1].lower()
 
+    @staticmethod
+    def format_message(address, token, device_kind_options):
+        """
+        Build the communication module request for mailing `token` to
+        `address`.
+        """
+        data = {
+            'from_email': device_kind_options['from_email'],
+            'recipient': address,
+            'subject': device_kind_options['subject'],
+            'message': device_kind_options['message'].format(token=token),
+        }
+
+        if device_kind_options.get('html_message'):
+            data['html_message'] = device_kind_options['html_message'].format(
+                token=token)
+
+        return data
 
     def _send_secure_token(self, address, policy, device_kind_options):
         # get instance of the communication module
@@ -68,18 +86,9 @@ class EmailDeviceKindModule(DeviceKindModule):
 
         # obtain the module request model
         mdl_instance = mdl.get_instance()
-        req = mdl_instance.get_request_model(data={
-            'from_email':
-            device_kind_options['from_email'],
-            'recipient':
-            address,
-            'subject':
-            device_kind_options['subject'],
-            'message':
-            device_kind_options['message'].format(token=tk),
-            'html_message':
-            device_kind_options['html_message'].format(token=tk),
-        })
+        req = mdl_instance.get_request_model(
+            data=EmailDeviceKindModule.format_message(
+                address, tk, device_kind_options))
 
         if not req.is_valid():
             return False, errors.MFAMissingInformationError(
@@ -206,7 +215,7 @@ class EmailDeviceKindModule(DeviceKindModule):
 
         # get the device kind details
         device_kind_options, err = self.get_configuration_model(
-            challenge.device.kind.options)
+            challenge.device.kind.configuration)
         if err:
             return False, err
 
@@ -221,6 +230,7 @@ class EmailDeviceKindModule(DeviceKindModule):
             data={'token': tk})
 
         assert private_details.is_valid()
+        challenge.private_details = private_details.validated_data
 
         return True, None
 
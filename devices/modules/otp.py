@@ -1,16 +1,26 @@
 from __future__ import unicode_literals
 
+import hashlib
+import hmac
+import json
 import logging
+import struct
+import time
 
 import pyotp
 import qrcode
+import qrcode.image.svg
 import base64
 import cStringIO
 
+from django.conf import settings
+from django.core.cache import caches
 from django.db import transaction
+from django.utils.crypto import constant_time_compare, salted_hmac
 from rest_framework import serializers
 
 from core import errors
+from core.cache import BoundedTTLCache
 from devices.models import Device
 from enrollment.models import Enrollment
 from .base import DeviceKindModule
@@ -29,6 +39,12 @@ class OTPConfiguration(serializers.Serializer):
     DEFAULT_SECRET_LENGTH = 32
     DEFAULT_VALID_WINDOW = 1
 
+    QR_CODE_MODE_INLINE = 'inline'
+    QR_CODE_MODE_LAZY = 'lazy'
+
+    QR_CODE_MODE_CHOICES = (
+        (QR_CODE_MODE_INLINE, 'inline'),
+        (QR_CODE_MODE_LAZY, 'lazy'), )
 
     ALGORITHM_CHOICES = (
         (ALGORITHM_SHA1, 'sha1'),
@@ -41,6 +57,8 @@ class OTPConfiguration(serializers.Serializer):
         choices=ALGORITHM_CHOICES, initial=ALGORITHM_SHA1)
     secret_length = serializers.IntegerField(initial=DEFAULT_SECRET_LENGTH)
     valid_window = serializers.IntegerField(initial=DEFAULT_VALID_WINDOW)
+    qr_code_mode = serializers.ChoiceField(
+        choices=QR_CODE_MODE_CHOICES, default=QR_CODE_MODE_INLINE)
 
 
 class OTPDeviceHandlerEnrollmentCompletion(serializers.Serializer):
@@ -86,9 +104,191 @@ class OTPDevicePrivateChallengeDetails(serializers.Serializer):
     token = serializers.CharField()
 
 
+class TOTPReplayGuard(object):
+    """
+    Records the last accepted time-step of every OTP secret, so that a token
+    cannot be used twice within its validity window. Steps are tracked in a
+    local LRU, and claimed through a shared cache so that every node sees
+    them.
+    """
+    LAST_STEP_CACHE_KEY = 'otp.replay.{0}'
+    STEP_CACHE_KEY = 'otp.replay.{0}.{1}'
+
+    def __init__(self, local_size, cache_alias):
+        self._local = BoundedTTLCache(max_size=local_size)
+        self._cache_alias = cache_alias
+
+    @staticmethod
+    def get_secret_fingerprint(secret):
+        # secrets are never used as cache keys; devices and enrollments for
+        # the same secret share their fingerprint
+        return salted_hmac('devices.modules.otp.TOTPReplayGuard',
+                           secret.rstrip('=').upper()).hexdigest()
+
+    def accept(self, secret, time_step, ttl):
+        fingerprint = TOTPReplayGuard.get_secret_fingerprint(secret)
+
+        last_step = self._local.get(fingerprint)
+        if last_step is not None and time_step <= last_step:
+            return False
+
+        cache = caches[self._cache_alias]
+        last_step_key = TOTPReplayGuard.LAST_STEP_CACHE_KEY.format(fingerprint)
+
+        last_step = cache.get(last_step_key)
+        if last_step is not None and time_step <= last_step:
+            self._local.set(fingerprint, last_step, ttl)
+            return False
+
+        # claiming the step is atomic, so only one node can accept it
+        if not cache.add(
+                TOTPReplayGuard.STEP_CACHE_KEY.format(fingerprint, time_step),
+                True, ttl):
+            return False
+
+        cache.set(last_step_key, time_step, ttl)
+        self._local.set(fingerprint, time_step, ttl)
+
+        return True
+
+    def clear(self):
+        self._local.clear()
+
+
+replay_guard = TOTPReplayGuard(
+    local_size=settings.MFA_OTP_REPLAY_LOCAL_CACHE_SIZE,
+    cache_alias=settings.MFA_OTP_REPLAY_CACHE)
+
+
+class TOTPKey(object):
+    """
+    Decoded key material for a TOTP secret.
+    """
+    __slots__ = ('secret', 'key', 'digits', 'interval')
+
+    def __init__(self, secret, digits, interval):
+        padding = '=' * (-len(secret) % 8)
+
+        self.secret = secret
+        self.key = base64.b32decode(secret + padding, casefold=True)
+        self.digits = digits
+        self.interval = interval
+
+    @staticmethod
+    def from_details(details):
+        return TOTPKey(details['secret'], details['digits'],
+                       details['interval'])
+
+
+class TOTPVerificationEngine(object):
+    """
+    Verifies TOTP tokens against decoded key material, which is cached per
+    device so that device details are neither validated nor decoded on
+    every verification.
+    """
+
+    def __init__(self, key_cache_size):
+        self._keys = BoundedTTLCache(max_size=key_cache_size)
+
+    def get_key(self, device):
+        # device details only change along with `last_updated_at`
+        cache_key = (device.pk, device.last_updated_at)
+
+        key = self._keys.get(cache_key)
+        if key is None:
+            details, err = device.get_model()
+            if err:
+                return None, err
+
+            key = TOTPKey.from_details(details)
+            self._keys.set(cache_key, key)
+
+        return key, None
+
+    @staticmethod
+    def generate(key, step):
+        digest = bytearray(
+            hmac.new(key.key, struct.pack(b'>Q', step), hashlib.sha1)
+            .digest())
+
+        offset = digest[-1] & 0xf
+        code = struct.unpack(b'>I', bytes(digest[offset:offset + 4]))[0]
+
+        return '{0:0{1}d}'.format((code & 0x7fffffff) % 10**key.digits,
+                                  key.digits)
+
+    @staticmethod
+    def candidates(key, valid_window, for_time=None):
+        current_step = int(
+            time.time() if for_time is None else for_time) // key.interval
+
+        return [(step, TOTPVerificationEngine.generate(key, step))
+                for step in range(current_step - valid_window,
+                                  current_step + valid_window + 1)]
+
+    @staticmethod
+    def verify(key, token, valid_window, for_time=None):
+        """
+        Return the time-step that `token` is valid for, or None. Every
+        candidate is compared, so timing does not reveal which one matched.
+        """
+        matched_step = None
+        for step, code in TOTPVerificationEngine.candidates(
+                key, valid_window, for_time):
+            if constant_time_compare(code, token):
+                matched_step = step
+
+        return matched_step
+
+    @staticmethod
+    def verify_many(entries, for_time=None):
+        """
+        Verify `(key, token, valid_window)` entries against a single point in
+        time, returning the matched time-step, or None, for each.
+        """
+        for_time = time.time() if for_time is None else for_time
+
+        return [
+            TOTPVerificationEngine.verify(key, token, valid_window, for_time)
+            for key, token, valid_window in entries
+        ]
+
+
+verification_engine = TOTPVerificationEngine(
+    key_cache_size=settings.MFA_OTP_KEY_CACHE_SIZE)
+
+
 class OTPDeviceKindModule(DeviceKindModule):
+    delivers_challenges = False
+
     @staticmethod
-    def generate_qr_code(provision_uri):
+    def verify(key, token, valid_window):
+        step = TOTPVerificationEngine.verify(key, token, valid_window)
+        if step is None:
+            return False
+
+        return replay_guard.accept(
+            key.secret, step, key.interval * (2 * valid_window + 2))
+
+    QR_CODE_FORMAT_PNG = 'png'
+    QR_CODE_FORMAT_SVG = 'svg'
+    QR_CODE_FORMAT_MATRIX = 'matrix'
+
+    QR_CODE_CONTENT_TYPES = {
+        QR_CODE_FORMAT_PNG: 'image/png',
+        QR_CODE_FORMAT_SVG: 'image/svg+xml',
+        QR_CODE_FORMAT_MATRIX: 'application/json',
+    }
+
+    @staticmethod
+    def render_qr_code(provision_uri, fmt=QR_CODE_FORMAT_PNG):
+        """
+        Render the qr code for a provisioning uri as `png`, `svg` or as a
+        json `matrix` of modules, returning its content and content type.
+        Renders embed the shared secret, so they are never cached.
+        """
+        assert fmt in OTPDeviceKindModule.QR_CODE_CONTENT_TYPES
+
         # create a qr code for the provisioning uri
         qr = qrcode.QRCode(
             error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -97,14 +297,32 @@ class OTPDeviceKindModule(DeviceKindModule):
         qr.add_data(provision_uri)
         qr.make(fit=True)
 
-        img = qr.make_image(fill_color="black", back_color="white")
+        if fmt == OTPDeviceKindModule.QR_CODE_FORMAT_MATRIX:
+            matrix = qr.get_matrix()
+            return json.dumps({
+                'size': len(matrix),
+                'rows': [''.join('1' if x else '0' for x in row)
+                         for row in matrix],
+            }), OTPDeviceKindModule.QR_CODE_CONTENT_TYPES[fmt]
+
         img_buffer = cStringIO.StringIO()
-        img.save(img_buffer, format='png')
 
-        res = base64.b64encode(img_buffer.getvalue())
+        if fmt == OTPDeviceKindModule.QR_CODE_FORMAT_SVG:
+            img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+            img.save(img_buffer)
+        else:
+            img = qr.make_image(fill_color="black", back_color="white")
+            img.save(img_buffer, format='png')
+
+        res = img_buffer.getvalue()
         img_buffer.close()
 
-        return res
+        return res, OTPDeviceKindModule.QR_CODE_CONTENT_TYPES[fmt]
+
+    @staticmethod
+    def generate_qr_code(provision_uri):
+        content, _ = OTPDeviceKindModule.render_qr_code(provision_uri)
+        return base64.b64encode(content)
 
     def get_configuration_model(self, data):
         return DeviceKindModule.build_model_instance(OTPConfiguration, data)
@@ -172,8 +390,10 @@ class OTPDeviceKindModule(DeviceKindModule):
                 'failed to create enrollment private details: {0}'.format(err))
             return err
 
-        # check if we should generate a qr-code
-        should_gen_qr = enrollment.device_selection.options.get('generate_qr_code', False)
+        # check if we should generate a qr-code; lazily rendered qr codes are
+        # served by the enrollment qr code endpoint instead
+        should_gen_qr = enrollment.device_selection.options.get('generate_qr_code', False) and \
+            self._configuration['qr_code_mode'] == OTPConfiguration.QR_CODE_MODE_INLINE
 
         # store the public details
         public_details, err = self.get_enrollment_public_details_model({
@@ -207,15 +427,9 @@ class OTPDeviceKindModule(DeviceKindModule):
                     format(enrollment.pk, err))
                 return False, err
 
-            # create the provisioning uri
-            totp = pyotp.TOTP(
-                s=private_details['secret'],
-                digits=private_details['digits'],
-                interval=private_details['interval'])
-
-            ok = totp.verify(
-                data['token'],
-                valid_window=self._configuration['valid_window'])
+            ok = OTPDeviceKindModule.verify(
+                TOTPKey.from_details(private_details), data['token'],
+                self._configuration['valid_window'])
             if not ok:
                 logger.error(
                     'failed to verify OTP `{0}` as valid for enrollment `{1}`'.
@@ -267,15 +481,12 @@ class OTPDeviceKindModule(DeviceKindModule):
         logger.info('completing OTP challenge `{0}` with `{1}`'.format(
             challenge.pk, data))
 
-        # obtain the device module, and create the OTP entity
-        device = challenge.device.get_model()
+        # obtain the decoded key material for the device
+        key, err = verification_engine.get_key(challenge.device)
+        if err:
+            return False, err
 
-        otp = pyotp.TOTP(
-            s=device['secret'],
-            digits=device['digits'],
-            interval=device['interval'])
-
-        # verify the token given the validity window it was registered
-        return otp.verify(
-            data['token'],
-            valid_window=self._configuration['valid_window']), None
+        # verify the token given the validity window it was registered, and
+        # that it has not been accepted before
+        return OTPDeviceKindModule.verify(
+            key, data['token'], self._configuration['valid_window']), None
@@ -0,0 +1,78 @@
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import logging
+import threading
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceKindModuleRegistry(object):
+    """
+    Process-wide registry of device kind module instances, keyed by device
+    kind and a hash of its configuration, so that a module is imported and
+    its configuration validated once rather than on every use.
+    """
+
+    def __init__(self):
+        self._modules = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_configuration_hash(configuration):
+        return hashlib.sha1(
+            json.dumps(
+                configuration, sort_keys=True,
+                cls=DjangoJSONEncoder)).hexdigest()
+
+    def get(self, device_kind):
+        # unsaved device kinds cannot be invalidated, so never cache them
+        if device_kind.pk is None:
+            return device_kind.load_module()
+
+        key = (device_kind.pk,
+               self.get_configuration_hash(device_kind.configuration))
+
+        module = self._modules.get(key)
+        if module is None:
+            module = device_kind.load_module()
+            with self._lock:
+                self._modules[key] = module
+
+        return module
+
+    def invalidate(self, device_kind_pk):
+        with self._lock:
+            for key in [k for k in self._modules if k[0] == device_kind_pk]:
+                del self._modules[key]
+
+    def clear(self):
+        with self._lock:
+            self._modules.clear()
+
+    def warm(self):
+        from .models import DeviceKind
+
+        try:
+            device_kinds = list(DeviceKind.objects.all())
+        except DatabaseError as e:
+            logger.warning(
+                'could not warm device kind modules: {0}'.format(e))
+            return 0
+
+        for device_kind in device_kinds:
+            try:
+                self.get(device_kind)
+            except Exception as e:
+                logger.error(
+                    'could not load module for device kind `{0}`: {1}'.format(
+                        device_kind.name, e))
+
+        return len(self._modules)
+
+
+module_registry = DeviceKindModuleRegistry()
@@ -23,3 +23,19 @@ class DeviceSerializer(serializers.ModelSerializer):
             'pk',
             'kind',
             'name', )
+
+
+class DeviceKindSummarySerializer(serializers.Serializer):
+    pk = serializers.IntegerField(read_only=True)
+    name = serializers.CharField(read_only=True)
+    description = serializers.CharField(read_only=True)
+
+
+class DeviceSummarySerializer(serializers.Serializer):
+    """
+    A read-only device representation for hot paths; expects `kind` to have
+    been loaded along with the device.
+    """
+    pk = serializers.IntegerField(read_only=True)
+    kind = DeviceKindSummarySerializer(read_only=True)
+    name = serializers.CharField(read_only=True)
@@ -0,0 +1,13 @@
+from __future__ import unicode_literals
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import DeviceKind
+from .registry import module_registry
+
+
+@receiver(post_save, sender=DeviceKind)
+@receiver(post_delete, sender=DeviceKind)
+def on_device_kind_changed_invalidate_module(sender, instance, **kwargs):
+    module_registry.invalidate(instance.pk)
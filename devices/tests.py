@@ -1 +1,175 @@
-# Create your tests here.
+import datetime
+
+import pyotp
+from django.core import mail
+from django.test import TestCase
+from django.utils import timezone
+
+from challenge.models import Challenge
+from contrib.communications import DjangoSMTPMailer
+from contrib.models import Module
+from enrollment.models import Enrollment
+from tenants.models import Tenant, Integration, Client
+from .models import Device, DeviceKind
+from .modules.otp import OTPConfiguration, TOTPReplayGuard, TOTPKey, \
+    TOTPVerificationEngine
+from .registry import module_registry
+
+
+class DeviceKindModuleRegistryTestCase(TestCase):
+    def setUp(self):
+        module_registry.clear()
+
+        self.device_kind = DeviceKind.objects.create(
+            name='OTP',
+            module='devices.modules.otp.OTPDeviceKindModule',
+            description='OTP Devices',
+            configuration={
+                'issuer_name': 'pymfa',
+                'digits': 6,
+                'algorithm': OTPConfiguration.ALGORITHM_SHA1,
+                'secret_length': 32,
+                'valid_window': 1,
+                'interval': 30,
+            })
+
+    def test_module_instances_are_reused(self):
+        module = self.device_kind.get_module()
+
+        self.assertIs(
+            DeviceKind.objects.get(pk=self.device_kind.pk).get_module(),
+            module)
+
+    def test_module_instances_are_invalidated_on_save(self):
+        module = self.device_kind.get_module()
+
+        self.device_kind.configuration['digits'] = 8
+        self.device_kind.save()
+
+        reloaded = DeviceKind.objects.get(pk=self.device_kind.pk).get_module()
+        self.assertIsNot(reloaded, module)
+        self.assertEqual(reloaded._configuration['digits'], 8)
+
+    def test_warm_loads_every_device_kind(self):
+        self.assertEqual(module_registry.warm(), 1)
+
+
+class EmailDeviceKindModuleTestCase(TestCase):
+    def setUp(self):
+        module_registry.clear()
+        DjangoSMTPMailer.close_pools()
+
+        mailer = '{0}.{1}'.format(DjangoSMTPMailer.__module__,
+                                  DjangoSMTPMailer.__name__)
+        Module.objects.create(name=mailer, configuration={})
+
+        integration = Integration.create(
+            tenant=Tenant.create(
+                name='Test Tenant',
+                email='john.doe@email.com',
+                password='john.doe'),
+            name='Test Integration',
+            notes='Test Notes')
+
+        self.device = Device.objects.create(
+            name='Email [@email.com]',
+            kind=DeviceKind.objects.create(
+                name='Email',
+                module='devices.modules.email.EmailDeviceKindModule',
+                description='Email Devices',
+                configuration={
+                    'from_email': 'oss2fa@email.com',
+                    'subject': 'Your 2fa access token',
+                    'message': '{token}',
+                    'communication_module': mailer,
+                    'communication_module_settings': {},
+                }),
+            client=Client.objects.create(
+                name='test', integration=integration, username='test'),
+            enrollment=Enrollment.objects.create(
+                integration=integration,
+                policy=integration.policy,
+                username='test',
+                status=Enrollment.STATUS_COMPLETE,
+                expires_at=timezone.now() + datetime.timedelta(minutes=5)),
+            details={'address': 'john.doe@email.com'})
+
+        self.challenge = Challenge.objects.create(
+            client=self.device.client,
+            policy=integration.policy,
+            device=self.device,
+            expires_at=timezone.now() + datetime.timedelta(minutes=5))
+
+    def test_mailed_token_completes_the_challenge(self):
+        self.assertIsNone(self.challenge.dispatch())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['john.doe@email.com'])
+
+        challenge = Challenge.objects.get(pk=self.challenge.pk)
+        success, err = challenge.complete({'token': mail.outbox[0].body})
+
+        self.assertTrue(success)
+        self.assertIsNone(err)
+        self.assertEqual(challenge.status, Challenge.STATUS_COMPLETE)
+
+    def test_other_tokens_fail_the_challenge(self):
+        self.challenge.dispatch()
+
+        challenge = Challenge.objects.get(pk=self.challenge.pk)
+        success, err = challenge.complete({'token': 'x'})
+
+        self.assertFalse(success)
+        self.assertIsNone(err)
+        self.assertEqual(challenge.status, Challenge.STATUS_FAILED)
+
+
+class TOTPReplayGuardTestCase(TestCase):
+    def setUp(self):
+        self.guard = TOTPReplayGuard(local_size=16, cache_alias='default')
+        self.secret = pyotp.random_base32()
+
+    def test_time_steps_are_accepted_once(self):
+        self.assertTrue(self.guard.accept(self.secret, 100, 60))
+        self.assertFalse(self.guard.accept(self.secret, 100, 60))
+        self.assertFalse(self.guard.accept(self.secret, 99, 60))
+        self.assertTrue(self.guard.accept(self.secret, 101, 60))
+
+    def test_time_steps_are_shared_through_the_cache(self):
+        self.assertTrue(self.guard.accept(self.secret, 100, 60))
+
+        other = TOTPReplayGuard(local_size=16, cache_alias='default')
+        self.assertFalse(other.accept(self.secret, 100, 60))
+
+
+class TOTPVerificationEngineTestCase(TestCase):
+    def setUp(self):
+        self.secret = pyotp.random_base32()
+        self.key = TOTPKey(self.secret, digits=6, interval=30)
+        self.totp = pyotp.TOTP(self.secret)
+
+    def test_codes_match_pyotp(self):
+        for for_time in (60, 89, 1500000000, 2000000000):
+            for step, code in TOTPVerificationEngine.candidates(
+                    self.key, 1, for_time):
+                self.assertEqual(code, self.totp.generate_otp(step))
+
+    def test_verify_returns_matched_time_step(self):
+        for_time = 1500000000
+        step = for_time // 30
+
+        self.assertEqual(
+            TOTPVerificationEngine.verify(
+                self.key, self.totp.generate_otp(step - 1), 1, for_time),
+            step - 1)
+        self.assertIsNone(
+            TOTPVerificationEngine.verify(
+                self.key, self.totp.generate_otp(step - 2), 1, for_time))
+
+    def test_verify_many(self):
+        for_time = 1500000000
+        code = self.totp.generate_otp(for_time // 30)
+
+        self.assertEqual(
+            TOTPVerificationEngine.verify_many(
+                [(self.key, code, 1), (self.key, 'invalid', 1)], for_time),
+            [for_time // 30, None])
@@ -2,11 +2,13 @@ from rest_framework.views import APIView
 from rest_framework import status
 from rest_framework.response import Response
 
+from mfa.routers import ReplicaReadMixin
+
 from .models import DeviceKind
 from .serializers import DeviceKindSerializer
 
 
-class DeviceKindList(APIView):
+class DeviceKindList(ReplicaReadMixin, APIView):
 
     def get(self, request, format=None):
         return Response(
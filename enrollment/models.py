@@ -9,8 +9,9 @@ from django.db import models, transaction
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
-from core import errors
-from core.models import Entity
+from core import errors, metrics
+from core.http import make_etag
+from core.models import Entity, update_chunk
 from policy.models import Policy, Rule
 from tenants.models import Integration, Client, BindingContext
 
@@ -24,6 +25,8 @@ class Enrollment(Entity):
     STATUS_FAILED = 4
     STATUS_EXPIRED = 5
 
+    PENDING_STATUSES = (STATUS_NEW, STATUS_IN_PROGRESS)
+
     DEFAULT_EXPIRATION_IN_MINUTES = 5
 
     STATUS_CHOICES = (
@@ -56,12 +59,18 @@ class Enrollment(Entity):
     class Meta:
         indexes = [
             models.Index(fields=['integration', 'username']),
+            models.Index(fields=['status', 'expires_at']),
         ]
 
     @staticmethod
-    def get_by_integration_and_pk(pk, integration, **kwargs):
+    def filter_by_integration_and_pk(pk, integration, **kwargs):
         return Enrollment.objects.filter(
-            pk=pk, integration=integration, **kwargs).first()
+            pk=pk, integration=integration, **kwargs)
+
+    @staticmethod
+    def get_by_integration_and_pk(pk, integration, **kwargs):
+        return Enrollment.filter_by_integration_and_pk(pk, integration,
+                                                       **kwargs).first()
 
     def _validate_device_selection(self):
         allowed_devices = self.policy.get_rule(Rule.KIND_DEVICE_SELECTION)
@@ -91,6 +100,45 @@ class Enrollment(Entity):
     def is_expired(self):
         return self.expires_at < timezone.now()
 
+    @staticmethod
+    def compute_effective_status(status, expires_at):
+        # pending entities past their expiration are reported as expired,
+        # even before the sweeper gets to them
+        if status in Enrollment.PENDING_STATUSES and expires_at < timezone.now():
+            return Enrollment.STATUS_EXPIRED
+        return status
+
+    def get_effective_status(self):
+        return Enrollment.compute_effective_status(self.status, self.expires_at)
+
+    def get_etag(self):
+        return make_etag(self.pk, self.last_updated_at,
+                         self.get_effective_status())
+
+    @staticmethod
+    def get_etag_by_integration_and_pk(pk, integration):
+        """
+        Returns the etag of an entity, without loading its details.
+        """
+        row = Enrollment.filter_by_integration_and_pk(pk, integration).values_list(
+            'pk', 'last_updated_at', 'status', 'expires_at').first()
+        if row is None:
+            return None
+
+        pk, last_updated_at, status, expires_at = row
+        return make_etag(pk, last_updated_at,
+                         Enrollment.compute_effective_status(status, expires_at))
+
+    @staticmethod
+    def expire_stale(chunk_size, now=None):
+        return update_chunk(
+            Enrollment.objects.filter(
+                status__in=Enrollment.PENDING_STATUSES,
+                expires_at__lt=now or timezone.now()),
+            chunk_size,
+            status=Enrollment.STATUS_EXPIRED,
+            last_updated_at=timezone.now())
+
     def prepare(self, data):
         with transaction.atomic():
             # make sure we don't have a device selection.
@@ -118,7 +166,9 @@ class Enrollment(Entity):
                 kind=data['kind'], options=prep_data)
 
             # get the device module, and prepare enrollment
-            err = self.device_selection.kind.get_module().enrollment_prepare(self)
+            module = self.device_selection.kind.get_module()
+            with metrics.time_module_hook(module, 'enrollment_prepare'):
+                err = module.enrollment_prepare(self)
 
             # if we couldn't finish preparation, fail.
             if err:
@@ -132,10 +182,17 @@ class Enrollment(Entity):
 
     def complete(self, payload):
         if self.status != Enrollment.STATUS_IN_PROGRESS:
-            return None, errors.MFAInconsistentStateError(
+            return errors.MFAInconsistentStateError(
                 'enrollment `{0}` is in state `{1}` and cannot be completed',
                 self.pk, self.get_status_display())
 
+        if self.is_expired():
+            self.status = Enrollment.STATUS_EXPIRED
+            self.save()
+
+            return errors.MFAInconsistentStateError(
+                'enrollment `{0}` expired at `{1}`', self.pk, self.expires_at)
+
         with transaction.atomic():
             assert self.status == Enrollment.STATUS_IN_PROGRESS
             assert self.device_selection is not None
@@ -152,7 +209,10 @@ class Enrollment(Entity):
                 return self._fail_enrollment(err)
 
             # attempt to complete the enrollment
-            device, error = device_module.enrollment_complete(self, completion)
+            with metrics.time_module_hook(device_module,
+                                          'enrollment_complete'):
+                device, error = device_module.enrollment_complete(
+                    self, completion)
 
             # if we have an error, fail
             if error:
@@ -8,11 +8,16 @@ from .models import Enrollment
 
 
 class EnrollmentSerializer(serializers.ModelSerializer):
+    status = serializers.SerializerMethodField()
+
     class Meta:
         model = Enrollment
         fields = ('pk', 'device_selection', 'username', 'status', 'created_at',
                   'expires_at', 'public_details')
 
+    def get_status(self, obj):
+        return obj.get_effective_status()
+
 
 class CreateEnrollmentSerializer(serializers.Serializer):
     username = serializers.CharField()
@@ -199,3 +199,67 @@ class EnrollmentAPITestCase(BaseEnrollmentTestCase, APITestCase):
         url = reverse('enrollment-complete', kwargs={'pk': doc['pk']})
         res = self.client.post(url, data, format='json')
         self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_lazily_render_totp_qr_code(self):
+        integration = Integration.objects.get(name=BASE_TEST_INTEGRATION_NAME)
+        self.client.force_authenticate(user=integration, token=integration)
+
+        kind = DeviceKind.objects.get(name='OTP')
+        kind.configuration['qr_code_mode'] = OTPConfiguration.QR_CODE_MODE_LAZY
+        kind.save()
+
+        res = self.client.post(
+            reverse('enrollment-list'), {'username': BASE_TEST_USERNAME},
+            format='json')
+        pk = res.json()['pk']
+
+        res = self.client.post(
+            reverse('enrollment-detail-prepare-device', kwargs={'pk': pk}), {
+                'kind': kind.pk,
+                'options': {
+                    'generate_qr_code': True,
+                }
+            },
+            format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIsNone(res.json()['public_details']['qr_code'])
+
+        url = reverse('enrollment-qr-code', kwargs={'pk': pk})
+
+        res = self.client.get(url, {'output': 'svg'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'image/svg+xml')
+        self.assertEqual(res['Cache-Control'], 'no-store')
+
+        res = self.client.get(
+            url, {'output': 'svg'}, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        res = self.client.get(url, {'output': 'matrix'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.json()['rows']), res.json()['size'])
+
+        res = self.client.get(url, {'output': 'gif'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_enrollment_detail_is_conditional(self):
+        integration = Integration.objects.get(name=BASE_TEST_INTEGRATION_NAME)
+        self.client.force_authenticate(user=integration, token=integration)
+
+        res = self.client.post(
+            reverse('enrollment-list'), {'username': BASE_TEST_USERNAME},
+            format='json')
+        enrollment = Enrollment.objects.get(pk=res.json()['pk'])
+        url = reverse('enrollment-detail', kwargs={'pk': enrollment.pk})
+
+        etag = self.client.get(url)['ETag']
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        enrollment.save()
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
@@ -2,25 +2,83 @@ from __future__ import unicode_literals
 
 import logging
 
+from django.http import HttpResponse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-
+from core.http import make_etag, etag_matches, not_modified, with_etag
+from mfa.routers import ReplicaReadMixin
+from tenants.idempotency import idempotent
 from .models import Enrollment
 from .serializers import EnrollmentSerializer, CreateEnrollmentSerializer, DevicePreparationSerializer
 
 logger = logging.getLogger(__name__)
 
 
-class EnrollmentDetail(APIView):
+class EnrollmentDetail(ReplicaReadMixin, APIView):
     def get(self, request, pk, format=None):
+        # the etag alone is only worth loading when the client has one
+        if request.META.get('HTTP_IF_NONE_MATCH'):
+            etag = Enrollment.get_etag_by_integration_and_pk(pk, request.auth)
+            if etag and etag_matches(request, etag):
+                return not_modified(etag)
+
         enrollment = Enrollment.get_by_integration_and_pk(pk, request.auth)
         if not enrollment:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
-        return Response(
-            EnrollmentSerializer(enrollment).data, status=status.HTTP_200_OK)
+        return with_etag(
+            Response(
+                EnrollmentSerializer(enrollment).data,
+                status=status.HTTP_200_OK), enrollment.get_etag())
+
+
+class EnrollmentQRCode(APIView):
+    OUTPUT_PNG = 'png'
+
+    def get(self, request, pk, format=None):
+        enrollment = Enrollment.get_by_integration_and_pk(
+            pk,
+            request.auth,
+            status=Enrollment.STATUS_IN_PROGRESS,
+            expires_at__gt=timezone.now())
+        if not enrollment or not enrollment.public_details or \
+                not enrollment.public_details.get('provisioning_uri'):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        module = enrollment.device_selection.kind.get_module()
+        if not hasattr(module, 'render_qr_code'):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        output = request.query_params.get('output', self.OUTPUT_PNG)
+        if output not in module.QR_CODE_CONTENT_TYPES:
+            return Response(
+                'unsupported qr code output `{0}`'.format(output),
+                status=status.HTTP_400_BAD_REQUEST)
+
+        provisioning_uri = enrollment.public_details['provisioning_uri']
+
+        # the qr code only changes along with the provisioning uri; it embeds
+        # the shared secret, so it must not be kept by any cache
+        etag = make_etag(provisioning_uri, output)
+        headers = {
+            'ETag': etag,
+            'Cache-Control': 'no-store',
+        }
+
+        if etag_matches(request, etag):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            content, content_type = module.render_qr_code(
+                provisioning_uri, output)
+            response = HttpResponse(content, content_type=content_type)
+
+        for header, value in headers.items():
+            response[header] = value
+
+        return response
 
 
 class EnrollmentCompletion(APIView):
@@ -68,6 +126,7 @@ class EnrollmentDevicePreparation(APIView):
 
 
 class EnrollmentList(APIView):
+    @idempotent
     def post(self, request, format=None):
         serializer = CreateEnrollmentSerializer(data=request.data)
         if not serializer.is_valid():
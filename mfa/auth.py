@@ -1,17 +1,74 @@
-from tenants.models import Integration
-
-from rest_framework.authentication import BasicAuthentication
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import exceptions
+from rest_framework.authentication import BasicAuthentication
+
+from core.cache import BoundedTTLCache
+from tenants.models import Integration
+
+CREDENTIAL_VERIFIER_SALT = 'mfa.auth.DefaultBasicAuthentication'
+
+# access key -> (secret verifier, db alias, integration field values, version
+# of the integration); entries are dropped by the process that changes the
+# integration, and by the others once they see its version change
+credential_cache = BoundedTTLCache(
+    max_size=settings.MFA_CREDENTIAL_CACHE_SIZE,
+    ttl=settings.MFA_CREDENTIAL_CACHE_TTL)
+
+
+def make_secret_verifier(secret_key):
+    return salted_hmac(CREDENTIAL_VERIFIER_SALT, secret_key).hexdigest()
+
+
+def invalidate_credentials(integration):
+    # the access key may have changed, so match on the primary key as well
+    credential_cache.delete_where(
+        lambda access_key, entry: access_key == integration.access_key or
+        entry[2]['id'] == integration.pk)
 
 
 class DefaultBasicAuthentication(BasicAuthentication):
+    # the secret key is left deferred on cached integrations, so that it is
+    # neither kept in memory nor decrypted unless something asks for it.
+    CACHED_FIELDS = tuple(
+        f.attname for f in Integration._meta.concrete_fields
+        if f.attname != 'secret_key')
+
+    def _load_integration(self, access_key, secret_key):
+        integration = Integration.objects.filter(access_key=access_key).first()
+        if not integration or not constant_time_compare(
+                integration.secret_key, secret_key):
+            return None
+
+        credential_cache.set(access_key, (
+            make_secret_verifier(secret_key), integration._state.db,
+            dict((name, getattr(integration, name))
+                 for name in self.CACHED_FIELDS),
+            Integration.get_cache_version(integration.pk)))
+
+        return integration
+
+    def authenticate_credentials(self, userid, password, request=None):
+        entry = credential_cache.get(userid)
+
+        if entry is not None and entry[3] != Integration.get_cache_version(
+                entry[2]['id']):
+            entry = None
+
+        if entry is None:
+            integration = self._load_integration(userid, password)
+        else:
+            verifier, db, values = entry[:3]
+            integration = None
 
-    def authenticate_credentials(self, userid, password):
-        integration = Integration.objects.filter(access_key=userid).first()
+            if constant_time_compare(verifier,
+                                     make_secret_verifier(password)):
+                integration = Integration.from_db(
+                    db, self.CACHED_FIELDS,
+                    [values[name] for name in self.CACHED_FIELDS])
 
-        print integration.secret_key, password
-        if not integration or (integration.secret_key != password):
+        if not integration:
             raise exceptions.AuthenticationFailed(
                 _('Invalid access key or secret key'))
 
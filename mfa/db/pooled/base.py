@@ -0,0 +1,115 @@
+"""
+A PostgreSQL backend that checks connections out of an in-process pool when
+Django connects, and returns them to it when Django closes them. As with
+`mfa.db.postgresql`, partitioned tables are flushed along with the others.
+
+Pool settings are read from the `POOL` entry of the database settings.
+"""
+from __future__ import unicode_literals
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.creation import DatabaseCreation as \
+    BaseDatabaseCreation
+
+from ..postgresql.base import DatabaseWrapper as BaseDatabaseWrapper
+from .pool import ConnectionPool
+
+DEFAULT_POOL_OPTIONS = {
+    'SIZE': 10,
+    'IDLE_TIMEOUT': 300,
+    'HEALTH_CHECK': True,
+    'CHECKOUT_TIMEOUT': 10,
+}
+
+# pools are keyed by process as well, so that a forked worker never shares
+# the sockets of its parent
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, conn_params, options):
+    key = (os.getpid(), alias, hashlib.sha1(
+        json.dumps(conn_params, sort_keys=True, default=str)).hexdigest())
+
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            options = dict(DEFAULT_POOL_OPTIONS, **options)
+
+            pool = _pools[key] = ConnectionPool(
+                connect=lambda: base.Database.connect(**conn_params),
+                size=options['SIZE'],
+                idle_timeout=options['IDLE_TIMEOUT'],
+                health_check=options['HEALTH_CHECK'],
+                checkout_timeout=options['CHECKOUT_TIMEOUT'])
+
+    return pool
+
+
+def get_pool_stats():
+    """
+    Returns `(alias, stats)` for every pool of this process.
+    """
+    pid = os.getpid()
+
+    with _pools_lock:
+        pools = [(k[1], v) for k, v in _pools.items() if k[0] == pid]
+
+    return [(alias, pool.stats()) for alias, pool in pools]
+
+
+def close_pools():
+    pid = os.getpid()
+
+    with _pools_lock:
+        keys = [k for k in _pools if k[0] == pid]
+        pools = [_pools.pop(k) for k in keys]
+
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_pools)
+
+
+class DatabaseCreation(BaseDatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # idle pooled connections to the test database would keep it from
+        # being dropped
+        close_pools()
+        super(DatabaseCreation, self)._destroy_test_db(test_database_name,
+                                                       verbosity)
+
+
+class DatabaseWrapper(BaseDatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_new_connection(self, conn_params):
+        self.pool = get_pool(self.alias, conn_params,
+                             self.settings_dict.get('POOL', {}))
+        connection = self.pool.acquire()
+
+        # as with the stock backend, the isolation level defaults to the one
+        # of the connection
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get('isolation_level',
+                                           connection.isolation_level)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+
+        with self.wrap_database_errors:
+            # a connection closed within a transaction stays referenced by
+            # this wrapper, so it can't be handed out again
+            self.pool.release(self.connection, broken=self.in_atomic_block)
@@ -0,0 +1,55 @@
+from __future__ import unicode_literals
+
+import psycopg2
+from psycopg2 import extensions
+
+from core.pool import ConnectionPool as BaseConnectionPool
+
+
+class ConnectionPool(BaseConnectionPool):
+    """
+    A bounded pool of open psycopg2 connections, health checked with a
+    `SELECT 1`. Connections are rolled back when released within a
+    transaction.
+    """
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+            if not conn.autocommit:
+                conn.rollback()
+        except psycopg2.Error:
+            return False
+
+        return True
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _reset(self, conn):
+        if conn.closed:
+            return False
+
+        status = conn.get_transaction_status()
+        if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+
+        return True
+
+    def _timeout_error(self):
+        return psycopg2.OperationalError(
+            'timed out waiting for a pooled database connection')
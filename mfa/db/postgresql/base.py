@@ -0,0 +1,32 @@
+"""
+The stock PostgreSQL backend, made aware of partitioned tables.
+
+Django lists ordinary tables and views only, so a partitioned table is left
+out of `flush`, whose truncation then fails on the foreign keys the
+partitioned table holds to the tables it does truncate.
+"""
+from __future__ import unicode_literals
+
+from django.db.backends.base.introspection import TableInfo
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.introspection import \
+    DatabaseIntrospection as BaseDatabaseIntrospection
+
+
+class DatabaseIntrospection(BaseDatabaseIntrospection):
+    def get_table_list(self, cursor):
+        # partitions are listed as well, but are never the table of a model
+        cursor.execute("""
+            SELECT c.relname, c.relkind
+            FROM pg_catalog.pg_class c
+            LEFT JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('r', 'v', 'p')
+                AND n.nspname NOT IN ('pg_catalog', 'pg_toast')
+                AND pg_catalog.pg_table_is_visible(c.oid)""")
+        return [TableInfo(row[0], {'r': 't', 'p': 't', 'v': 'v'}.get(row[1]))
+                for row in cursor.fetchall()
+                if row[0] not in self.ignored_tables]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    introspection_class = DatabaseIntrospection
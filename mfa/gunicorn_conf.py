@@ -0,0 +1,18 @@
+"""
+Gunicorn server hooks, loaded with:
+
+    gunicorn -c python:mfa.gunicorn_conf mfa.wsgi
+"""
+from __future__ import absolute_import, unicode_literals
+
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mfa.settings')
+
+
+def on_starting(server):
+    # metrics files left by the workers of an earlier run would otherwise be
+    # summed into those of this one
+    from core import metrics
+
+    metrics.clear()
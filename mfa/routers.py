@@ -0,0 +1,134 @@
+"""
+Routes the reads of read-only API views to replicas.
+
+Views opt in through `ReplicaReadMixin`. Any write pins the integration (or
+tenant user) that made it to the primary for a few seconds, so that it
+reads its own writes while the replicas catch up. Pins must be seen by every
+worker, so replicas are refused unless they are kept in a shared cache.
+"""
+from __future__ import unicode_literals
+
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+from core.cache import PROCESS_LOCAL_CACHES
+from tenants.models import Integration
+
+PIN_CACHE_KEY = 'mfa.routers.pin.{0}.{1}'
+
+_state = threading.local()
+
+
+@contextmanager
+def replica_reads():
+    previous = getattr(_state, 'use_replicas', False)
+    _state.use_replicas = True
+    try:
+        yield
+    finally:
+        _state.use_replicas = previous
+
+
+def get_pin_cache():
+    return caches[settings.MFA_DATABASE_REPLICA_PIN_CACHE]
+
+
+def check_pin_cache():
+    if settings.MFA_DATABASE_REPLICAS and isinstance(get_pin_cache(),
+                                                     PROCESS_LOCAL_CACHES):
+        raise ImproperlyConfigured(
+            'replicas need the `{0}` cache, where pins are kept, to be shared '
+            'by every worker'.format(settings.MFA_DATABASE_REPLICA_PIN_CACHE))
+
+
+def get_pin_key(request):
+    integration = getattr(request, 'auth', None)
+    if isinstance(integration, Integration):
+        return PIN_CACHE_KEY.format('integration', integration.pk)
+
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return PIN_CACHE_KEY.format('user', user.pk)
+
+    return None
+
+
+def pin(request):
+    key = get_pin_key(request)
+    if key is not None:
+        get_pin_cache().set(key, True,
+                            settings.MFA_DATABASE_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(request):
+    key = get_pin_key(request)
+    return key is not None and get_pin_cache().get(key, False)
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        if not settings.MFA_DATABASE_REPLICAS or not getattr(
+                _state, 'use_replicas', False):
+            return None
+
+        return random.choice(settings.MFA_DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+
+        # instances read from a replica must still be written to the primary
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.MFA_DATABASE_REPLICAS
+
+
+class ReplicaReadMixin(object):
+    """
+    Reads made while handling safe requests go to a replica, unless the
+    requester is pinned to the primary.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super(ReplicaReadMixin, self).initial(request, *args, **kwargs)
+
+        if request.method in SAFE_METHODS and not is_pinned(request):
+            _state.use_replicas = True
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super(ReplicaReadMixin, self).dispatch(
+                request, *args, **kwargs)
+        finally:
+            _state.use_replicas = False
+
+
+class ReplicaPinMiddleware(object):
+    """
+    Pins requesters to the primary after any request that wrote to it.
+    """
+
+    def __init__(self, get_response):
+        check_pin_cache()
+
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.wrote = False
+
+        response = self.get_response(request)
+
+        if _state.wrote and settings.MFA_DATABASE_REPLICAS:
+            pin(request)
+
+        return response
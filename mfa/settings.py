@@ -48,9 +48,11 @@ INSTALLED_APPS = [
     'policy',
     'devices',
     'contrib',
+    'retention',
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -59,6 +61,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'mfa.routers.ReplicaPinMiddleware',
+    'core.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'mfa.urls'
@@ -84,14 +88,78 @@ WSGI_APPLICATION = 'mfa.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
 
+#
+# Both engines below are the stock PostgreSQL backend, made aware of the
+# partitioned challenge table, without which `manage.py flush` fails.
+#
+# Set `MFA_DATABASE_ENGINE` to `mfa.db.pooled` to check connections out of an
+# in-process pool, sized and tuned through the `MFA_DATABASE_POOL_*`
+# variables. Connections are then returned to the pool at the end of every
+# request, unless `MFA_DATABASE_CONN_MAX_AGE` keeps them around; otherwise,
+# connections persist for that many seconds.
+
+MFA_DATABASE_ENGINE = os.getenv('MFA_DATABASE_ENGINE', 'mfa.db.postgresql')
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': MFA_DATABASE_ENGINE,
         'NAME': os.getenv('MFA_DATABASE_NAME', 'mfa'),
         'USER': os.getenv('MFA_DATABASE_USER', 'mfa'),
         'PASSWORD': os.getenv('MFA_DATABASE_PASSWORD', 'mfa'),
         'HOST': os.getenv('MFA_DATABASE_HOST', 'localhost'),
-        'PORT': os.getenv('MFA_DATABASE_PORT', '5432')
+        'PORT': os.getenv('MFA_DATABASE_PORT', '5432'),
+        'CONN_MAX_AGE': int(
+            os.getenv('MFA_DATABASE_CONN_MAX_AGE', 0
+                      if MFA_DATABASE_ENGINE == 'mfa.db.pooled' else 60)),
+        'POOL': {
+            'SIZE': int(os.getenv('MFA_DATABASE_POOL_SIZE', 10)),
+            'IDLE_TIMEOUT': float(
+                os.getenv('MFA_DATABASE_POOL_IDLE_TIMEOUT', 300)),
+            'HEALTH_CHECK': os.getenv('MFA_DATABASE_POOL_HEALTH_CHECK',
+                                      'true').lower() == 'true',
+            'CHECKOUT_TIMEOUT': float(
+                os.getenv('MFA_DATABASE_POOL_CHECKOUT_TIMEOUT', 10)),
+        }
+    }
+}
+
+# Read-only API views read from the `replica` database when
+# `MFA_DATABASE_REPLICA_HOST` is set. After any write, the integration (or
+# tenant user) that made it reads from the primary for this many seconds.
+# Pins are kept in this cache, which every worker must share: a local-memory
+# one is refused on startup when a replica is configured.
+
+MFA_DATABASE_REPLICAS = []
+MFA_DATABASE_REPLICA_PIN_SECONDS = int(
+    os.getenv('MFA_DATABASE_REPLICA_PIN_SECONDS', 10))
+MFA_DATABASE_REPLICA_PIN_CACHE = os.getenv('MFA_DATABASE_REPLICA_PIN_CACHE',
+                                           'default')
+
+if os.getenv('MFA_DATABASE_REPLICA_HOST'):
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        HOST=os.getenv('MFA_DATABASE_REPLICA_HOST'),
+        PORT=os.getenv('MFA_DATABASE_REPLICA_PORT',
+                       DATABASES['default']['PORT']),
+        TEST={'MIRROR': 'default'})
+    MFA_DATABASE_REPLICAS.append('replica')
+
+DATABASE_ROUTERS = ['mfa.routers.ReplicaRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+#
+# Policy snapshots are shared through this cache, along with the versions
+# through which processes learn that what they cached of a policy or an
+# integration changed. Use a shared backend, such as memcached, when running
+# more than one process; otherwise, changes only reach the other processes
+# once their cached entries expire.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('MFA_CACHE_BACKEND',
+                             'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('MFA_CACHE_LOCATION', ''),
     }
 }
 
@@ -160,6 +228,110 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
 EMAIL_USE_TLS = True
 
+# Policy snapshots are cached for this many seconds, which, unless the cache
+# is shared, bounds how long other processes apply a policy after it changed.
+MFA_POLICY_SNAPSHOT_TTL = int(os.getenv('MFA_POLICY_SNAPSHOT_TTL', 30))
+
+# Integration credentials verified by `mfa.auth.DefaultBasicAuthentication`
+# are cached in-process for this many seconds. Unless the cache is shared,
+# rotated or deleted credentials keep working in other processes for as long.
+MFA_CREDENTIAL_CACHE_SIZE = int(os.getenv('MFA_CREDENTIAL_CACHE_SIZE', 1024))
+MFA_CREDENTIAL_CACHE_TTL = int(os.getenv('MFA_CREDENTIAL_CACHE_TTL', 60))
+
+# Keys signing and verifying tokens are cached in-process for this many
+# integrations, for this many seconds, which, unless the cache is shared,
+# bounds how long other processes keep using the keys of a rotated secret.
+# Portal tokens expire along with their enrollment or challenge, and after
+# this many hours at most.
+MFA_PORTAL_TOKEN_KEY_CACHE_SIZE = int(
+    os.getenv('MFA_PORTAL_TOKEN_KEY_CACHE_SIZE', 1024))
+MFA_PORTAL_TOKEN_KEY_CACHE_TTL = int(
+    os.getenv('MFA_PORTAL_TOKEN_KEY_CACHE_TTL', 300))
+MFA_PORTAL_TOKEN_MAX_LIFETIME_HOURS = int(
+    os.getenv('MFA_PORTAL_TOKEN_MAX_LIFETIME_HOURS', 24))
+
+# Request and device module latencies, and database connection pool
+# statistics, are exposed at `/metrics`, in the Prometheus text format, to
+# these addresses, or to requests carrying this token as
+# `Authorization: Bearer <token>`. Set a directory to aggregate the metrics
+# of every worker, each writing its own at most this often; the gunicorn
+# hooks of `mfa.gunicorn_conf` clear it before the workers are forked.
+MFA_METRICS_ENABLED = os.getenv('MFA_METRICS_ENABLED',
+                                'false').lower() == 'true'
+MFA_METRICS_ALLOWED_IPS = [
+    x.strip()
+    for x in os.getenv('MFA_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+    if x.strip()
+]
+MFA_METRICS_TOKEN = os.getenv('MFA_METRICS_TOKEN')
+MFA_METRICS_DIR = os.getenv('MFA_METRICS_DIR')
+MFA_METRICS_FLUSH_INTERVAL = float(
+    os.getenv('MFA_METRICS_FLUSH_INTERVAL', 5))
+
+# This fraction of integration requests is profiled, along with any request
+# carrying a token from `manage.py profiling_token` in an `X-MFA-Profile`
+# header, valid for this many seconds. Used tokens are remembered in this
+# cache, which every worker must share: tokens are refused while it is a
+# local-memory one. Profiles are written to this directory as collapsed
+# stacks sampled this often, or traced as pstats files in `cprofile` mode.
+MFA_PROFILING_ENABLED = os.getenv('MFA_PROFILING_ENABLED',
+                                  'false').lower() == 'true'
+MFA_PROFILING_SAMPLE_RATE = float(os.getenv('MFA_PROFILING_SAMPLE_RATE', 0))
+MFA_PROFILING_TOKEN_MAX_AGE = int(
+    os.getenv('MFA_PROFILING_TOKEN_MAX_AGE', 300))
+MFA_PROFILING_TOKEN_CACHE = os.getenv('MFA_PROFILING_TOKEN_CACHE',
+                                      'default')
+MFA_PROFILING_DIR = os.getenv('MFA_PROFILING_DIR',
+                              os.path.join(LOG_DIR, 'profiles'))
+MFA_PROFILING_MODE = os.getenv('MFA_PROFILING_MODE', 'sample')
+MFA_PROFILING_INTERVAL = float(os.getenv('MFA_PROFILING_INTERVAL', 0.005))
+
+# Responses to requests carrying an `Idempotency-Key` header are replayed to
+# retries of those requests for this many hours.
+MFA_IDEMPOTENCY_KEY_TTL_HOURS = int(
+    os.getenv('MFA_IDEMPOTENCY_KEY_TTL_HOURS', 24))
+
+# Accepted OTP time-steps are tracked in a local LRU of this size, and shared
+# with other nodes through this cache alias.
+MFA_OTP_REPLAY_CACHE = os.getenv('MFA_OTP_REPLAY_CACHE', 'default')
+MFA_OTP_REPLAY_LOCAL_CACHE_SIZE = int(
+    os.getenv('MFA_OTP_REPLAY_LOCAL_CACHE_SIZE', 10000))
+
+# Decoded OTP key material is cached for this many devices.
+MFA_OTP_KEY_CACHE_SIZE = int(os.getenv('MFA_OTP_KEY_CACHE_SIZE', 10000))
+
+# Challenges are partitioned by month of creation, with partitions created
+# this many months ahead. Challenges are only looked up by id for this many
+# days after their creation, so that older partitions are never scanned: past
+# it, fetching, waiting on or completing a challenge answers 404 Not Found.
+MFA_CHALLENGE_PARTITIONS_AHEAD = int(
+    os.getenv('MFA_CHALLENGE_PARTITIONS_AHEAD', 3))
+MFA_CHALLENGE_LOOKUP_WINDOW_DAYS = int(
+    os.getenv('MFA_CHALLENGE_LOOKUP_WINDOW_DAYS', 30))
+
+# Long-polling challenge clients are held for at most this many seconds, and
+# check on their challenge at least this often, should a notification be
+# missed. Serve the API with threaded or asynchronous workers when enabled.
+MFA_CHALLENGE_WAIT_TIMEOUT = int(os.getenv('MFA_CHALLENGE_WAIT_TIMEOUT', 30))
+MFA_CHALLENGE_WAIT_POLL_INTERVAL = float(
+    os.getenv('MFA_CHALLENGE_WAIT_POLL_INTERVAL', 5))
+
+# Challenges and enrollments older than their policy's retention period (or
+# this many days, by default) are archived here and purged. A retention of
+# zero days keeps history forever.
+MFA_RETENTION_DEFAULT_DAYS = int(os.getenv('MFA_RETENTION_DEFAULT_DAYS', 90))
+MFA_RETENTION_ARCHIVE_DIR = os.getenv(
+    'MFA_RETENTION_ARCHIVE_DIR', os.path.join(BASE_DIR, '..', 'archive'))
+
+# Micro-benchmark runs are recorded here, and a benchmark whose median is
+# slower than the median of its recent runs by more than this fraction is
+# flagged as a regression.
+MFA_BENCHMARK_HISTORY_FILE = os.getenv(
+    'MFA_BENCHMARK_HISTORY_FILE',
+    os.path.join(BASE_DIR, '..', 'benchmarks.json'))
+MFA_BENCHMARK_REGRESSION_THRESHOLD = float(
+    os.getenv('MFA_BENCHMARK_REGRESSION_THRESHOLD', 0.2))
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'mfa.auth.DefaultBasicAuthentication', ),
@@ -0,0 +1,182 @@
+import os
+import tempfile
+from importlib import import_module
+
+import psycopg2
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from django.utils.six.moves import reload_module
+from rest_framework.test import APIClient
+
+from challenge.tests import BaseChallengeTestCase
+from core import metrics
+from . import routers
+from .db.pooled import base
+from .db.pooled.pool import ConnectionPool
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    def setUp(self):
+        params = connection.get_connection_params()
+        self.pool = ConnectionPool(
+            connect=lambda: psycopg2.connect(**params),
+            size=1,
+            idle_timeout=60,
+            health_check=True,
+            checkout_timeout=0.1)
+        self.addCleanup(self.pool.close)
+
+    def test_connections_are_reused(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+
+        self.assertIs(self.pool.acquire(), conn)
+
+        stats = self.pool.stats()
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['in_use'], 1)
+        self.assertEqual(stats['checkouts'], 2)
+
+    def test_checkout_times_out_when_exhausted(self):
+        self.pool.acquire()
+
+        with self.assertRaises(psycopg2.OperationalError):
+            self.pool.acquire()
+
+        self.assertEqual(self.pool.stats()['timeouts'], 1)
+
+    def test_unhealthy_connections_are_replaced(self):
+        conn = self.pool.acquire()
+        self.pool.release(conn)
+        conn.close()
+
+        self.assertIsNot(self.pool.acquire(), conn)
+        self.assertEqual(self.pool.stats()['discarded'], 1)
+
+    def test_transactions_are_rolled_back_on_release(self):
+        conn = self.pool.acquire()
+        conn.cursor().execute('SELECT 1')
+        self.pool.release(conn)
+
+        self.assertEqual(conn.get_transaction_status(),
+                         psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+
+class PooledDatabaseWrapperTestCase(SimpleTestCase):
+    allow_database_queries = True
+
+    def test_connections_return_to_the_pool(self):
+        wrapper = base.DatabaseWrapper(
+            dict(connection.settings_dict, POOL={'SIZE': 1}), alias='pooled')
+        self.addCleanup(base.close_pools)
+
+        for _ in range(2):
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            wrapper.close()
+
+        stats = dict(base.get_pool_stats())['pooled']
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(stats['checkouts'], 2)
+
+        rendered = metrics.render()
+        self.assertIn('mfa_db_pool_connections_idle{database="pooled"} 1',
+                      rendered)
+        self.assertIn('mfa_db_pool_checkouts_total{database="pooled"} 2',
+                      rendered)
+
+
+class WSGITestCase(SimpleTestCase):
+    allow_database_queries = True
+
+    def test_no_connection_is_left_open_for_workers_to_inherit(self):
+        reload_module(import_module('mfa.wsgi'))
+
+        self.assertIsNone(connection.connection)
+
+
+# pins are kept in a cache shared by the processes of this host
+PIN_CACHES = dict(
+    settings.CACHES,
+    pins={
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'mfa-test-pins'),
+    })
+
+
+@override_settings(
+    MFA_DATABASE_REPLICAS=['replica'],
+    MFA_DATABASE_REPLICA_PIN_CACHE='pins',
+    CACHES=PIN_CACHES)
+class ReplicaRouterTestCase(BaseChallengeTestCase):
+    def setUp(self):
+        super(ReplicaRouterTestCase, self).setUp()
+        self.addCleanup(routers.get_pin_cache().clear)
+
+        self.router = routers.ReplicaRouter()
+        self.api = APIClient()
+        self.api.force_authenticate(
+            user=self.integration, token=self.integration)
+
+    def test_only_replica_reads_are_routed(self):
+        self.assertIsNone(self.router.db_for_read(None))
+
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(None), 'replica')
+            self.assertEqual(self.router.db_for_write(None), 'default')
+
+        self.assertFalse(
+            self.router.allow_migrate('replica', 'challenge'))
+
+    def get_read_aliases(self, url):
+        """
+        Returns the aliases the router picked for the reads of a request,
+        which are then made on the primary, as no replica is configured.
+        """
+        aliases = []
+        db_for_read = routers.ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            aliases.append(db_for_read(router, model, **hints))
+            return None
+
+        routers.ReplicaRouter.db_for_read = record
+        try:
+            res = self.api.get(url)
+        finally:
+            routers.ReplicaRouter.db_for_read = db_for_read
+
+        self.assertEqual(res.status_code, 200)
+        return set(aliases)
+
+    def test_writes_pin_the_integration_to_the_primary(self):
+        res = self.api.post(
+            reverse('challenge-list'), {
+                'username': self.client_entity.username,
+                'device_pk': self.device.pk,
+            },
+            format='json')
+        self.assertEqual(res.status_code, 201)
+
+        url = reverse('challenge-detail', kwargs={'pk': res.data['pk']})
+
+        # pinned, the challenge is read back from the primary
+        self.assertEqual(self.get_read_aliases(url), {None})
+
+        routers.get_pin_cache().clear()
+
+        self.assertEqual(self.get_read_aliases(url), {'replica'})
+
+    def test_replicas_need_a_shared_pin_cache(self):
+        routers.ReplicaPinMiddleware(None)
+
+        with self.settings(MFA_DATABASE_REPLICA_PIN_CACHE='default'):
+            with self.assertRaises(ImproperlyConfigured):
+                routers.ReplicaPinMiddleware(None)
+
+            with self.settings(MFA_DATABASE_REPLICAS=[]):
+                routers.ReplicaPinMiddleware(None)
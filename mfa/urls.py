@@ -16,15 +16,24 @@ Including another URLconf
 from django.conf.urls import url
 from django.contrib import admin
 
-from challenge.views import ChallengeList, ChallengeDetailView, ChallengeCompletionView
-from enrollment.views import EnrollmentList, EnrollmentDetail, EnrollmentCompletion, EnrollmentDevicePreparation
-from tenants.views import IntegrationClientAuthDecision, TenantsListView, TenantIntegrationListView
+from challenge.views import ChallengeList, ChallengeDetailView, ChallengeCompletionView, ChallengeWaitView
+from enrollment.views import EnrollmentList, EnrollmentDetail, EnrollmentCompletion, EnrollmentDevicePreparation, \
+    EnrollmentQRCode
+from tenants.views import IntegrationClientAuthDecision, IntegrationClientAuthDecisionBatch, TenantsListView, \
+    TenantIntegrationListView, PortalTokenVerification
 from devices.views import DeviceKindList
+from core.views import metrics
 
 urlpatterns = [
+    url(r'^integration/clients/auth/batch',
+        IntegrationClientAuthDecisionBatch.as_view(),
+        name='client-auth-batch'),
     url(r'^integration/clients/auth',
         IntegrationClientAuthDecision.as_view(),
         name='client-auth'),
+    url(r'^integration/challenges/(?P<pk>[0-9]+)/wait',
+        ChallengeWaitView.as_view(),
+        name='challenge-wait'),
     url(r'^integration/challenges/(?P<pk>[0-9]+)/complete',
         ChallengeCompletionView.as_view(),
         name='challenge-complete'),
@@ -40,6 +49,9 @@ urlpatterns = [
     url(r'^integration/enrollments/(?P<pk>[0-9]+)/prepare-device',
         EnrollmentDevicePreparation.as_view(),
         name='enrollment-detail-prepare-device'),
+    url(r'^integration/enrollments/(?P<pk>[0-9]+)/qr-code',
+        EnrollmentQRCode.as_view(),
+        name='enrollment-qr-code'),
     url(r'^integration/enrollments/(?P<pk>[0-9]+)',
         EnrollmentDetail.as_view(),
         name='enrollment-detail'),
@@ -51,5 +63,9 @@ urlpatterns = [
         name='tenant-integration-list'),
     url(r'^tenants', TenantsListView.as_view(), name='tenant-list'),
     url(r'^devices-kind', DeviceKindList.as_view(), name='device-kind-list'),
+    url(r'^portal/tokens/verify',
+        PortalTokenVerification.as_view(),
+        name='portal-token-verify'),
     url(r'^admin/', admin.site.urls),
+    url(r'^metrics$', metrics, name='metrics'),
 ]
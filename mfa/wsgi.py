@@ -14,3 +14,14 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mfa.settings")
 
 application = get_wsgi_application()
+
+# load and validate every device kind module before serving requests
+from devices.registry import module_registry  # noqa: E402
+module_registry.warm()
+
+# with `--preload`, this runs in the gunicorn master: close the connections
+# warming opened, so that no forked worker inherits their sockets
+from django.db import connections  # noqa: E402
+from mfa.db.pooled.base import close_pools  # noqa: E402
+connections.close_all()
+close_pools()
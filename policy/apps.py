@@ -5,3 +5,6 @@ from django.apps import AppConfig
 
 class PolicyConfig(AppConfig):
     name = 'policy'
+
+    def ready(self):
+        from . import signals  # noqa
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-18 01:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('policy', '0003_auto_20261018_0106'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='configuration',
+            name='kind',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Token Digits Length'), (2, 'Challenge Expiration (Minutes)'), (3, 'Enrollment Expiration (Minutes)'), (4, 'History Retention (Days)'), (5, 'Trusted Device Lifetime (Days)')]),
+        ),
+    ]
@@ -1,26 +1,108 @@
 from __future__ import unicode_literals
 
+from django.conf import settings
 from django.contrib.postgres.fields import JSONField
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
 from django.utils.translation import ugettext_lazy as _
 
+from core.cache import bump_version, get_version
 from core.models import Entity
 
 
-class Policy(Entity):
-    def get_rule(self, kind):
-        entry = self.rules.filter(kind=kind).first()
-        if not entry:
-            return None
+class PolicySnapshot(object):
+    """
+    An immutable view of a policy's rules and configurations, with every
+    value already run through its kind processor.
+    """
+    __slots__ = ('_rules', '_configurations')
+
+    def __init__(self, rules, configurations):
+        object.__setattr__(self, '_rules', dict(rules))
+        object.__setattr__(self, '_configurations', dict(configurations))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('policy snapshots are immutable')
+
+    def __getstate__(self):
+        return self._rules, self._configurations
+
+    def __setstate__(self, state):
+        object.__setattr__(self, '_rules', state[0])
+        object.__setattr__(self, '_configurations', state[1])
+
+    @staticmethod
+    def load(policy_pk):
+        return PolicySnapshot(
+            rules=[(x.kind, x.get_parsed_value())
+                   for x in Rule.objects.filter(policy_id=policy_pk)],
+            configurations=[
+                (x.kind, x.get_parsed_value())
+                for x in Configuration.objects.filter(policy_id=policy_pk)
+            ])
 
-        return entry.get_parsed_value()
+    def get_rule(self, kind):
+        return self._rules.get(kind)
 
     def get_configuration(self, kind):
-        entry = self.configurations.filter(kind=kind).first()
-        if not entry:
-            return None
+        return self._configurations.get(kind)
+
+
+class Policy(Entity):
+    SNAPSHOT_CACHE_KEY = 'policy.snapshot.{0}'
+    SNAPSHOT_VERSION_CACHE_KEY = 'policy.snapshot.{0}.version'
+
+    @staticmethod
+    def get_snapshot_version(policy_pk):
+        return get_version(Policy.SNAPSHOT_VERSION_CACHE_KEY.format(policy_pk))
+
+    @staticmethod
+    def invalidate_snapshot(policy_pk):
+        bump_version(Policy.SNAPSHOT_VERSION_CACHE_KEY.format(policy_pk))
+
+    @staticmethod
+    def invalidate_snapshot_on_commit(policy_pk):
+        """
+        Invalidates the snapshot once the current transaction commits, as a
+        snapshot rebuilt from uncommitted changes would otherwise be cached
+        under the new version.
+        """
+
+        def invalidate():
+            Policy.invalidate_snapshot(policy_pk)
+
+        invalidate.policy_pk = policy_pk
+        transaction.on_commit(invalidate)
+
+    @staticmethod
+    def has_uncommitted_changes(policy_pk):
+        # callbacks are dropped along with the transaction, or savepoint,
+        # that registered them when it is rolled back
+        return any(
+            getattr(func, 'policy_pk', None) == policy_pk
+            for _, func in transaction.get_connection().run_on_commit)
+
+    def get_snapshot(self):
+        # changes made by the current transaction are only visible to it
+        if Policy.has_uncommitted_changes(self.pk):
+            return PolicySnapshot.load(self.pk)
+
+        key = Policy.SNAPSHOT_CACHE_KEY.format(self.pk)
+        version = Policy.get_snapshot_version(self.pk)
+
+        snapshot = cache.get(key, version=version)
+        if snapshot is None:
+            snapshot = PolicySnapshot.load(self.pk)
+            cache.set(key, snapshot, settings.MFA_POLICY_SNAPSHOT_TTL,
+                      version=version)
+
+        return snapshot
 
-        return entry.get_parsed_value()
+    def get_rule(self, kind):
+        return self.get_snapshot().get_rule(kind)
+
+    def get_configuration(self, kind):
+        return self.get_snapshot().get_configuration(kind)
 
 
 class Configuration(models.Model):
@@ -29,18 +111,25 @@ class Configuration(models.Model):
     KIND_TOKEN_LENGTH = 1
     KIND_CHALLENGE_EXPIRATION_IN_MINUTES = 2
     KIND_ENROLLMENT_EXPIRATION_IN_MINUTES = 3
+    KIND_RETENTION_IN_DAYS = 4
+    KIND_TRUSTED_DEVICE_LIFETIME_IN_DAYS = 5
 
     KIND_CHOICES = (
         (KIND_TOKEN_LENGTH, _('Token Digits Length')),
         (KIND_CHALLENGE_EXPIRATION_IN_MINUTES,
          _('Challenge Expiration (Minutes)')),
         (KIND_ENROLLMENT_EXPIRATION_IN_MINUTES,
-         _('Enrollment Expiration (Minutes)')), )
+         _('Enrollment Expiration (Minutes)')),
+        (KIND_RETENTION_IN_DAYS, _('History Retention (Days)')),
+        (KIND_TRUSTED_DEVICE_LIFETIME_IN_DAYS,
+         _('Trusted Device Lifetime (Days)')), )
 
     KIND_PROCESSORS = {
         KIND_TOKEN_LENGTH: lambda x: int(float(x)),
         KIND_CHALLENGE_EXPIRATION_IN_MINUTES: lambda x: int(float(x)),
-        KIND_ENROLLMENT_EXPIRATION_IN_MINUTES: lambda x: int(float(x))
+        KIND_ENROLLMENT_EXPIRATION_IN_MINUTES: lambda x: int(float(x)),
+        KIND_RETENTION_IN_DAYS: lambda x: int(float(x)),
+        KIND_TRUSTED_DEVICE_LIFETIME_IN_DAYS: lambda x: int(float(x))
     }
 
     policy = models.ForeignKey(Policy, related_name='configurations')
@@ -0,0 +1,14 @@
+from __future__ import unicode_literals
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Policy, Rule, Configuration
+
+
+@receiver(post_save, sender=Rule)
+@receiver(post_delete, sender=Rule)
+@receiver(post_save, sender=Configuration)
+@receiver(post_delete, sender=Configuration)
+def on_policy_entry_changed_invalidate_snapshot(sender, instance, **kwargs):
+    Policy.invalidate_snapshot_on_commit(instance.policy_id)
@@ -1 +1,91 @@
-# Create your tests here.
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from .models import Policy, Rule, Configuration
+
+
+class PolicySnapshotTestCase(TransactionTestCase):
+    # snapshots are only cached, and invalidated, once changes commit
+    def setUp(self):
+        cache.clear()
+
+        self.policy = Policy.objects.create(name='Test Policy')
+
+        Configuration.objects.create(
+            policy=self.policy,
+            kind=Configuration.KIND_TOKEN_LENGTH,
+            value='8.0')
+
+        Rule.objects.create(
+            policy=self.policy,
+            kind=Rule.KIND_DEVICE_SELECTION,
+            definition={'allowedDeviceKinds': ['OTP']})
+
+    def test_lookups_share_one_snapshot(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(
+                self.policy.get_configuration(
+                    Configuration.KIND_TOKEN_LENGTH), 8)
+            self.assertEqual(
+                self.policy.get_rule(Rule.KIND_DEVICE_SELECTION), ['OTP'])
+            self.assertIsNone(
+                self.policy.get_configuration(
+                    Configuration.KIND_CHALLENGE_EXPIRATION_IN_MINUTES))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.policy.get_configuration(
+                    Configuration.KIND_TOKEN_LENGTH), 8)
+
+    def test_snapshot_is_immutable(self):
+        with self.assertRaises(AttributeError):
+            self.policy.get_snapshot()._rules = {}
+
+    def test_snapshot_is_invalidated_on_change(self):
+        self.assertEqual(
+            self.policy.get_configuration(Configuration.KIND_TOKEN_LENGTH), 8)
+
+        Configuration.objects.filter(policy=self.policy).get().delete()
+        self.assertIsNone(
+            self.policy.get_configuration(Configuration.KIND_TOKEN_LENGTH))
+
+        Configuration.objects.create(
+            policy=self.policy,
+            kind=Configuration.KIND_TOKEN_LENGTH,
+            value='6')
+        self.assertEqual(
+            self.policy.get_configuration(Configuration.KIND_TOKEN_LENGTH), 6)
+
+    def test_snapshot_is_invalidated_on_commit(self):
+        version = Policy.get_snapshot_version(self.policy.pk)
+
+        with transaction.atomic():
+            Configuration.objects.filter(policy=self.policy).delete()
+            self.assertEqual(
+                Policy.get_snapshot_version(self.policy.pk), version)
+
+            # the transaction sees its own changes all the same
+            self.assertIsNone(
+                self.policy.get_configuration(
+                    Configuration.KIND_TOKEN_LENGTH))
+
+        self.assertNotEqual(
+            Policy.get_snapshot_version(self.policy.pk), version)
+
+    def test_rolled_back_changes_are_not_cached(self):
+        self.assertEqual(
+            self.policy.get_configuration(Configuration.KIND_TOKEN_LENGTH), 8)
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Configuration.objects.filter(policy=self.policy).delete()
+                self.assertIsNone(
+                    self.policy.get_configuration(
+                        Configuration.KIND_TOKEN_LENGTH))
+                raise RuntimeError()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.policy.get_configuration(
+                    Configuration.KIND_TOKEN_LENGTH), 8)
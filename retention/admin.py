@@ -0,0 +1,12 @@
+from django.contrib import admin
+
+from .models import RetentionCheckpoint
+
+
+class RetentionCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['model', 'policy', 'archived', 'deleted', 'updated_at']
+    list_filter = ['model']
+    readonly_fields = ['model', 'policy', 'pending', 'archived', 'deleted']
+
+
+admin.site.register(RetentionCheckpoint, RetentionCheckpointAdmin)
@@ -0,0 +1,51 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from retention.purge import HistoryPurger, RETENTION_TARGETS
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Archive and delete challenges and enrollments older than their '
+            'policy\'s retention period')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=HistoryPurger.DEFAULT_BATCH_SIZE,
+            help='number of rows archived and deleted at a time')
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0.1,
+            help='seconds to pause between batches')
+        parser.add_argument(
+            '--archive-dir',
+            default=settings.MFA_RETENTION_ARCHIVE_DIR,
+            help='directory the compressed archives are written to')
+        parser.add_argument(
+            '--no-archive',
+            action='store_true',
+            help='delete expired rows without archiving them')
+
+    def handle(self, *args, **options):
+        purger = HistoryPurger(
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            archive_dir=None
+            if options['no_archive'] else options['archive_dir'])
+
+        for target in RETENTION_TARGETS:
+            archived, deleted, elapsed = purger.purge(target)
+
+            self.stdout.write(
+                self.style.SUCCESS(
+                    'purged `{0}` {1} (`{2}` archived) in {3:.1f}s, '
+                    '{4:.0f} rows/s'.format(deleted, target.model._meta.
+                                            verbose_name_plural, archived,
+                                            elapsed, deleted / elapsed
+                                            if elapsed else 0)))
@@ -0,0 +1,30 @@
+from __future__ import unicode_literals
+
+from django.contrib.postgres.fields import JSONField
+from django.db import models
+
+from policy.models import Policy
+
+
+class RetentionCheckpoint(models.Model):
+    """
+    Progress of the history purge for one model and policy. `pending` holds
+    the primary keys of rows that were archived but are yet to be deleted,
+    so that an interrupted purge picks up where it left off, without
+    archiving those rows twice.
+    """
+    model = models.CharField(max_length=64)
+    policy = models.ForeignKey(
+        Policy, related_name='retention_checkpoints', on_delete=models.CASCADE)
+    pending = JSONField(default=list, blank=True)
+    archived = models.BigIntegerField(default=0)
+    deleted = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (
+            'model',
+            'policy', )
+
+    def __unicode__(self):
+        return '{0} [{1}]'.format(self.model, self.policy_id)
@@ -0,0 +1,261 @@
+from __future__ import unicode_literals
+
+import gzip
+import json
+import logging
+import os
+import time
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from challenge import partitions
+from challenge.models import Challenge
+from enrollment.models import Enrollment
+from policy.models import Policy, Configuration
+from .models import RetentionCheckpoint
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionTarget(object):
+    """
+    A model whose history is purged once it outlives its policy's retention
+    period, along with the one-to-one rows (`related`) it owns.
+    """
+
+    def __init__(self, model, related=()):
+        self.model = model
+        self.label = model._meta.label_lower
+        self.related = [model._meta.get_field(name) for name in related]
+
+    def get_queryset(self, policy_pk, cutoff):
+        return self.model.objects.filter(
+            policy_id=policy_pk, created_at__lt=cutoff)
+
+    def get_deletable(self, pks):
+        return self.model.objects.filter(pk__in=pks)
+
+    def get_orphans(self, field, pks):
+        queryset = field.related_model.objects.filter(pk__in=pks)
+
+        # only rows nothing else points to anymore are considered orphans
+        for rel in field.related_model._meta.related_objects:
+            queryset = queryset.filter(**{rel.name + '__isnull': True})
+
+        return queryset
+
+    def drop_partitions(self, before):
+        return []
+
+
+class ChallengeRetentionTarget(RetentionTarget):
+    def drop_partitions(self, before):
+        return partitions.detach_partitions(before, drop=True)
+
+
+class EnrollmentRetentionTarget(RetentionTarget):
+    # devices cascade from their enrollment, which must then be kept
+
+    def get_queryset(self, policy_pk, cutoff):
+        return super(EnrollmentRetentionTarget, self).get_queryset(
+            policy_pk, cutoff).filter(device__isnull=True)
+
+    def get_deletable(self, pks):
+        return super(EnrollmentRetentionTarget, self).get_deletable(
+            pks).filter(device__isnull=True)
+
+
+RETENTION_TARGETS = (
+    ChallengeRetentionTarget(Challenge, related=('binding_context', )),
+    EnrollmentRetentionTarget(
+        Enrollment, related=('binding_context', 'device_selection')),
+)
+
+
+class HistoryArchive(object):
+    """
+    A gzip-compressed JSON-lines file, created on the first write. Every
+    write is flushed to disk before returning.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def write(self, records):
+        if self._file is None:
+            self._file = gzip.open(self.path, 'wb')
+
+        for record in records:
+            self._file.write(
+                (json.dumps(record, cls=DjangoJSONEncoder) + '\n')
+                .encode('utf-8'))
+
+        self._file.flush(zlib.Z_SYNC_FLUSH)
+        os.fsync(self._file.fileobj.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class HistoryPurger(object):
+    """
+    Archives and deletes rows older than their policy's retention period, in
+    batches of `batch_size` rows, pausing `pause` seconds between batches so
+    that neither locks nor I/O are held for long.
+    """
+    DEFAULT_BATCH_SIZE = 500
+
+    # secrets and tokens are never written out to archives
+    ARCHIVE_EXCLUDED_FIELDS = ('private_details', )
+
+    def __init__(self,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 pause=0,
+                 archive_dir=None,
+                 now=None):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.archive_dir = archive_dir
+        self.now = now or timezone.now()
+
+    @staticmethod
+    def get_retention_periods():
+        for policy in Policy.objects.all():
+            days = policy.get_configuration(
+                Configuration.KIND_RETENTION_IN_DAYS)
+            if days is None:
+                days = settings.MFA_RETENTION_DEFAULT_DAYS
+
+            yield policy.pk, days
+
+    def open_archive(self, target):
+        if not self.archive_dir:
+            return None
+
+        if not os.path.isdir(self.archive_dir):
+            os.makedirs(self.archive_dir)
+
+        return HistoryArchive(
+            os.path.join(self.archive_dir, '{0}-{1}.jsonl.gz'.format(
+                target.label, self.now.strftime('%Y%m%d%H%M%S'))))
+
+    def _archive(self, target, archive, rows):
+        if archive is None:
+            return
+
+        for field in target.related:
+            ids = [row[field.attname] for row in rows if row[field.attname]]
+            related = dict((x['id'], x) for x in field.related_model.objects.
+                           filter(pk__in=ids).values())
+
+            for row in rows:
+                row[field.name] = related.get(row[field.attname])
+
+        archive.write([
+            dict((k, v) for k, v in row.items()
+                 if k not in HistoryPurger.ARCHIVE_EXCLUDED_FIELDS)
+            for row in rows
+        ])
+
+    def _delete_pending(self, target, checkpoint):
+        if not checkpoint.pending:
+            return 0
+
+        with transaction.atomic():
+            queryset = target.get_deletable(checkpoint.pending)
+
+            related = [(field, [
+                x for x in queryset.values_list(field.attname, flat=True) if x
+            ]) for field in target.related]
+
+            # the total includes cascaded rows; only report the target's own
+            deleted = queryset.delete()[1].get(target.model._meta.label, 0)
+
+            for field, pks in related:
+                target.get_orphans(field, pks).delete()
+
+            checkpoint.pending = []
+            checkpoint.deleted += deleted
+            checkpoint.save()
+
+        return deleted
+
+    def purge_policy(self, target, archive, policy_pk, cutoff):
+        checkpoint, _ = RetentionCheckpoint.objects.get_or_create(
+            model=target.label, policy_id=policy_pk)
+
+        # finish the batch an interrupted purge archived but did not delete
+        deleted = self._delete_pending(target, checkpoint)
+        archived = 0
+        last_pk = 0
+
+        while True:
+            rows = list(
+                target.get_queryset(policy_pk, cutoff).filter(pk__gt=last_pk)
+                .order_by('pk').values()[:self.batch_size])
+            if not rows:
+                break
+
+            last_pk = rows[-1]['id']
+
+            self._archive(target, archive, rows)
+
+            checkpoint.pending = [row['id'] for row in rows]
+            checkpoint.archived += len(rows)
+            checkpoint.save()
+            archived += len(rows)
+
+            deleted += self._delete_pending(target, checkpoint)
+
+            logger.debug('purged `{0}` up to `{1}` for policy `{2}`'.format(
+                target.label, last_pk, policy_pk))
+
+            time.sleep(self.pause)
+
+        return archived, deleted
+
+    def purge(self, target):
+        """
+        Purge `target`'s expired history across every policy, returning the
+        number of rows archived and deleted, and the seconds it took.
+        """
+        started_at = time.time()
+        archive = self.open_archive(target)
+        archived = deleted = 0
+
+        periods = list(HistoryPurger.get_retention_periods())
+
+        # whole partitions past every policy's retention are dropped; when
+        # archiving, only once their rows were archived and purged below
+        before = None
+        if periods and all(days > 0 for _, days in periods):
+            before = self.now - timedelta(days=max(d for _, d in periods))
+
+        if before is not None and archive is None:
+            target.drop_partitions(before)
+
+        try:
+            for policy_pk, days in periods:
+                if days <= 0:
+                    continue
+
+                a, d = self.purge_policy(target, archive, policy_pk,
+                                         self.now - timedelta(days=days))
+                archived += a
+                deleted += d
+        finally:
+            if archive is not None:
+                archive.close()
+
+        if before is not None and archive is not None:
+            target.drop_partitions(before)
+
+        return archived, deleted, time.time() - started_at
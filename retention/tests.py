@@ -0,0 +1,100 @@
+import datetime
+import gzip
+import json
+import shutil
+import tempfile
+
+from django.utils import timezone
+
+from challenge.models import Challenge
+from challenge.tests import BaseChallengeTestCase
+from enrollment.models import Enrollment
+from policy.models import Configuration
+from tenants.models import BindingContext
+from .models import RetentionCheckpoint
+from .purge import HistoryPurger, RETENTION_TARGETS
+
+CHALLENGE_TARGET, ENROLLMENT_TARGET = RETENTION_TARGETS
+
+
+class HistoryPurgeTestCase(BaseChallengeTestCase):
+    def setUp(self):
+        super(HistoryPurgeTestCase, self).setUp()
+
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+
+        Configuration.objects.create(
+            policy=self.integration.policy,
+            kind=Configuration.KIND_RETENTION_IN_DAYS,
+            value='30')
+
+    def age(self, entity, days):
+        type(entity).objects.filter(pk=entity.pk).update(
+            created_at=timezone.now() - datetime.timedelta(days=days))
+
+    def create_challenge(self, days=0):
+        challenge = super(HistoryPurgeTestCase, self).create_challenge()
+        challenge.binding_context = BindingContext.objects.create(
+            client_ip_address='127.0.0.1')
+        challenge.save()
+
+        self.age(challenge, days)
+        return challenge
+
+    def read_archive(self, archive):
+        with gzip.open(archive.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_purges_challenges_past_retention(self):
+        stale = [self.create_challenge(days=31) for _ in range(3)]
+        fresh = self.create_challenge(days=29)
+
+        purger = HistoryPurger(batch_size=2, archive_dir=self.archive_dir)
+        archive = purger.open_archive(CHALLENGE_TARGET)
+
+        archived, deleted, _ = purger.purge(CHALLENGE_TARGET)
+
+        self.assertEqual((archived, deleted), (3, 3))
+        self.assertEqual(list(Challenge.objects.all()), [fresh])
+        self.assertEqual(BindingContext.objects.count(), 1)
+
+        records = self.read_archive(archive)
+        self.assertEqual([r['id'] for r in records], [c.pk for c in stale])
+        self.assertEqual(records[0]['binding_context']['client_ip_address'],
+                         '127.0.0.1')
+        self.assertNotIn('private_details', records[0])
+
+    def test_keeps_enrollments_with_devices(self):
+        self.age(self.device.enrollment, 31)
+        abandoned = Enrollment.objects.create(
+            integration=self.integration,
+            policy=self.integration.policy,
+            username='abandoned',
+            expires_at=timezone.now())
+        self.age(abandoned, 31)
+
+        _, deleted, _ = HistoryPurger().purge(ENROLLMENT_TARGET)
+
+        self.assertEqual(deleted, 1)
+        self.assertEqual(
+            list(Enrollment.objects.all()), [self.device.enrollment])
+
+    def test_resumes_pending_deletes(self):
+        challenge = self.create_challenge(days=31)
+
+        RetentionCheckpoint.objects.create(
+            model=CHALLENGE_TARGET.label,
+            policy=self.integration.policy,
+            pending=[challenge.pk])
+
+        purger = HistoryPurger(archive_dir=self.archive_dir)
+        archived, deleted, _ = purger.purge(CHALLENGE_TARGET)
+
+        # the pending row was already archived by the interrupted purge
+        self.assertEqual((archived, deleted), (0, 1))
+        self.assertFalse(Challenge.objects.exists())
+
+        checkpoint = RetentionCheckpoint.objects.get()
+        self.assertEqual(checkpoint.pending, [])
+        self.assertEqual(checkpoint.deleted, 1)
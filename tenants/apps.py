@@ -5,3 +5,6 @@ from django.apps import AppConfig
 
 class TenantsConfig(AppConfig):
     name = 'tenants'
+
+    def ready(self):
+        from . import signals  # noqa
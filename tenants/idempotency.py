@@ -0,0 +1,92 @@
+"""
+Lets integrations safely retry requests that create entities.
+
+A request carrying an `Idempotency-Key` header claims that key for its
+integration, and the response it gets is stored along with the key. Retries
+with the same key get the stored response back, without the request being
+processed again, while the key lasts.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import logging
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def get_request_digest(request):
+    return hashlib.sha256(
+        force_bytes('{0} {1}\n{2}'.format(
+            request.method, request.path,
+            json.dumps(request.data, sort_keys=True, default=str)))
+    ).hexdigest()
+
+
+def idempotent(method):
+    """
+    Decorates the handler of an integration request with support for the
+    `Idempotency-Key` header. Only successful responses are stored, so that
+    failed requests may be retried with the same key.
+    """
+
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key:
+            return method(self, request, *args, **kwargs)
+
+        if len(key) > IdempotencyKey.MAX_KEY_LENGTH:
+            return Response(
+                'idempotency key is longer than {0} characters'.format(
+                    IdempotencyKey.MAX_KEY_LENGTH),
+                status=status.HTTP_400_BAD_REQUEST)
+
+        digest = get_request_digest(request)
+
+        with transaction.atomic():
+            entity, claimed = IdempotencyKey.claim(
+                request.auth, key, digest,
+                timezone.now() +
+                timedelta(hours=settings.MFA_IDEMPOTENCY_KEY_TTL_HOURS))
+
+            if not claimed:
+                if entity.request_digest != digest:
+                    return Response(
+                        'idempotency key `{0}` was used for another request'.
+                        format(key),
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+                logger.info('replaying response for idempotency key `{0}`'.
+                            format(key))
+
+                res = Response(entity.response, status=entity.status_code)
+                res[REPLAYED_HEADER] = 'true'
+                return res
+
+            res = method(self, request, *args, **kwargs)
+
+            if status.is_success(res.status_code):
+                entity.status_code = res.status_code
+                entity.response = res.data
+                entity.save(update_fields=['status_code', 'response'])
+            else:
+                entity.delete()
+
+            return res
+
+    return wrapper
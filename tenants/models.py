@@ -5,15 +5,20 @@ from datetime import timedelta
 
 from django.apps import apps
 from django.contrib.auth.models import User, Group
+from django.contrib.postgres.fields import JSONField
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models, transaction
+from django.db.models import Prefetch
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 from django.utils.translation import ugettext_lazy as _
 from encrypted_fields import EncryptedCharField
 
 from core import errors
-from core.models import Entity
+from core.cache import bump_version, get_version
+from core.models import Entity, delete_chunk, reserve_pk
 from policy.models import Policy, Configuration
+from .tokens import PortalToken
 
 
 class Tenant(Entity):
@@ -109,6 +114,10 @@ class Integration(Entity):
     ACCESS_KEY_LENGTH = 32
     SECRET_KEY_LENGTH = 48
 
+    # bumped whenever an integration changes, so that every process drops
+    # what it cached of it
+    VERSION_CACHE_KEY = 'tenants.integration.{0}.version'
+
     tenant = models.ForeignKey(
         Tenant, related_name='integrations', on_delete=models.CASCADE)
     policy = models.OneToOneField(
@@ -117,13 +126,22 @@ class Integration(Entity):
     secret_key = EncryptedCharField(max_length=128, unique=True)
     endpoint = models.URLField(blank=True)
     notes = models.TextField(blank=True, null=True)
-    uid = models.CharField(max_length=16, blank=True, null=True)
+    uid = models.CharField(max_length=16, blank=True, null=True, db_index=True)
 
     def save(self, *args, **kwargs):
         if not self.uid:
             self.uid = uuid.uuid4().get_hex()[:8]
         super(Integration, self).save(*args, **kwargs)
 
+    @staticmethod
+    def get_cache_version(integration_pk):
+        return get_version(
+            Integration.VERSION_CACHE_KEY.format(integration_pk))
+
+    @staticmethod
+    def invalidate_cached(integration_pk):
+        bump_version(Integration.VERSION_CACHE_KEY.format(integration_pk))
+
     @staticmethod
     def create(tenant, name, notes):
         return Integration.objects.create(
@@ -134,12 +152,13 @@ class Integration(Entity):
             access_key=get_random_string(Integration.ACCESS_KEY_LENGTH),
             secret_key=get_random_string(Integration.SECRET_KEY_LENGTH), )
 
-    def generate_auth_session_token(self, username, expires_at):
-        return ''
+    def generate_auth_session_token(self, kind, pk, username, expires_at):
+        return PortalToken.issue(self, kind, pk, username, expires_at)
 
-    def generate_auth_session_portal_url(self, kind, username, expires_at):
+    def generate_auth_session_portal_url(self, kind, pk, username,
+                                         expires_at):
         return self.endpoint + '/' + kind + '/?token=' + self.generate_auth_session_token(
-            username, expires_at)
+            kind, pk, username, expires_at)
 
     def enroll(self, username):
         client = Client.objects.filter(
@@ -155,14 +174,19 @@ class Integration(Entity):
         ) or Enrollment.DEFAULT_EXPIRATION_IN_MINUTES
         expires_at = timezone.now() + timedelta(minutes=expiration_mins)
 
+        # the portal token embeds the enrollment's pk, so it is drawn ahead
+        # of the insert rather than updated in after it
+        pk = reserve_pk(Enrollment)
+
         entity = Enrollment.objects.create(
+            pk=pk,
             integration=self,
             policy=self.policy,
             username=username,
             binding_context=None,
             expires_at=expires_at,
             portal_url=self.generate_auth_session_portal_url(
-                'enrollment', username, expires_at))
+                'enrollment', pk, username, expires_at))
 
         return entity, None
 
@@ -170,6 +194,7 @@ class Integration(Entity):
         assert client.integration == self
 
         Challenge = apps.get_model('challenge', 'Challenge')
+        ChallengeDispatch = apps.get_model('challenge', 'ChallengeDispatch')
 
         device = None
         if data['device_pk']:
@@ -186,19 +211,112 @@ class Integration(Entity):
 
         expires_at = timezone.now() + timedelta(minutes=expiration_mins)
 
-        # create the challenge entity
-        entity = Challenge.objects.create(
-            client=client,
-            device=device,
-            policy=self.policy,
-            reference=data['reference'] if 'reference' in data else '',
-            expires_at=expires_at,
-            portal_url=self.generate_auth_session_portal_url(
-                'challenge', client.username, expires_at))
+        with transaction.atomic():
+            # the browser fingerprint binds any trusted device token issued
+            # on completion
+            binding_context = None
+            if data.get('binding_context'):
+                binding_context = BindingContext.objects.create(
+                    client_ip_address=data['binding_context'].get(
+                        'client_ip_address'),
+                    client_browser_fingerprint=data['binding_context'].get(
+                        'client_browser_fingerprint'))
+
+            # create the challenge entity; the portal token embeds its pk
+            pk = reserve_pk(Challenge)
+
+            entity = Challenge.objects.create(
+                pk=pk,
+                client=client,
+                device=device,
+                policy=self.policy,
+                binding_context=binding_context,
+                reference=data['reference'] if 'reference' in data else '',
+                expires_at=expires_at,
+                portal_url=self.generate_auth_session_portal_url(
+                    'challenge', pk, client.username, expires_at))
+
+            # queue the challenge to be performed by its device module, unless
+            # there is nothing to deliver and it can be performed right away
+            if device.kind.get_module().delivers_challenges:
+                ChallengeDispatch.objects.create(challenge=entity)
+            else:
+                entity.dispatch()
 
         return entity, None
 
 
+class IdempotencyKey(models.Model):
+    """
+    The response an integration got for a request carrying an
+    `Idempotency-Key` header, replayed to retries of that request until it
+    expires.
+    """
+    MAX_KEY_LENGTH = 255
+
+    integration = models.ForeignKey(
+        Integration,
+        related_name='idempotency_keys',
+        on_delete=models.CASCADE)
+    key = models.CharField(max_length=MAX_KEY_LENGTH)
+    request_digest = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response = JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('integration', 'key')
+
+    def is_expired(self):
+        return self.expires_at < timezone.now()
+
+    @staticmethod
+    def claim(integration, key, request_digest, expires_at):
+        """
+        Returns the key, and whether it was claimed by this request. A
+        concurrent request for the same key waits on the unique index, or on
+        the lock of an expired key, until the request that claimed it is
+        done.
+        """
+        entity, created = IdempotencyKey.objects.get_or_create(
+            integration=integration,
+            key=key,
+            defaults={
+                'request_digest': request_digest,
+                'expires_at': expires_at,
+            })
+
+        if created or not entity.is_expired():
+            return entity, created
+
+        # of the requests finding the key expired, only the first to lock it
+        # claims it again; the others find it claimed once that one is done
+        entity = IdempotencyKey.objects.select_for_update().filter(
+            pk=entity.pk).first()
+        if entity is None:
+            # deleted meanwhile, by a failed request or by the sweep
+            return IdempotencyKey.claim(integration, key, request_digest,
+                                        expires_at)
+
+        if not entity.is_expired():
+            return entity, False
+
+        entity.request_digest = request_digest
+        entity.status_code = None
+        entity.response = None
+        entity.expires_at = expires_at
+        entity.save()
+
+        return entity, True
+
+    @staticmethod
+    def expire_stale(chunk_size, now=None):
+        return delete_chunk(
+            IdempotencyKey.objects.filter(
+                expires_at__lt=now or timezone.now()), chunk_size)
+
+
 class ClientGroup(Entity):
     pass
 
@@ -230,5 +348,13 @@ class Client(Entity):
     def __unicode__(self):
         return self.username
 
+    @staticmethod
+    def get_with_devices(integration):
+        Device = apps.get_model('devices', 'Device')
+
+        return Client.objects.filter(integration=integration).prefetch_related(
+            Prefetch('devices',
+                     queryset=Device.objects.select_related('kind')))
+
     class Meta:
         unique_together = ('integration', 'username')
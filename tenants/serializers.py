@@ -3,7 +3,7 @@ from __future__ import unicode_literals
 from django.utils.translation import ugettext_lazy as _
 from rest_framework import serializers
 
-from devices.serializers import DeviceSerializer
+from devices.serializers import DeviceSummarySerializer
 from .models import Tenant, Integration
 
 
@@ -18,6 +18,25 @@ class IntegrationClientAuthDecisionSerializer(serializers.Serializer):
     binding_context = BindingContextSerializer(required=False)
 
 
+class IntegrationClientAuthDecisionBatchSerializer(serializers.Serializer):
+    MAX_BATCH_SIZE = 500
+
+    clients = IntegrationClientAuthDecisionSerializer(many=True)
+
+    def validate_clients(self, value):
+        if not value:
+            raise serializers.ValidationError(
+                _('at least one client is required'))
+
+        max_size = IntegrationClientAuthDecisionBatchSerializer.MAX_BATCH_SIZE
+        if len(value) > max_size:
+            raise serializers.ValidationError(
+                _('at most {0} clients may be decided at once').format(
+                    max_size))
+
+        return value
+
+
 class IntegrationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Integration
@@ -47,6 +66,17 @@ class CreateIntegrationSerializer(serializers.Serializer):
     notes = serializers.CharField()
 
 
+class PortalTokenVerificationSerializer(serializers.Serializer):
+    token = serializers.CharField(max_length=1024)
+
+
+class PortalTokenSerializer(serializers.Serializer):
+    kind = serializers.CharField()
+    pk = serializers.IntegerField()
+    username = serializers.CharField()
+    expires_at = serializers.DateTimeField()
+
+
 class TenantSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tenant
@@ -76,4 +106,14 @@ class IntegrationClientAuthDecisionResponseSerializer(serializers.Serializer):
             _('Deny'), ), )
 
     result = serializers.ChoiceField(choices=RESULT_CHOICES)
-    devices = DeviceSerializer(many=True, required=False)
+    devices = DeviceSummarySerializer(many=True, required=False)
+
+
+class IntegrationClientAuthDecisionBatchEntrySerializer(
+        IntegrationClientAuthDecisionResponseSerializer):
+    username = serializers.CharField()
+
+
+class IntegrationClientAuthDecisionBatchResponseSerializer(
+        serializers.Serializer):
+    decisions = IntegrationClientAuthDecisionBatchEntrySerializer(many=True)
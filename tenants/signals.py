@@ -0,0 +1,22 @@
+from __future__ import unicode_literals
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mfa.auth import invalidate_credentials
+from .models import Integration
+from .tokens import invalidate_signing_keys
+
+
+@receiver(post_save, sender=Integration)
+@receiver(post_delete, sender=Integration)
+def on_integration_changed_invalidate_credentials(sender, instance, **kwargs):
+    invalidate_credentials(instance)
+    invalidate_signing_keys(instance)
+
+    # other processes drop what they cached once the change is visible to
+    # them, rather than reloading what is about to change
+    integration_pk = instance.pk
+    transaction.on_commit(
+        lambda: Integration.invalidate_cached(integration_pk))
@@ -1,6 +1,26 @@
+import base64
+import calendar
+import copy
+import datetime
+import hashlib
+import hmac
+import json
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
 
-from .models import Tenant, Integration
+from devices.models import Device, DeviceKind
+from enrollment.models import Enrollment
+from mfa.auth import credential_cache
+from .models import Tenant, Integration, Client, IdempotencyKey
+from .serializers import IntegrationClientAuthDecisionResponseSerializer
+from .tokens import PortalToken, missing_uid_cache, signing_key_cache, sign, \
+    PURPOSE_PORTAL
 
 
 class IntegrationTestCase(TestCase):
@@ -20,3 +40,386 @@ class IntegrationTestCase(TestCase):
 
         self.assertIsNotNone(integration.access_key)
         self.assertIsNotNone(integration.secret_key)
+
+
+class IntegrationAuthenticationTestCase(APITestCase):
+    def setUp(self):
+        credential_cache.clear()
+
+        self.integration = Integration.create(
+            tenant=Tenant.create(
+                name='Test Tenant',
+                email='john.doe@email.com',
+                password='john.doe'),
+            name='Test Integration',
+            notes='Test Notes')
+
+    def _authenticate(self, access_key, secret_key):
+        self.client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(
+            '{0}:{1}'.format(access_key, secret_key)))
+
+    def test_credentials_are_cached(self):
+        self._authenticate(self.integration.access_key,
+                           self.integration.secret_key)
+
+        # integration lookup and device kind listing
+        with self.assertNumQueries(2):
+            res = self.client.get(reverse('device-kind-list'))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        # device kind listing only
+        with self.assertNumQueries(1):
+            res = self.client.get(reverse('device-kind-list'))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_invalid_secret_is_rejected_when_cached(self):
+        self._authenticate(self.integration.access_key,
+                           self.integration.secret_key)
+        self.client.get(reverse('device-kind-list'))
+
+        self._authenticate(self.integration.access_key, 'invalid')
+        with self.assertNumQueries(0):
+            res = self.client.get(reverse('device-kind-list'))
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cached_credentials_are_invalidated_on_save(self):
+        self._authenticate(self.integration.access_key,
+                           self.integration.secret_key)
+        self.client.get(reverse('device-kind-list'))
+
+        self.integration.secret_key = 'rotated'
+        self.integration.save()
+
+        res = self.client.get(reverse('device-kind-list'))
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self._authenticate(self.integration.access_key, 'rotated')
+        res = self.client.get(reverse('device-kind-list'))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_cached_credentials_follow_changes_made_elsewhere(self):
+        self._authenticate(self.integration.access_key,
+                           self.integration.secret_key)
+        self.client.get(reverse('device-kind-list'))
+
+        # rotated by another process, which bumps the version on commit
+        Integration.objects.filter(pk=self.integration.pk).update(
+            secret_key='rotated')
+        Integration.invalidate_cached(self.integration.pk)
+
+        res = self.client.get(reverse('device-kind-list'))
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_tokens_are_issued_without_loading_the_secret_again(self):
+        integration = Integration.objects.defer('secret_key').get(
+            pk=self.integration.pk)
+        expires_at = timezone.now() + datetime.timedelta(minutes=5)
+
+        token = PortalToken.issue(integration, 'challenge', 1, 'john',
+                                  expires_at)
+
+        integration = Integration.objects.defer('secret_key').get(
+            pk=self.integration.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                PortalToken.issue(integration, 'challenge', 1, 'john',
+                                  expires_at), token)
+
+
+class IntegrationClientAuthDecisionTestCase(APITestCase):
+    def setUp(self):
+        self.integration = Integration.create(
+            tenant=Tenant.create(
+                name='Test Tenant',
+                email='john.doe@email.com',
+                password='john.doe'),
+            name='Test Integration',
+            notes='Test Notes')
+
+        self.device_kind = DeviceKind.objects.create(
+            name='Email',
+            module='devices.modules.email.EmailDeviceKindModule',
+            description='Email Devices')
+
+        self.client.force_authenticate(
+            user=self.integration, token=self.integration)
+
+    def create_client(self, username, client_status=Client.STATUS_ACTIVE,
+                      devices=0):
+        client = Client.objects.create(
+            name=username,
+            integration=self.integration,
+            username=username,
+            status=client_status)
+
+        for i in range(devices):
+            Device.objects.create(
+                name='Email [{0}]'.format(i),
+                kind=self.device_kind,
+                client=client,
+                enrollment=Enrollment.objects.create(
+                    integration=self.integration,
+                    policy=self.integration.policy,
+                    username=username,
+                    status=Enrollment.STATUS_COMPLETE,
+                    expires_at=timezone.now()),
+                details={'address': 'john.doe@email.com'})
+
+        return client
+
+    def test_batch_decides_every_username(self):
+        self.create_client('active', devices=2)
+        self.create_client('bypass', client_status=Client.STATUS_BYPASS)
+        self.create_client('inactive', client_status=Client.STATUS_INACTIVE)
+
+        with self.assertNumQueries(2):
+            res = self.client.post(
+                reverse('client-auth-batch'), {
+                    'clients': [
+                        {'username': 'active'},
+                        {'username': 'bypass'},
+                        {'username': 'inactive'},
+                        {'username': 'missing',
+                         'binding_context': {
+                             'client_ip_address': '127.0.0.1'}},
+                    ]
+                },
+                format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        decisions = res.json()['decisions']
+        self.assertEqual(
+            [(x['username'], x['result']) for x in decisions],
+            [('active', IntegrationClientAuthDecisionResponseSerializer.
+              RESULT_CHALLENGE),
+             ('bypass',
+              IntegrationClientAuthDecisionResponseSerializer.RESULT_ALLOW),
+             ('inactive',
+              IntegrationClientAuthDecisionResponseSerializer.RESULT_DENY),
+             ('missing',
+              IntegrationClientAuthDecisionResponseSerializer.RESULT_ENROLL)])
+        self.assertEqual(len(decisions[0]['devices']), 2)
+
+    def test_batch_rejects_empty_requests(self):
+        res = self.client.post(
+            reverse('client-auth-batch'), {'clients': []}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_decision_query_count_is_independent_of_devices(self):
+        self.create_client('one', devices=1)
+        self.create_client('many', devices=10)
+
+        for username, device_count in (('one', 1), ('many', 10)):
+            # client lookup, and devices along with their kinds
+            with self.assertNumQueries(2):
+                res = self.client.post(
+                    reverse('client-auth'), {'username': username},
+                    format='json')
+
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(res.json()['devices']), device_count)
+            self.assertEqual(res.json()['devices'][0]['kind']['name'],
+                             'Email')
+
+
+class PortalTokenTestCase(APITestCase):
+    def setUp(self):
+        self.integration = Integration.create(
+            tenant=Tenant.create(
+                name='Test Tenant',
+                email='john.doe@email.com',
+                password='john.doe'),
+            name='Test Integration',
+            notes='Test Notes')
+
+        self.addCleanup(signing_key_cache.clear)
+        self.addCleanup(missing_uid_cache.clear)
+
+    def issue(self, minutes=5):
+        return PortalToken.issue(
+            self.integration, 'challenge', 42, 'john.doe',
+            timezone.now() + datetime.timedelta(minutes=minutes))
+
+    def test_verify_token(self):
+        token, err = PortalToken.verify(self.issue())
+
+        self.assertIsNone(err)
+        self.assertEqual((token.uid, token.kind, token.pk, token.username),
+                         (self.integration.uid, 'challenge', 42, 'john.doe'))
+
+        # the signing key is cached once known
+        with self.assertNumQueries(0):
+            _, err = PortalToken.verify(self.issue())
+        self.assertIsNone(err)
+
+    def test_reject_tampered_or_expired_tokens(self):
+        uid, claims, signature = self.issue().split('.')
+        other = PortalToken.issue(
+            self.integration, 'challenge', 43, 'john.doe',
+            timezone.now() + datetime.timedelta(minutes=5)).split('.')[1]
+
+        for token in ('', 'a.b.c', '.'.join((uid, other, signature)),
+                      '.'.join((uid, claims, signature[:-1])),
+                      self.issue(minutes=-1)):
+            _, err = PortalToken.verify(token)
+            self.assertIsNotNone(err)
+
+    def test_far_future_tokens_are_rejected_without_lookup(self):
+        token = sign(self.integration, PURPOSE_PORTAL,
+                     ['challenge', 42, 'john.doe'],
+                     timezone.now() + datetime.timedelta(days=365))
+
+        with self.assertNumQueries(0):
+            _, err = PortalToken.verify(token)
+        self.assertIsNotNone(err)
+
+        # issued tokens are capped to the same lifetime
+        token, err = PortalToken.verify(self.issue(minutes=60 * 24 * 365))
+        self.assertIsNone(err)
+        self.assertLessEqual(token.expires_at,
+                             timezone.now() + datetime.timedelta(hours=24))
+
+    def test_unknown_uids_are_cached_apart(self):
+        _, claims, signature = self.issue().split('.')
+        token = '.'.join(('0badc0de', claims, signature))
+
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(PortalToken.verify(token)[1])
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(PortalToken.verify(token)[1])
+
+        self.assertEqual(len(signing_key_cache), 0)
+
+        with self.assertNumQueries(0):
+            _, err = PortalToken.verify('{0}!.{1}.{2}'.format(
+                self.integration.uid, claims, signature))
+        self.assertIsNotNone(err)
+
+    def test_tokens_issued_before_trusted_devices_verify(self):
+        # portal tokens as first issued, signed with a key derived with the
+        # `tenants.tokens.portal` salt alone
+        expires_at = timezone.now() + datetime.timedelta(minutes=5)
+        claims = base64.urlsafe_b64encode(
+            json.dumps(['challenge', 42, 'john.doe',
+                        calendar.timegm(expires_at.utctimetuple())],
+                       separators=(',', ':'))).rstrip(b'=')
+        message = '{0}.{1}'.format(self.integration.uid, claims)
+        key = hmac.new(self.integration.secret_key.encode('utf-8'),
+                       b'tenants.tokens.portal', hashlib.sha256).digest()
+        signature = base64.urlsafe_b64encode(
+            hmac.new(key, message.encode('utf-8'),
+                     hashlib.sha256).digest()).rstrip(b'=')
+
+        token, err = PortalToken.verify('{0}.{1}'.format(message, signature))
+
+        self.assertIsNone(err)
+        self.assertEqual(token.pk, 42)
+
+    def test_rotated_secret_invalidates_tokens(self):
+        token = self.issue()
+        self.assertIsNone(PortalToken.verify(token)[1])
+
+        self.integration.secret_key = 'rotated'
+        self.integration.save()
+
+        self.assertIsNotNone(PortalToken.verify(token)[1])
+
+    def test_enrollment_portal_url_carries_token(self):
+        enrollment, _ = self.integration.enroll('john.doe')
+        token = enrollment.portal_url.split('?token=')[1]
+
+        res = self.client.post(reverse('portal-token-verify'),
+                               {'token': token})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['kind'], 'enrollment')
+        self.assertEqual(res.data['pk'], enrollment.pk)
+
+        res = self.client.post(reverse('portal-token-verify'),
+                               {'token': token + 'x'})
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_portal_url_is_inserted_along_with_its_entity(self):
+        with CaptureQueriesContext(connection) as queries:
+            enrollment, _ = self.integration.enroll('john.doe')
+
+        self.assertFalse(
+            [x for x in queries if x['sql'].startswith('UPDATE')])
+
+        token, _ = PortalToken.verify(enrollment.portal_url.split('?token=')[1])
+        self.assertEqual(token.pk, enrollment.pk)
+
+
+class IdempotencyKeyTestCase(APITestCase):
+    def setUp(self):
+        self.integration = Integration.create(
+            tenant=Tenant.create(
+                name='Test Tenant',
+                email='john.doe@email.com',
+                password='john.doe'),
+            name='Test Integration',
+            notes='Test Notes')
+
+        self.client.force_authenticate(
+            user=self.integration, token=self.integration)
+
+    def enroll(self, username, key='key'):
+        return self.client.post(
+            reverse('enrollment-list'), {'username': username},
+            format='json',
+            HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_response(self):
+        res = self.enroll('john.doe')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        retry = self.enroll('john.doe')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['pk'], res.data['pk'])
+        self.assertEqual(Enrollment.objects.count(), 1)
+
+        # keys are scoped to the request they were first used for
+        res = self.enroll('jane.doe')
+        self.assertEqual(res.status_code,
+                         status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_failed_request_is_not_stored(self):
+        Client.objects.create(
+            name='john.doe', integration=self.integration,
+            username='john.doe')
+
+        res = self.enroll('john.doe')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_expired_keys_are_swept(self):
+        self.enroll('john.doe')
+        IdempotencyKey.objects.update(
+            expires_at=timezone.now() - datetime.timedelta(minutes=1))
+
+        self.assertEqual(IdempotencyKey.expire_stale(10), 1)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_expired_key_is_claimed_once(self):
+        self.enroll('john.doe')
+        IdempotencyKey.objects.update(
+            expires_at=timezone.now() - datetime.timedelta(minutes=1))
+
+        # concurrent retries both find the key as it was before either
+        # claimed it
+        stale = IdempotencyKey.objects.get()
+        IdempotencyKey.objects.get_or_create = \
+            lambda **kwargs: (copy.copy(stale), False)
+        self.addCleanup(delattr, IdempotencyKey.objects, 'get_or_create')
+
+        expires_at = timezone.now() + datetime.timedelta(hours=1)
+        claims = [
+            IdempotencyKey.claim(self.integration, 'key',
+                                 stale.request_digest, expires_at)[1]
+            for _ in range(2)
+        ]
+
+        self.assertEqual(claims, [True, False])
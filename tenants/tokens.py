@@ -0,0 +1,248 @@
+"""
+Compact, stateless tokens signed on behalf of integrations.
+
+A token reads `<integration uid>.<claims>.<signature>`, where the claims end
+with the token's expiration, and the signature is an HMAC-SHA256 of both,
+keyed by a key derived from the integration's secret key with a salt of its
+own per purpose, so that a token issued for one purpose never verifies for
+another.
+
+Portal tokens carry the kind, pk and username of the enrollment or challenge
+they were issued for. Trusted device tokens carry the client they were issued
+to, and a digest of the browser fingerprint that client completed a
+challenge from.
+"""
+from __future__ import unicode_literals
+
+import base64
+import binascii
+import calendar
+import hashlib
+import hmac
+import json
+import numbers
+import re
+import time
+from datetime import datetime, timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.encoding import force_bytes
+
+from core import errors
+from core.cache import BoundedTTLCache
+
+# purposes are the salts their signing keys are derived with; the portal
+# salt predates the other purposes, and must not change
+PURPOSE_PORTAL = b'tenants.tokens.portal'
+PURPOSE_TRUSTED_DEVICE = b'tenants.tokens.trusted-device'
+
+PURPOSES = (PURPOSE_PORTAL, PURPOSE_TRUSTED_DEVICE)
+
+# uids are generated as hex, and signatures are unpadded base64 of a sha256
+UID_PATTERN = re.compile(r'^[0-9a-zA-Z]{1,16}$')
+SIGNATURE_PATTERN = re.compile(r'^[0-9a-zA-Z_-]{43}$')
+
+# integration uid -> signing keys, by purpose, of the integrations with that
+# uid
+signing_key_cache = BoundedTTLCache(
+    max_size=settings.MFA_PORTAL_TOKEN_KEY_CACHE_SIZE,
+    ttl=settings.MFA_PORTAL_TOKEN_KEY_CACHE_TTL)
+
+# integration pk -> version of the integration, and its signing keys by
+# purpose, so that issuing tokens neither loads nor decrypts its secret key
+issuing_key_cache = BoundedTTLCache(
+    max_size=settings.MFA_PORTAL_TOKEN_KEY_CACHE_SIZE,
+    ttl=settings.MFA_PORTAL_TOKEN_KEY_CACHE_TTL)
+
+# uids no integration has, kept apart so that looking up made-up uids cannot
+# evict the keys of actual integrations
+missing_uid_cache = BoundedTTLCache(
+    max_size=settings.MFA_PORTAL_TOKEN_KEY_CACHE_SIZE,
+    ttl=settings.MFA_PORTAL_TOKEN_KEY_CACHE_TTL)
+
+
+def _encode(value):
+    return base64.urlsafe_b64encode(value).rstrip(b'=').decode('ascii')
+
+
+def _decode(value):
+    value = force_bytes(value)
+    return base64.urlsafe_b64decode(value + b'=' * (-len(value) % 4))
+
+
+def _sign(key, message):
+    return _encode(hmac.new(key, force_bytes(message), hashlib.sha256).digest())
+
+
+def derive_signing_key(secret_key, purpose):
+    return hmac.new(force_bytes(secret_key), purpose, hashlib.sha256).digest()
+
+
+def derive_signing_keys(secret_key):
+    return dict((x, derive_signing_key(secret_key, x)) for x in PURPOSES)
+
+
+def get_signing_keys(uid):
+    keys = signing_key_cache.get(uid)
+    if keys is None:
+        if missing_uid_cache.get(uid):
+            return []
+
+        Integration = apps.get_model('tenants', 'Integration')
+        keys = [
+            derive_signing_keys(x)
+            for x in Integration.objects.filter(uid=uid).values_list(
+                'secret_key', flat=True)
+        ]
+
+        if keys:
+            signing_key_cache.set(uid, keys)
+        else:
+            missing_uid_cache.set(uid, True)
+
+    return keys
+
+
+def get_issuing_keys(integration):
+    Integration = apps.get_model('tenants', 'Integration')
+    version = Integration.get_cache_version(integration.pk)
+
+    entry = issuing_key_cache.get(integration.pk)
+    if entry is None or entry[0] != version:
+        entry = (version, derive_signing_keys(integration.secret_key))
+        issuing_key_cache.set(integration.pk, entry)
+
+    return entry[1]
+
+
+def invalidate_signing_keys(integration):
+    signing_key_cache.delete(integration.uid)
+    missing_uid_cache.delete(integration.uid)
+    issuing_key_cache.delete(integration.pk)
+
+
+def sign(integration, purpose, claims, expires_at, max_lifetime=None):
+    # tokens outliving `max_lifetime` would never verify
+    if max_lifetime is not None:
+        expires_at = min(expires_at, timezone.now() + max_lifetime)
+
+    claims = _encode(
+        json.dumps(
+            list(claims) + [calendar.timegm(expires_at.utctimetuple())],
+            separators=(',', ':')).encode('utf-8'))
+
+    message = '{0}.{1}'.format(integration.uid, claims)
+    return '{0}.{1}'.format(
+        message, _sign(get_issuing_keys(integration)[purpose], message))
+
+
+def unsign(token, purpose, name, max_lifetime=None):
+    """
+    Returns the uid, claims and expiration of the token, once the token is
+    known to be well formed, unexpired and signed by its integration for
+    `purpose`, in that order. Signing keys are only looked up for tokens
+    that pass every other check, as anyone may present a token.
+    """
+    invalid = errors.MFASecurityError('invalid {0}'.format(name))
+
+    try:
+        uid, claims, signature = token.split('.')
+        if not UID_PATTERN.match(uid) or \
+                not SIGNATURE_PATTERN.match(signature):
+            return None, invalid
+
+        values = json.loads(_decode(claims).decode('utf-8'))
+        values, expires_at = values[:-1], values[-1]
+    except (ValueError, TypeError, IndexError, KeyError, binascii.Error):
+        return None, invalid
+
+    if not isinstance(expires_at, numbers.Integral) or \
+            expires_at <= time.time():
+        return None, errors.MFASecurityError('expired {0}'.format(name))
+
+    # no token is issued for longer than `max_lifetime`
+    if max_lifetime is not None and \
+            expires_at > time.time() + max_lifetime.total_seconds():
+        return None, invalid
+
+    message = '{0}.{1}'.format(uid, claims)
+    if not any(
+            constant_time_compare(_sign(keys[purpose], message), signature)
+            for keys in get_signing_keys(uid)):
+        return None, invalid
+
+    return (uid, values, datetime.fromtimestamp(expires_at,
+                                                timezone.utc)), None
+
+
+class PortalToken(object):
+    def __init__(self, uid, kind, pk, username, expires_at):
+        self.uid = uid
+        self.kind = kind
+        self.pk = pk
+        self.username = username
+        self.expires_at = expires_at
+
+    @staticmethod
+    def get_max_lifetime():
+        return timedelta(hours=settings.MFA_PORTAL_TOKEN_MAX_LIFETIME_HOURS)
+
+    @staticmethod
+    def issue(integration, kind, pk, username, expires_at):
+        return sign(integration, PURPOSE_PORTAL, [kind, pk, username],
+                    expires_at, PortalToken.get_max_lifetime())
+
+    @staticmethod
+    def verify(token):
+        res, err = unsign(token, PURPOSE_PORTAL, 'portal token',
+                          PortalToken.get_max_lifetime())
+        if err:
+            return None, err
+
+        uid, claims, expires_at = res
+        try:
+            kind, pk, username = claims
+        except ValueError:
+            return None, errors.MFASecurityError('invalid portal token')
+
+        return PortalToken(uid, kind, pk, username, expires_at), None
+
+
+class TrustedDeviceToken(object):
+    """
+    Proof that a client completed a challenge from a given browser, which
+    exempts it from further challenges from that browser until it expires.
+    """
+
+    @staticmethod
+    def get_fingerprint_digest(fingerprint):
+        return _encode(hashlib.sha256(force_bytes(fingerprint)).digest()[:16])
+
+    @staticmethod
+    def issue(integration, client_pk, fingerprint, expires_at):
+        return sign(integration, PURPOSE_TRUSTED_DEVICE, [
+            client_pk, TrustedDeviceToken.get_fingerprint_digest(fingerprint)
+        ], expires_at)
+
+    @staticmethod
+    def verify(token, integration, client_pk, fingerprint):
+        """
+        Returns whether the token was issued by `integration` to the client
+        with `client_pk`, for the browser with `fingerprint`.
+        """
+        res, err = unsign(token, PURPOSE_TRUSTED_DEVICE, 'trusted device token')
+        if err:
+            return False, err
+
+        uid, claims, _ = res
+        if uid != integration.uid or claims != [
+                client_pk,
+                TrustedDeviceToken.get_fingerprint_digest(fingerprint)
+        ]:
+            return False, errors.MFASecurityError(
+                'trusted device token was not issued for this client')
+
+        return True, None
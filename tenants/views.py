@@ -9,14 +9,18 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from mfa.routers import ReplicaReadMixin
 from .models import Client, Integration, Tenant, TenantUser
+from .tokens import PortalToken, TrustedDeviceToken
 from .serializers import IntegrationClientAuthDecisionSerializer, IntegrationClientAuthDecisionResponseSerializer, \
-    CreateTenantSerializer, TenantSerializer, CreateIntegrationSerializer, IntegrationSerializer
+    CreateTenantSerializer, TenantSerializer, CreateIntegrationSerializer, IntegrationSerializer, \
+    IntegrationClientAuthDecisionBatchSerializer, IntegrationClientAuthDecisionBatchResponseSerializer, \
+    PortalTokenVerificationSerializer, PortalTokenSerializer
 
 logger = logging.getLogger(__name__)
 
 
-class TenantIntegrationListView(APIView):
+class TenantIntegrationListView(ReplicaReadMixin, APIView):
     authentication_classes = (BasicAuthentication, )
     permission_classes = (IsAuthenticated, )
 
@@ -74,6 +78,82 @@ class TenantsListView(APIView):
         return Response(res.data, status=status.HTTP_201_CREATED)
 
 
+class PortalTokenVerification(APIView):
+    # portal tokens are verified without credentials, or database queries
+    # once the integration's signing key is cached
+    authentication_classes = ()
+    permission_classes = ()
+
+    def post(self, request, format=None):
+        serializer = PortalTokenVerificationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        token, err = PortalToken.verify(serializer.validated_data['token'])
+        if err:
+            return Response(err.message, status=status.HTTP_403_FORBIDDEN)
+
+        return Response(
+            PortalTokenSerializer(token).data, status=status.HTTP_200_OK)
+
+
+def get_auth_decision(integration, client, username, binding_context=None):
+    # if we don't have a client, send an enrollment signal
+    if not client:
+        logger.info(
+            'auth informs that username `{0}` is not present; must enroll'.
+            format(username))
+
+        return {
+            'result':
+            IntegrationClientAuthDecisionResponseSerializer.RESULT_ENROLL
+        }
+
+    # if we have a client in a status different than active, handle it here
+    if client.status != Client.STATUS_ACTIVE:
+        logger.info(
+            'auth informs that username `{0}` is not to undergo 2fa; status is `{1}`'.
+            format(username, client.get_status_display()))
+
+        return {
+            'result':
+            IntegrationClientAuthDecisionResponseSerializer.RESULT_ALLOW
+            if client.status == Client.STATUS_BYPASS else
+            IntegrationClientAuthDecisionResponseSerializer.RESULT_DENY
+        }
+
+    # a client that completed a challenge from this browser is trusted until
+    # the token it was issued expires
+    token = (binding_context or {}).get('trusted_device_token')
+    if token:
+        trusted, err = TrustedDeviceToken.verify(
+            token, integration, client.pk,
+            binding_context.get('client_browser_fingerprint') or '')
+        if trusted:
+            logger.info(
+                'auth informs that username `{0}` is on a trusted device'.
+                format(username))
+
+            return {
+                'result':
+                IntegrationClientAuthDecisionResponseSerializer.RESULT_ALLOW
+            }
+
+        logger.warning(
+            'ignoring trusted device token for username `{0}`: {1}'.format(
+                username, err.message))
+
+    # we have a client, and it is neither exempt or or denied, so must go
+    # through 2nd factor
+    return {
+        'result':
+        IntegrationClientAuthDecisionResponseSerializer.RESULT_CHALLENGE,
+        'devices':
+        client.devices.all()
+    }
+
+
 class IntegrationClientAuthDecision(APIView):
     def post(self, request, format=None):
         serializer = IntegrationClientAuthDecisionSerializer(data=request.data)
@@ -90,43 +170,51 @@ class IntegrationClientAuthDecision(APIView):
             data['username']))
 
         # attempt to obtain a client with the given username
-        client = Client.objects.filter(
-            username=data['username'], integration=request.auth).first()
+        client = Client.get_with_devices(request.auth).filter(
+            username=data['username']).first()
 
-        # if we don't have a client, send an enrollment signal
-        if not client:
-            logger.info(
-                'auth informs that username `{0}` is not present; must enroll'.
-                format(data['username']))
+        res = IntegrationClientAuthDecisionResponseSerializer(
+            get_auth_decision(request.auth, client, data['username'],
+                              data.get('binding_context')))
 
-            res = IntegrationClientAuthDecisionResponseSerializer({
-                'result':
-                IntegrationClientAuthDecisionResponseSerializer.RESULT_ENROLL
-            })
+        return Response(res.data, status=status.HTTP_200_OK)
 
-            return Response(res.data, status=status.HTTP_200_OK)
 
-        # if we have a client in a status different than active, handle it here
-        if client.status != Client.STATUS_ACTIVE:
-            logger.info(
-                'auth informs that username `{0}` is not to undergo 2fa; status is `{1}`'.
-                format(data['username'], client.get_status_display()))
-            res = IntegrationClientAuthDecisionResponseSerializer({
-                'result':
-                IntegrationClientAuthDecisionResponseSerializer.RESULT_ALLOW
-                if client.status == Client.STATUS_BYPASS else
-                IntegrationClientAuthDecisionResponseSerializer.RESULT_DENY
-            })
+class IntegrationClientAuthDecisionBatch(APIView):
+    def post(self, request, format=None):
+        serializer = IntegrationClientAuthDecisionBatchSerializer(
+            data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-            return Response(res.data, status=status.HTTP_200_OK)
+        assert request.auth is not None
+        assert isinstance(request.auth, Integration)
 
-        # we have a client, and it is neither exempt or or denied, so must go
-        # through 2nd factor
-        res = IntegrationClientAuthDecisionResponseSerializer({
-            'result':
-            IntegrationClientAuthDecisionResponseSerializer.RESULT_CHALLENGE,
-            'devices':
-            client.devices.all()
+        entries = serializer.validated_data['clients']
+        usernames = set(x['username'] for x in entries)
+
+        logger.info('processing batch auth decision for `{0}` usernames'.
+                    format(len(usernames)))
+
+        # resolve every client, and their devices, in a fixed number of
+        # queries regardless of the batch size
+        clients = dict(
+            (x.username, x)
+            for x in Client.get_with_devices(request.auth).filter(
+                username__in=usernames))
+
+        decisions = []
+        for entry in entries:
+            decision = get_auth_decision(
+                request.auth,
+                clients.get(entry['username']), entry['username'],
+                entry.get('binding_context'))
+            decision['username'] = entry['username']
+            decisions.append(decision)
+
+        res = IntegrationClientAuthDecisionBatchResponseSerializer({
+            'decisions': decisions
         })
 
         return Response(res.data, status=status.HTTP_200_OK)